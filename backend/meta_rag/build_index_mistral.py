@@ -18,16 +18,24 @@ from collections import defaultdict
 
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
 from sklearn.feature_extraction.text import TfidfVectorizer
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Import modules from notebook (using relative imports)
 from .core.parser import parse_directory
 from .components.chunking import chunk_blocks  # Cell 8 - Hybrid chunking
-from .core.metadata_mistral import MistralMetadataExtractor  # Mistral metadata extraction
-from .components.gear_triples import extract_triples_from_text  # Cell 59 - GPT-4o-mini
+from .core.metadata_mistral import MetadataExtractor  # Mistral metadata extraction
+from .core.metadata_local import LocalMetadataExtractor
+from .components.gear_triples import extract_triples_batch  # Cell 59 - GPT-4o-mini
+from .components.faiss_index import INDEX_TYPES, build_index
+from .components.embedder import EMBEDDING_BACKENDS, load_embedding_model
+from .components.rate_limiter import MISTRAL_RATE_TIERS
 
 
 class IndexBuilderV2:
@@ -42,7 +50,10 @@ class IndexBuilderV2:
         openai_api_key: Optional[str] = None,
         use_metadata_extraction: bool = True,
         use_tfidf_augmentation: bool = True,
-        use_gear: bool = False  # Requires OpenAI key
+        use_gear: bool = False,  # Requires OpenAI key
+        index_type: str = "sq8",
+        embedding_backend: str = "torch",
+        local_metadata: bool = False
     ):
         """
         Initialize the index builder.
@@ -56,6 +67,10 @@ class IndexBuilderV2:
             use_metadata_extraction: Whether to extract metadata with Mistral
             use_tfidf_augmentation: Whether to augment embeddings with TF-IDF keywords
             use_gear: Whether to extract triples for GEAR (requires OpenAI key)
+            index_type: FAISS index type, one of INDEX_TYPES ("sq8", "flat", "hnsw", "ivfpq")
+            embedding_backend: "torch", "onnx" or "onnx-int8" (ONNX Runtime inference)
+            local_metadata: Try local NER/summarization models first and only
+                call Mistral for chunks they are not confident about
         """
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
@@ -63,20 +78,27 @@ class IndexBuilderV2:
         self.use_metadata_extraction = use_metadata_extraction
         self.use_tfidf_augmentation = use_tfidf_augmentation
         self.use_gear = use_gear
+        self.index_type = index_type
+        self.embedding_backend = embedding_backend
 
         # Create output directory
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
         # Load embedding model
         print(f"📦 Loading embedding model: {embedding_model_name}")
-        self.embedding_model = SentenceTransformer(embedding_model_name)
+        # fp16 only takes effect on CUDA, where MiniLM embeddings are unaffected in practice
+        self.embedding_model = load_embedding_model(embedding_model_name, embedding_backend, fp16=True)
 
         # Initialize metadata extractor if requested
         self.metadata_extractor = None
         if use_metadata_extraction:
             if mistral_api_key:
                 print("🔑 Initializing Mistral metadata extractor")
-                self.metadata_extractor = MetadataExtractor(api_key=mistral_api_key)
+                local_extractor = None
+                if local_metadata:
+                    print("🖥️  Loading local metadata models")
+                    local_extractor = LocalMetadataExtractor()
+                self.metadata_extractor = MetadataExtractor(api_key=mistral_api_key, local_extractor=local_extractor)
             else:
                 print("⚠️  No Mistral API key provided, skipping metadata extraction")
 
@@ -104,6 +126,10 @@ class IndexBuilderV2:
         """
         Chunk documents using notebook's hybrid strategy (Cell 8).
 
+        Each document's blocks are popped from documents_blocks once it has been
+        chunked, so parsed blocks are released as chunking proceeds (the dict is
+        empty afterwards).
+
         Args:
             documents_blocks: Dictionary mapping doc names to lists of blocks
             max_size: Maximum chunk size in characters (default: 3000)
@@ -114,15 +140,22 @@ class IndexBuilderV2:
         """
         print(f"\n✂️  Chunking documents using Hybrid strategy (max_size={max_size}, overlap={overlap})")
         all_chunks = []
+        num_documents = len(documents_blocks)
 
-        for doc_name, blocks in tqdm(documents_blocks.items(), desc="Chunking documents"):
-            chunks = chunk_blocks(doc_name, blocks, max_size=max_size, overlap=overlap)
-            all_chunks.extend(chunks)
+        for doc_name in tqdm(list(documents_blocks), desc="Chunking documents"):
+            blocks = documents_blocks.pop(doc_name)
+            all_chunks.extend(chunk_blocks(doc_name, blocks, max_size=max_size, overlap=overlap))
 
-        print(f"✅ Generated {len(all_chunks)} chunks from {len(documents_blocks)} documents")
+        print(f"✅ Generated {len(all_chunks)} chunks from {num_documents} documents")
         return all_chunks
 
-    def enrich_with_metadata(self, chunks: List[Dict], delay: float = 1.0) -> List[Dict]:
+    def enrich_with_metadata(
+        self,
+        chunks: List[Dict],
+        max_concurrency: int = 8,
+        rate_tier: Optional[str] = None,
+        chunks_per_request: int = 1
+    ) -> List[Dict]:
         """Enrich chunks with Mistral metadata extraction."""
         if not self.metadata_extractor:
             print("⚠️  Skipping metadata extraction (no API key)")
@@ -132,9 +165,11 @@ class IndexBuilderV2:
         print("⏱️  This may take a while...")
         enriched_chunks = self.metadata_extractor.enrich_chunks(
             chunks,
-            delay=delay,
+            max_concurrency=max_concurrency,
             batch_size=10,
-            verbose=True
+            verbose=True,
+            rate_tier=rate_tier,
+            chunks_per_request=chunks_per_request
         )
         return enriched_chunks
 
@@ -155,34 +190,41 @@ class IndexBuilderV2:
 
         print(f"\n🔤 Preparing 3 text variants for {len(chunks)} chunks")
 
-        # Extract base text from each chunk
+        # Pull the needed fields out of the chunk dicts once, as flat columns
         corpus_texts = [chunk["text"] for chunk in chunks]
+        summaries = [chunk.get("summary", "") for chunk in chunks]
 
-        # Initialize text variants
-        texts_content = []
-        texts_tfidf = []
-        texts_prefix = []
+        # 1. Content-only (baseline)
+        texts_content = corpus_texts
+
+        # 3. Prefix-fusion: summary + content
+        texts_prefix = [
+            f"SUMMARY: {summary}\n{content}" if summary else content
+            for content, summary in zip(corpus_texts, summaries)
+        ]
 
         # Compute TF-IDF top keywords across all chunks
-        vectorizer = TfidfVectorizer(max_features=50, stop_words='english')
+        # float32 halves the sparse matrix; only the weight ordering is used
+        vectorizer = TfidfVectorizer(max_features=50, stop_words='english', dtype=np.float32)
         X = vectorizer.fit_transform(corpus_texts)
         feature_names = vectorizer.get_feature_names_out()
+        # Read the CSR arrays directly instead of materializing a row matrix per chunk
+        indptr, indices, data = X.indptr, X.indices, X.data
 
-        # Prepare all 3 variants
-        for i, chunk in enumerate(tqdm(chunks, desc="Preparing text variants")):
-            content = chunk["text"]
-
-            # 1. Content-only (baseline)
-            texts_content.append(content)
-
-            # 2. TF-IDF weighted keywords
-            row = X.getrow(i)
+        # 2. TF-IDF weighted keywords
+        texts_tfidf = []
+        for i, content in enumerate(tqdm(corpus_texts, desc="Preparing text variants")):
+            start, end = indptr[i], indptr[i + 1]
             top_terms = []
-            if row.getnnz() > 0:
-                nz_indices = row.indices
-                nz_weights = row.data
-                sorted_idx = np.argsort(nz_weights)[::-1]
-                top_terms = [feature_names[nz_indices[idx]] for idx in sorted_idx[:5]]
+            if end > start:
+                nz_indices = indices[start:end]
+                nz_weights = data[start:end]
+                # Partial sort: only the top 5 weights need ordering
+                top_idx = np.arange(end - start)
+                if end - start > 5:
+                    top_idx = np.argpartition(-nz_weights, 5)[:5]
+                top_idx = top_idx[np.argsort(nz_weights[top_idx])[::-1]]
+                top_terms = list(feature_names[nz_indices[top_idx]])
 
             weighted_text = content
             if top_terms:
@@ -193,11 +235,6 @@ class IndexBuilderV2:
                 weighted_text = content + "\nKEYWORDS: " + " ".join(augmented_terms)
             texts_tfidf.append(weighted_text)
 
-            # 3. Prefix-fusion: summary + content
-            summary = chunk.get("summary", "")
-            prefix_text = f"SUMMARY: {summary}\n{content}" if summary else content
-            texts_prefix.append(prefix_text)
-
         print(f"✅ Prepared 3 text variants:")
         print(f"   - texts_content: {len(texts_content)} items")
         print(f"   - texts_tfidf: {len(texts_tfidf)} items")
@@ -205,10 +242,14 @@ class IndexBuilderV2:
 
         return texts_content, texts_tfidf, texts_prefix
 
-    def extract_gear_triples(self, chunks: List[Dict]) -> List[Dict]:
+    def extract_gear_triples(self, chunks: List[Dict], max_concurrency: int = 16) -> List[Dict]:
         """
         Extract knowledge graph triples using GPT-4o-mini (Cell 59).
 
+        Args:
+            chunks: List of chunk dictionaries
+            max_concurrency: Maximum number of in-flight OpenAI requests
+
         Returns:
             List of triples with chunk_id: [(subject, predicate, object, chunk_id), ...]
         """
@@ -219,10 +260,14 @@ class IndexBuilderV2:
         print(f"\n🕸️  Extracting knowledge graph triples with GPT-4o-mini")
         all_triples = []
 
-        for i, chunk in enumerate(tqdm(chunks, desc="GEAR triple extraction")):
-            text = chunk["text"]
-            triples_list = extract_triples_from_text(text, query=None, model="gpt-4o-mini")
+        # Requests run concurrently; results stay aligned with chunk order
+        triples_per_chunk = extract_triples_batch(
+            [chunk["text"] for chunk in chunks],
+            model="gpt-4o-mini",
+            max_concurrency=max_concurrency
+        )
 
+        for i, triples_list in enumerate(triples_per_chunk):
             # Convert to tuple format with chunk_id
             for triple_dict in triples_list:
                 triple = (
@@ -243,7 +288,7 @@ class IndexBuilderV2:
         texts_prefix: List[str]
     ) -> tuple:
         """
-        Build 3 FAISS IndexFlatIP indices (notebook Cell 20):
+        Build 3 FAISS inner-product indices (notebook Cell 20):
         1. index_content: Content-only embeddings
         2. index_tfidf: TF-IDF augmented embeddings
         3. index_prefix: Summary-prefixed embeddings
@@ -259,50 +304,31 @@ class IndexBuilderV2:
         """
         print(f"\n🧠 Building 3 FAISS indices")
 
-        # 1. Embed content-only texts
-        print("\n1️⃣  Computing content-only embeddings...")
-        embeddings_content = self.embedding_model.encode(
-            texts_content,
-            batch_size=64,
+        # Embed all 3 variants in a single encode() call so the model runs
+        # full batches across variants; normalize_embeddings=True makes the
+        # vectors unit-length for inner product search (no normalize_L2 pass)
+        n = len(texts_content)
+        print(f"\n🔢 Computing embeddings for {3 * n} texts (content, tfidf, prefix)...")
+        embeddings = self.embedding_model.encode(
+            texts_content + texts_tfidf + texts_prefix,
+            batch_size=256 if self.embedding_model.device.type == "cuda" else 128,
             show_progress_bar=True,
-            convert_to_numpy=True
+            convert_to_numpy=True,
+            normalize_embeddings=True
         )
-        embeddings_content = embeddings_content.astype(np.float32)
-        faiss.normalize_L2(embeddings_content)
-
-        # 2. Embed TF-IDF augmented texts
-        print("\n2️⃣  Computing TF-IDF augmented embeddings...")
-        embeddings_tfidf = self.embedding_model.encode(
-            texts_tfidf,
-            batch_size=64,
-            show_progress_bar=True,
-            convert_to_numpy=True
-        )
-        embeddings_tfidf = embeddings_tfidf.astype(np.float32)
-        faiss.normalize_L2(embeddings_tfidf)
-
-        # 3. Embed prefix-fusion texts
-        print("\n3️⃣  Computing prefix-fusion embeddings...")
-        embeddings_prefix = self.embedding_model.encode(
-            texts_prefix,
-            batch_size=64,
-            show_progress_bar=True,
-            convert_to_numpy=True
-        )
-        embeddings_prefix = embeddings_prefix.astype(np.float32)
-        faiss.normalize_L2(embeddings_prefix)
+
+        # View the result as one contiguous (3, N, d) float32 block and split
+        # it into the per-variant arrays fed to each index
+        embeddings = embeddings.astype(np.float32, copy=False).reshape(3, n, -1)
+        embeddings_content, embeddings_tfidf, embeddings_prefix = embeddings
 
         # Build FAISS indices
         dimension = embeddings_content.shape[1]
-        print(f"\n📊 Building FAISS IndexFlatIP (dimension={dimension})")
-
-        index_content = faiss.IndexFlatIP(dimension)
-        index_tfidf = faiss.IndexFlatIP(dimension)
-        index_prefix = faiss.IndexFlatIP(dimension)
+        print(f"\n📊 Building FAISS {self.index_type} indices (dimension={dimension})")
 
-        index_content.add(embeddings_content)
-        index_tfidf.add(embeddings_tfidf)
-        index_prefix.add(embeddings_prefix)
+        index_content = build_index(embeddings_content, self.index_type)
+        index_tfidf = build_index(embeddings_tfidf, self.index_type)
+        index_prefix = build_index(embeddings_prefix, self.index_type)
 
         print(f"✅ Built 3 FAISS indices:")
         print(f"   - index_content: {index_content.ntotal} vectors")
@@ -341,35 +367,37 @@ class IndexBuilderV2:
         print(f"✅ Saved index_tfidf: {index_tfidf_path}")
         print(f"✅ Saved index_prefix: {index_prefix_path}")
 
-        # Build metadata dictionary
-        metadata = {}
+        # Save raw fp32 embeddings (the indices may be quantized)
+        np.save(self.output_dir / "embeddings_content.npy", embeddings_content)
+        np.save(self.output_dir / "embeddings_tfidf.npy", embeddings_tfidf)
+        np.save(self.output_dir / "embeddings_prefix.npy", embeddings_prefix)
+        print("✅ Saved embeddings: embeddings_content.npy, embeddings_tfidf.npy, embeddings_prefix.npy")
+
+        # Stream metadata as JSON Lines (one chunk per line) instead of
+        # building one big dict and pretty-printing it
         id_to_index = {}
         index_to_id = {}
 
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"chunk_{i}"
-            chunk["chunk_id"] = i
-
-            # Store all 3 embeddings
-            chunk["embedding_content"] = embeddings_content[i].tolist()
-            chunk["embedding_tfidf"] = embeddings_tfidf[i].tolist()
-            chunk["embedding_prefix"] = embeddings_prefix[i].tolist()
-
-            # Add citation info
-            doc_name = os.path.basename(chunk.get("doc", ""))
-            page = chunk.get("page")
-            block_idx = chunk.get("block_index")
-            chunk["doc_name"] = doc_name
-            chunk["citation"] = f"{doc_name} – page {page}, block {block_idx}" if page is not None else doc_name
-
-            metadata[chunk_id] = chunk
-            id_to_index[chunk_id] = i
-            index_to_id[i] = chunk_id
-
-        # Save metadata
-        metadata_path = self.output_dir / "metadata.json"
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        metadata_path = self.output_dir / "metadata.jsonl"
+        with open(metadata_path, 'wb') as f:
+            for i, chunk in enumerate(chunks):
+                chunk_id = f"chunk_{i}"
+                chunk["chunk_id"] = i
+
+                # Add citation info
+                doc_name = os.path.basename(chunk.get("doc", ""))
+                page = chunk.get("page")
+                block_idx = chunk.get("block_index")
+                chunk["doc_name"] = doc_name
+                chunk["citation"] = f"{doc_name} – page {page}, block {block_idx}" if page is not None else doc_name
+
+                if orjson is not None:
+                    f.write(orjson.dumps(chunk, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE))
+                else:
+                    f.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
+
+                id_to_index[chunk_id] = i
+                index_to_id[i] = chunk_id
         print(f"✅ Saved metadata: {metadata_path}")
 
         # Save ID mapping
@@ -378,14 +406,19 @@ class IndexBuilderV2:
             pickle.dump({
                 'id_to_index': id_to_index,
                 'index_to_id': index_to_id
-            }, f)
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
         print(f"✅ Saved ID mapping: {id_mapping_path}")
 
         # Save triples if GEAR was used
         if triples and len(triples) > 0:
             triples_path = self.output_dir / "gear_triples.json"
-            with open(triples_path, 'w', encoding='utf-8') as f:
-                json.dump(triples, f, indent=2, ensure_ascii=False)
+            # Machine-read only, so no pretty-printing
+            if orjson is not None:
+                with open(triples_path, 'wb') as f:
+                    f.write(orjson.dumps(triples))
+            else:
+                with open(triples_path, 'w', encoding='utf-8') as f:
+                    json.dump(triples, f, ensure_ascii=False)
             print(f"✅ Saved GEAR triples: {triples_path}")
 
         # Save index info
@@ -393,6 +426,8 @@ class IndexBuilderV2:
             "model_name": self.embedding_model_name,
             "num_chunks": len(chunks),
             "dimension": embeddings_content.shape[1],
+            "index_type": self.index_type,
+            "embedding_backend": self.embedding_backend,
             "has_metadata_extraction": self.metadata_extractor is not None,
             "has_three_indices": True,
             "has_gear": self.use_gear and triples and len(triples) > 0,
@@ -408,7 +443,9 @@ class IndexBuilderV2:
         max_size: int = 3000,
         overlap: int = 200,
         extract_metadata: bool = True,
-        metadata_delay: float = 1.0,
+        metadata_concurrency: int = 8,
+        metadata_rate_tier: Optional[str] = None,
+        metadata_chunks_per_request: int = 1,
         extensions: Optional[List[str]] = None
     ):
         """
@@ -418,7 +455,10 @@ class IndexBuilderV2:
             max_size: Maximum chunk size in characters (default: 3000)
             overlap: Character overlap between chunks (default: 200)
             extract_metadata: Whether to extract metadata
-            metadata_delay: Delay between metadata API calls (default: 1.0s)
+            metadata_concurrency: Max concurrent metadata API calls (default: 8)
+            metadata_rate_tier: Mistral quota tier used to pace metadata calls
+                (default: None = unpaced; 429s are retried with backoff)
+            metadata_chunks_per_request: Chunks sent per metadata request (default: 1)
             extensions: List of file extensions to parse (default: None = all)
         """
         print("=" * 60)
@@ -437,7 +477,12 @@ class IndexBuilderV2:
 
         # Step 3: Enrich with metadata (Mistral)
         if extract_metadata:
-            chunks = self.enrich_with_metadata(chunks, delay=metadata_delay)
+            chunks = self.enrich_with_metadata(
+                chunks,
+                max_concurrency=metadata_concurrency,
+                rate_tier=metadata_rate_tier,
+                chunks_per_request=metadata_chunks_per_request
+            )
 
         # Step 4: Prepare 3 text variants (content, tfidf, prefix)
         texts_content, texts_tfidf, texts_prefix = self.prepare_three_text_variants(chunks)
@@ -450,6 +495,8 @@ class IndexBuilderV2:
          embeddings_content, embeddings_tfidf, embeddings_prefix) = self.build_three_faiss_indices(
             texts_content, texts_tfidf, texts_prefix
         )
+        # The augmented texts are only needed for encoding; free them before saving
+        del texts_content, texts_tfidf, texts_prefix
 
         # Step 7: Save everything
         self.save_three_indices(
@@ -480,7 +527,16 @@ def main():
     parser.add_argument("--no-metadata", action="store_true", help="Skip metadata extraction")
     parser.add_argument("--no-tfidf", action="store_true", help="Skip TF-IDF augmentation")
     parser.add_argument("--enable-gear", action="store_true", help="Enable GEAR triple extraction")
-    parser.add_argument("--metadata-delay", type=float, default=1.0, help="Delay between API calls")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="sq8", help="FAISS index type")
+    parser.add_argument("--embedding-backend", choices=EMBEDDING_BACKENDS, default="torch",
+                        help="Embedding inference backend (onnx/onnx-int8 use ONNX Runtime)")
+    parser.add_argument("--local-metadata", action="store_true",
+                        help="Extract metadata with local models first, Mistral only as fallback")
+    parser.add_argument("--metadata-concurrency", type=int, default=8, help="Max concurrent metadata API calls")
+    parser.add_argument("--metadata-tier", choices=tuple(MISTRAL_RATE_TIERS), default=None,
+                        help="Mistral quota tier; paces metadata calls to its RPM/TPM limits (default: unpaced)")
+    parser.add_argument("--metadata-chunks-per-request", type=int, default=1,
+                        help="Chunks extracted per metadata API request (>1 shares the instructions across chunks)")
     args = parser.parse_args()
 
     # Load environment variables
@@ -497,14 +553,19 @@ def main():
         openai_api_key=openai_key,
         use_metadata_extraction=not args.no_metadata,
         use_tfidf_augmentation=not args.no_tfidf,
-        use_gear=args.enable_gear
+        use_gear=args.enable_gear,
+        index_type=args.index_type,
+        embedding_backend=args.embedding_backend,
+        local_metadata=args.local_metadata
     )
 
     builder.build(
         max_size=args.max_size,
         overlap=args.overlap,
         extract_metadata=not args.no_metadata,
-        metadata_delay=args.metadata_delay
+        metadata_concurrency=args.metadata_concurrency,
+        metadata_rate_tier=args.metadata_tier,
+        metadata_chunks_per_request=args.metadata_chunks_per_request
     )
 
 
@@ -3,11 +3,60 @@ Answer Generation with Citations - Extracted from META notebook
 Uses Mistral for generating final answers with source citations
 """
 
+# Precomputed (doc_name, page_part, cat_part, src) per chunk, indexed like
+# all_chunks; set via build_citation_records() when chunks are loaded
+citation_records = None
+
+
+def _citation_record(ch):
+    """Resolve the display fields used in the 'Sources' block for one chunk."""
+    # Try several common metadata keys (adjust to your schema)
+    doc_name = (
+        ch.get("doc_name")
+        or ch.get("title")
+        or ch.get("doc_title")
+        or ch.get("file_name")
+        or "Unknown document"
+    )
+    page_start = ch.get("page_start")
+    page_end = ch.get("page_end")
+    single_page = ch.get("page")
+    if page_start is not None and page_end is not None:
+        page_part = f" (pages {page_start}–{page_end})"
+    elif page_start is not None:
+        page_part = f" (page {page_start})"
+    elif single_page is not None:
+        page_part = f" (page {single_page})"
+    else:
+        page_part = ""
+
+    category = ch.get("category") or ""
+    subcat = ch.get("sub_category") or ch.get("subcat") or ""
+    cat_part = f" — {category}/{subcat}" if (category or subcat) else ""
+
+    src = ch.get("source_url") or ch.get("pdf_path") or ch.get("source") or "N/A"
+
+    return doc_name, page_part, cat_part, src
+
+
+def build_citation_records(chunks):
+    """
+    Precompute citation display fields for every chunk once at load time,
+    so answer generation only unpacks a tuple per cited chunk.
+    """
+    return [_citation_record(ch) for ch in chunks]
+
+
 # --- Enhanced answer + citations block (fixed) ---
-def generate_answer_with_citations_v2(query, chunk_indices, call_llm_fn=None):
+def generate_answer_with_citations_v2(query, chunk_indices, call_llm_fn=None, max_tokens=512):
     """
     Generate an answer AND a nicely formatted 'Sources' block.
 
+    Parameters
+    ----------
+    max_tokens : int
+        Cap on the generated answer length (default Mistral path only).
+
     Returns
     -------
     answer_text : str
@@ -17,12 +66,10 @@ def generate_answer_with_citations_v2(query, chunk_indices, call_llm_fn=None):
     """
 
     # 1) Build the numbered context that the LLM will see
-    context_lines = []
-    for i, idx in enumerate(chunk_indices, start=1):
-        ch = all_chunks[idx]
-        content = ch.get("text", "").strip()
-        context_lines.append(f"[{i}] {content}")
-    context_str = "\n".join(context_lines)
+    context_str = "\n".join(
+        f"[{i}] {all_chunks[idx].get('text', '').strip()}"
+        for i, idx in enumerate(chunk_indices, start=1)
+    )
 
     # 2) Build the prompt
     system_msg = "You are a helpful policy QA assistant. Answer questions using the provided documents."
@@ -40,7 +87,7 @@ def generate_answer_with_citations_v2(query, chunk_indices, call_llm_fn=None):
     ]
 
     if call_llm_fn is None:
-        resp = _call_mistral_chat(messages, model=MODEL_NAME)
+        resp = _call_mistral_chat(messages, model=MODEL_NAME, max_tokens=max_tokens)
     else:
         # If you pass a custom fn, it must accept the same messages list
         resp = call_llm_fn(messages, model=MODEL_NAME)
@@ -49,37 +96,18 @@ def generate_answer_with_citations_v2(query, chunk_indices, call_llm_fn=None):
     answer_text = _extract_text_from_response(resp)
 
     # 4) Build a nice "Sources" block mapping [i] -> metadata
-    lines = ["Sources used:"]
+    records = citation_records
+    # Header + 2 lines per source, filled in place
+    lines = [None] * (1 + 2 * len(chunk_indices))
+    lines[0] = "Sources used:"
     for i, idx in enumerate(chunk_indices, start=1):
-        ch = all_chunks[idx]
-        # Try several common metadata keys (adjust to your schema)
-        doc_name = (
-            ch.get("doc_name")
-            or ch.get("title")
-            or ch.get("doc_title")
-            or ch.get("file_name")
-            or "Unknown document"
-        )
-        page_start = ch.get("page_start")
-        page_end = ch.get("page_end")
-        single_page = ch.get("page")
-        if page_start is not None and page_end is not None:
-            page_part = f" (pages {page_start}–{page_end})"
-        elif page_start is not None:
-            page_part = f" (page {page_start})"
-        elif single_page is not None:
-            page_part = f" (page {single_page})"
+        if records is not None:
+            doc_name, page_part, cat_part, src = records[idx]
         else:
-            page_part = ""
-
-        category = ch.get("category") or ""
-        subcat = ch.get("sub_category") or ch.get("subcat") or ""
-        cat_part = f" — {category}/{subcat}" if (category or subcat) else ""
-
-        src = ch.get("source_url") or ch.get("pdf_path") or ch.get("source") or "N/A"
+            doc_name, page_part, cat_part, src = _citation_record(all_chunks[idx])
 
-        lines.append(f"[{i}] {doc_name}{page_part}{cat_part}")
-        lines.append(f"     Source: {src}")
+        lines[2 * i - 1] = f"[{i}] {doc_name}{page_part}{cat_part}"
+        lines[2 * i] = f"     Source: {src}"
 
     sources_block = "\n".join(lines)
     return answer_text, sources_block
@@ -0,0 +1,32 @@
+"""
+Sync Entry Points for Async Code
+Runs the concurrent API pipelines from plain synchronous callers, including
+notebooks (Jupyter/Colab) where an event loop is already running
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Coroutine
+
+
+def run_sync(coro: Coroutine) -> Any:
+    """
+    Run a coroutine to completion and return its result.
+
+    asyncio.run() refuses to start while another event loop is running in
+    this thread, so in that case the coroutine gets its own loop on a worker
+    thread and the caller blocks until it finishes.
+
+    Args:
+        coro: Coroutine to run (must not depend on the caller's loop)
+
+    Returns:
+        The coroutine's result
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
@@ -3,8 +3,20 @@ Chunking Strategy - EXACT implementation from META notebook
 Hybrid strategy using structural info (headings, paragraphs) with natural breakpoints
 """
 
+import re
+from bisect import bisect_right
 from typing import List, Dict
 
+# Natural breakpoints, highest priority first
+_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+# Every separator contains a newline or a space, so one scan for those
+# characters finds all of them
+_SEP_CHAR_RE = re.compile(r"[\n ]")
+
+# First non-whitespace character (same whitespace set as str.strip)
+_NON_SPACE_RE = re.compile(r"\S")
+
 
 def chunk_blocks(doc_name: str, blocks: List[Dict], max_size: int = 3000, overlap: int = 200) -> List[Dict]:
     """
@@ -27,18 +39,38 @@ def chunk_blocks(doc_name: str, blocks: List[Dict], max_size: int = 3000, overla
     Returns:
         List of chunk dictionaries with metadata
     """
-    def _find_natural_split(text, start, hard_end):
+    def _separator_positions(text):
+        """
+        Collect the sorted start offsets of every natural separator in text,
+        in priority order, with a single pass over the text. Overlapping
+        matches are kept (e.g. both offsets of a "\n\n" inside "\n\n\n")
+        so lookups match str.rfind exactly.
+        """
+        double_newlines, newlines, sentence_ends, spaces = [], [], [], []
+        for m in _SEP_CHAR_RE.finditer(text):
+            i = m.start()
+            if text[i] == "\n":
+                newlines.append(i)
+                if text[i + 1:i + 2] == "\n":
+                    double_newlines.append(i)
+            else:
+                spaces.append(i)
+                if i > 0 and text[i - 1] == ".":
+                    sentence_ends.append(i - 1)
+        return [(2, double_newlines), (1, newlines), (2, sentence_ends), (1, spaces)]
+
+    def _find_natural_split(sep_positions, start, hard_end):
         """
         Find a good split location between [start, hard_end],
         preferring natural separators, else fall back to hard_end.
+        Binary-searches the precomputed separator offsets of the block.
         """
-        split_at = hard_end
-        for sep in ["\n\n", "\n", ". ", " "]:
-            idx = text.rfind(sep, start, hard_end)
-            if idx != -1 and idx + len(sep) <= hard_end:
-                split_at = idx + len(sep)
-                break
-        return split_at
+        for sep_len, found in sep_positions:
+            # Last separator that starts at/after start and ends by hard_end
+            i = bisect_right(found, hard_end - sep_len) - 1
+            if i >= 0 and found[i] >= start:
+                return found[i] + sep_len
+        return hard_end
 
     chunks = []
 
@@ -49,24 +81,16 @@ def chunk_blocks(doc_name: str, blocks: List[Dict], max_size: int = 3000, overla
 
         # --- Build a single block_text and record spans for each paragraph ---
 
-        segments = []  # list of {kind: 'heading'/'para', 'para_idx': int|None, 'start': int, 'end': int}
         pieces = []
+        para_spans = []  # (start, end, para_idx) for each non-empty paragraph
         offset = 0
 
-        # Optional heading as its own segment (for context)
+        # Optional heading as its own piece (for context)
         if heading:
             h_text = str(heading).strip()
             if h_text:
                 pieces.append(h_text)
-                start = offset
-                end = start + len(h_text)
-                segments.append({
-                    "kind": "heading",
-                    "para_idx": None,
-                    "start": start,
-                    "end": end
-                })
-                offset = end
+                offset = len(h_text)
 
         # Add paragraphs separated by "\n\n"
         for i, p in enumerate(paragraphs):
@@ -81,57 +105,63 @@ def chunk_blocks(doc_name: str, blocks: List[Dict], max_size: int = 3000, overla
 
             start = offset
             pieces.append(p_text)
-            end = start + len(p_text)
-
-            segments.append({
-                "kind": "para",
-                "para_idx": i,
-                "start": start,
-                "end": end
-            })
-            offset = end
+            offset += len(p_text)
+            para_spans.append((start, offset, i))
 
-        block_text = "".join(pieces).strip()
+        # Pieces are already stripped, so no outer strip is needed
+        block_text = "".join(pieces)
         if not block_text:
             continue
 
         text_len = len(block_text)
 
-        # Pre-compute paragraph-only spans for traceability
-        para_spans = [
-            (seg["start"], seg["end"], seg["para_idx"])
-            for seg in segments
-            if seg["kind"] == "para"
-        ]
-
         # --- Slide through block_text to create chunks ---
 
+        # Paragraph spans are sorted and disjoint, so the paragraphs touched by
+        # a chunk form a contiguous run para_spans[lo:hi]. chunk_start only
+        # grows, so lo only moves forward; chunk_end can step back after an
+        # early natural split, so hi may retreat as well as advance.
+        n_paras = len(para_spans)
+        lo = 0
+        hi = 0
+
+        # Separator offsets are found once per block instead of rfind-scanning
+        # every window
+        sep_positions = _separator_positions(block_text)
+
         pos = 0
         while pos < text_len:
             hard_end = min(text_len, pos + max_size)
-            split_at = _find_natural_split(block_text, pos, hard_end)
+            split_at = _find_natural_split(sep_positions, pos, hard_end)
 
             # Fallback in case something goes weird
             if split_at <= pos:
                 split_at = hard_end
 
-            chunk_text = block_text[pos:split_at].strip()
-            if not chunk_text:
+            # Trim by index and slice once, instead of slicing the window
+            # and then copying it again in strip()
+            first = _NON_SPACE_RE.search(block_text, pos, split_at)
+            if first is None:
                 # Move forward to avoid infinite loop
                 pos = hard_end
                 continue
+            trim_end = split_at
+            while block_text[trim_end - 1].isspace():
+                trim_end -= 1
+            chunk_text = block_text[first.start():trim_end]
 
             chunk_start = pos
             chunk_end = split_at
 
             # Determine all paragraph indices that intersect this chunk
-            touched_paras = []
-            primary_para_idx = None
-            for (p_start, p_end, p_idx) in para_spans:
-                if p_start < chunk_end and p_end > chunk_start:  # intervals overlap
-                    touched_paras.append(p_idx)
-                    if primary_para_idx is None:
-                        primary_para_idx = p_idx
+            while lo < n_paras and para_spans[lo][1] <= chunk_start:
+                lo += 1
+            while hi < n_paras and para_spans[hi][0] < chunk_end:
+                hi += 1
+            while hi > 0 and para_spans[hi - 1][0] >= chunk_end:
+                hi -= 1
+            touched_paras = [p_idx for (_, _, p_idx) in para_spans[lo:hi]]
+            primary_para_idx = touched_paras[0] if touched_paras else None
 
             chunk_meta = {
                 "doc": doc_name,
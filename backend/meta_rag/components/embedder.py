@@ -0,0 +1,215 @@
+"""
+Embedding Model Loader
+Caches SentenceTransformer instances and optionally runs them on ONNX Runtime
+"""
+
+import os
+import json
+import functools
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+# Supported backends for load_embedding_model()
+#   torch     - default PyTorch SentenceTransformer
+#   onnx      - ONNX Runtime (exported on first load if the repo has no ONNX file)
+#   onnx-int8 - ONNX Runtime with a dynamically int8-quantized model
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Pre-quantized file shipped with the sentence-transformers ONNX exports (AVX2-safe)
+ONNX_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+
+# Exports made by OnnxEmbedder, one subdirectory per model (built on first use)
+ONNX_EMBEDDER_DIR = Path(os.getenv(
+    "METARAG_ONNX_EMBEDDER_DIR",
+    str(Path.home() / ".cache" / "metarag" / "embedder_onnx")
+))
+
+
+def default_device() -> str:
+    """Pick the fastest available torch device: cuda, then mps, then cpu."""
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    if torch.cuda.is_available():
+        return "cuda"
+    mps = getattr(torch.backends, "mps", None)
+    if mps is not None and mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+@functools.lru_cache(maxsize=4)
+def load_embedding_model(
+    model_name: str = "all-MiniLM-L6-v2",
+    backend: str = "torch",
+    device: Optional[str] = None,
+    fp16: bool = False
+) -> SentenceTransformer:
+    """
+    Load (or reuse) a SentenceTransformer model.
+
+    Repeated calls with the same arguments return the cached instance, so
+    building several indices or backends in one process loads the weights once.
+
+    Args:
+        model_name: SentenceTransformer model name or path
+        backend: One of EMBEDDING_BACKENDS; ONNX backends need
+            sentence-transformers>=3.2 with the [onnx] extra and fall back
+            to torch if unavailable
+        device: torch device for the torch backend (default: default_device())
+        fp16: Cast the model to half precision when running on CUDA
+            (encode() still returns float32 arrays)
+
+    Returns:
+        SentenceTransformer model with the usual encode() API
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}")
+
+    if backend != "torch":
+        model_kwargs = {"file_name": ONNX_INT8_FILE} if backend == "onnx-int8" else None
+        try:
+            model = SentenceTransformer(model_name, backend="onnx", model_kwargs=model_kwargs)
+            print(f"✅ Loaded embedding model on ONNX Runtime ({backend}): {model_name}")
+            return model
+        except Exception as e:
+            print(f"⚠️  ONNX backend unavailable ({e}), falling back to torch")
+
+    model = SentenceTransformer(model_name, device=device or default_device())
+    if fp16 and model.device.type == "cuda":
+        model.half()
+    print(f"✅ Loaded embedding model on {model.device} ({'fp16' if fp16 and model.device.type == 'cuda' else 'fp32'}): {model_name}")
+    return model
+
+
+def _sentence_transformers_config(model_name: str, filename: str) -> Optional[dict]:
+    """Read one sentence-transformers config file from a local model dir or the Hub (None if absent)."""
+    local = Path(model_name) / filename
+    if local.exists():
+        return json.loads(local.read_text())
+    try:
+        from huggingface_hub import hf_hub_download
+        return json.loads(Path(hf_hub_download(model_name, filename)).read_text())
+    except Exception:
+        return None
+
+
+class OnnxEmbedder:
+    """
+    SentenceTransformer.encode() for mean-pooling models, run directly on
+    ONNX Runtime with the pooling and normalization done in NumPy.
+
+    Meant for the query path on CPU, where single short encodes are
+    dominated by per-call overhead rather than the transformer itself.
+    """
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        """
+        Export (first use) and load the model on ONNX Runtime's CPU provider.
+
+        Args:
+            model_name: sentence-transformers model name or local path; bare
+                names resolve to the sentence-transformers/ org like
+                SentenceTransformer does
+
+        Raises:
+            ValueError: If the model does not use mean pooling
+        """
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        if "/" not in model_name and not Path(model_name).exists():
+            model_name = f"sentence-transformers/{model_name}"
+
+        pooling = _sentence_transformers_config(model_name, "1_Pooling/config.json") or {}
+        if not pooling.get("pooling_mode_mean_tokens", True):
+            raise ValueError(f"{model_name} does not use mean pooling")
+        modules = _sentence_transformers_config(model_name, "modules.json") or []
+        # Models ending in a Normalize module always return unit vectors
+        self._always_normalize = any(m.get("type", "").endswith("Normalize") for m in modules)
+        st_config = _sentence_transformers_config(model_name, "sentence_bert_config.json") or {}
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        self.max_seq_length = st_config.get("max_seq_length") or min(self.tokenizer.model_max_length, 512)
+
+        save_dir = ONNX_EMBEDDER_DIR / model_name.strip("/").replace("/", "--")
+        if not (save_dir / "model.onnx").exists():
+            print(f"🔄 Exporting {model_name} to ONNX (one-time)")
+            ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(save_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(save_dir, provider="CPUExecutionProvider")
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        inputs = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np"
+        )
+        last_hidden = self.model(**inputs).last_hidden_state
+        # Mean over real tokens only
+        mask = inputs["attention_mask"].astype(np.float32)
+        summed = np.einsum("bsd,bs->bd", last_hidden, mask)
+        return summed / np.maximum(mask.sum(axis=1, keepdims=True), 1e-9)
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        normalize_embeddings: bool = False,
+        **kwargs
+    ) -> np.ndarray:
+        """
+        Embed sentences like SentenceTransformer.encode(..., convert_to_numpy=True).
+
+        Args:
+            sentences: One text or a list of texts
+            batch_size: Texts per forward pass (batched in order of length)
+            normalize_embeddings: L2-normalize the rows
+            **kwargs: Other SentenceTransformer.encode() options, ignored
+
+        Returns:
+            (n, d) float32 array, or (d,) for a single string
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        embeddings = None
+        for start in range(0, len(texts), batch_size):
+            batch = order[start:start + batch_size]
+            batch_emb = self._embed_batch([texts[i] for i in batch])
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch_emb.shape[1]), dtype=np.float32)
+            embeddings[batch] = batch_emb
+        if embeddings is None:
+            embeddings = np.empty((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        if normalize_embeddings or self._always_normalize:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings[0] if single else embeddings
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.config.hidden_size
+
+
+@functools.lru_cache(maxsize=4)
+def load_query_embedder(model_name: str = "all-MiniLM-L6-v2"):
+    """
+    Load the encoder for the query path: OnnxEmbedder on CPU-only machines,
+    the cached SentenceTransformer otherwise or if ONNX is unavailable.
+
+    Args:
+        model_name: SentenceTransformer model name or path
+
+    Returns:
+        Model with SentenceTransformer's encode() API
+    """
+    if default_device() == "cpu":
+        try:
+            model = OnnxEmbedder(model_name)
+            print(f"✅ Loaded query embedder on ONNX Runtime: {model_name}")
+            return model
+        except Exception as e:
+            print(f"⚠️  ONNX query embedder unavailable ({e}), falling back to SentenceTransformer")
+    return load_embedding_model(model_name)
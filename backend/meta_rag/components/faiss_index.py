@@ -0,0 +1,133 @@
+"""
+FAISS Index Helpers
+Builds the inner-product indices used for the 3-index strategy
+"""
+
+from pathlib import Path
+from typing import Optional
+
+import faiss
+import numpy as np
+
+# Supported index types for build_index()
+INDEX_TYPES = ("flat", "sq8", "hnsw", "ivfpq")
+
+# HNSW graph parameters (efSearch is stored with the index)
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# IVFPQ parameters: 32 sub-quantizers x 8 bits per vector
+IVFPQ_M = 32
+IVFPQ_NBITS = 8
+IVFPQ_NPROBE = 16
+# Rotation learned before PQ when converting an existing flat index
+OPQ_M = 32
+
+# Text variants saved as embeddings_<variant>.npy next to the indices
+EMBEDDING_VARIANTS = ("content", "tfidf", "prefix")
+
+
+def build_index(embeddings: np.ndarray, index_type: str = "sq8") -> faiss.Index:
+    """
+    Build an inner-product FAISS index over L2-normalized embeddings.
+
+    Args:
+        embeddings: (N, d) float32 array of L2-normalized vectors
+        index_type: "flat" (exact fp32 IndexFlatIP), "sq8" (8-bit scalar
+            quantized, 4x smaller and faster to scan, near-identical ranking),
+            "hnsw" (graph search, sublinear query time) or "ivfpq" (inverted
+            lists + product quantization, for large corpora; falls back to
+            sq8 when there are too few vectors to train it)
+
+    Returns:
+        Trained FAISS index containing all embeddings
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    dimension = embeddings.shape[1]
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dimension)
+    elif index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(
+            dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(embeddings)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif index_type == "ivfpq":
+        n = embeddings.shape[0]
+        nlist = max(1, int(4 * np.sqrt(n)))
+        # k-means wants ~39 points per list and PQ needs 2^nbits points per codebook
+        if n < max(39 * nlist, 2 ** IVFPQ_NBITS) or dimension % IVFPQ_M != 0:
+            print(f"⚠️  Too few vectors ({n}) for IVFPQ, using sq8 instead")
+            return build_index(embeddings, "sq8")
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFPQ(
+            quantizer, dimension, nlist, IVFPQ_M, IVFPQ_NBITS, faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(embeddings)
+        index.nprobe = min(IVFPQ_NPROBE, nlist)
+    else:
+        raise ValueError(f"Unknown index_type '{index_type}', expected one of {INDEX_TYPES}")
+
+    index.add(embeddings)
+    return index
+
+
+def convert_flat_index(index: faiss.Index, fast_scan: bool = False) -> Optional[faiss.Index]:
+    """
+    Rebuild an exact IndexFlatIP as an OPQ + IVF + PQ index.
+
+    The vectors are reconstructed from the flat index itself, so indices
+    built before "ivfpq" was available can be converted without
+    re-embedding the corpus.
+
+    Args:
+        index: Exact inner-product index (IndexFlatIP)
+        fast_scan: Use 4-bit fast-scan PQ codes (PQ32x4fs), whose lookup
+            tables stay in SIMD registers, instead of 8-bit codes
+
+    Returns:
+        Trained index holding the same vectors, or None if the index is too
+        small to train IVF/PQ on (the flat index is then the better choice)
+    """
+    n, dimension = index.ntotal, index.d
+    # sqrt(N) lists rather than build_index's 4*sqrt(N), so corpora of a
+    # few thousand chunks already have enough points per list to train
+    nlist = max(1, int(np.sqrt(n)))
+    nbits = 4 if fast_scan else IVFPQ_NBITS
+    # k-means (IVF lists and PQ/OPQ codebooks alike) wants ~39 points per centroid
+    if n < 39 * max(nlist, 2 ** nbits) or dimension % OPQ_M != 0:
+        return None
+
+    embeddings = index.reconstruct_n(0, n)
+    pq = f"PQ{IVFPQ_M}x4fs" if fast_scan else f"PQ{IVFPQ_M}"
+    converted = faiss.index_factory(
+        dimension, f"OPQ{OPQ_M},IVF{nlist},{pq}", faiss.METRIC_INNER_PRODUCT
+    )
+    converted.train(embeddings)
+    converted.add(embeddings)
+    faiss.extract_index_ivf(converted).nprobe = min(IVFPQ_NPROBE, nlist)
+    return converted
+
+
+def load_embeddings(embedding_dir, variant: str = "content") -> np.ndarray:
+    """
+    Memory-map the saved (N, d) float32 embeddings for one text variant.
+
+    Rows are paged in on access, so looking up a single chunk's vector is
+    O(1) and does not read the whole file.
+
+    Args:
+        embedding_dir: Directory the index was built into
+        variant: One of EMBEDDING_VARIANTS
+
+    Returns:
+        Read-only memory-mapped array
+    """
+    if variant not in EMBEDDING_VARIANTS:
+        raise ValueError(f"Unknown embedding variant '{variant}', expected one of {EMBEDDING_VARIANTS}")
+    return np.load(Path(embedding_dir) / f"embeddings_{variant}.npy", mmap_mode="r")
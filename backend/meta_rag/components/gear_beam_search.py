@@ -4,21 +4,37 @@ GEAR Beam Search - Extracted from META notebook
 
 # Step 7: Diverse Triple Beam Search — clean implementation
 
+import heapq
 import math
+from collections import defaultdict
 
-def get_neighbors(triple, all_triples):
+def build_entity_index(all_triples):
+    """
+    Map each entity (subject or object) to the sorted positions of the triples
+    in all_triples that mention it.
+    """
+    entity_index = defaultdict(list)
+    for pos, (s, _, o) in enumerate(all_triples):
+        entity_index[s].append(pos)
+        if o != s:
+            entity_index[o].append(pos)
+    return entity_index
+
+def get_neighbors(triple, all_triples, entity_index=None):
     """
     Find all triples in all_triples that share subject or object with the given triple (excluding itself).
+    With an entity_index from build_entity_index() this is a lookup instead of a full scan;
+    neighbors are returned in all_triples order either way.
     """
     s0, _, o0 = triple
-    neighbors = []
-    for t in all_triples:
-        s, _, o = t
-        if t == triple:
-            continue
-        if s == s0 or s == o0 or o == s0 or o == o0:
-            neighbors.append(t)
-    return neighbors
+    if entity_index is None:
+        entity_index = build_entity_index(all_triples)
+
+    positions = entity_index.get(s0, [])
+    if o0 != s0:
+        positions = sorted(set(positions).union(entity_index.get(o0, [])))
+
+    return [all_triples[pos] for pos in positions if all_triples[pos] != triple]
 
 def score_triple(triple, query_emb):
     """
@@ -29,6 +45,36 @@ def score_triple(triple, query_emb):
     triple_emb = model.encode([triple_text], convert_to_tensor=True)
     return float(util.pytorch_cos_sim(query_emb, triple_emb)[0])
 
+def intern_triples(triples, vocab):
+    """
+    Map string triples to (int, int, int) ids, assigning each distinct
+    subject/predicate/object string the next id in vocab (string -> id).
+    Interned triples hash and compare on three ints instead of three strings.
+    """
+    return [
+        (vocab.setdefault(s, len(vocab)), vocab.setdefault(p, len(vocab)), vocab.setdefault(o, len(vocab)))
+        for (s, p, o) in triples
+    ]
+
+def score_triples(triples, query_emb, score_cache, batch_size=64, strings=None):
+    """
+    Score many triples against the query with a single batched model.encode call.
+    Triples already in score_cache are not re-encoded.
+    - strings: id -> string list when triples are interned id triples
+
+    Returns: list of cosine similarities aligned with triples
+    """
+    pending = [t for t in dict.fromkeys(triples) if t not in score_cache]
+    if pending:
+        if strings is not None:
+            triple_texts = [f"{strings[s]} {strings[p]} {strings[o]}" for (s, p, o) in pending]
+        else:
+            triple_texts = [f"{s} {p} {o}" for (s, p, o) in pending]
+        triple_embs = model.encode(triple_texts, convert_to_tensor=True, batch_size=batch_size)
+        sims = util.pytorch_cos_sim(query_emb, triple_embs)[0].tolist()
+        score_cache.update(zip(pending, sims))
+    return [score_cache[t] for t in triples]
+
 def diverse_triple_beam_search(query, T_q, all_triples, beam_size=3, max_length=3, gamma=1.0):
     """
     Perform Diverse Triple Beam Search as in GEAR (GEAR: §4.2, Algorithm 1).
@@ -39,34 +85,61 @@ def diverse_triple_beam_search(query, T_q, all_triples, beam_size=3, max_length=
     """
     query_emb = model.encode([query], convert_to_tensor=True)
 
+    # Search over interned int triples; map back to the caller's triples at the end
+    vocab = {}
+    all_ids = intern_triples(all_triples, vocab)
+    start_ids = intern_triples(T_q, vocab)
+    strings = list(vocab)  # id -> string (dicts keep insertion order)
+    original = dict(zip(all_ids, all_triples))
+    for t_id, t in zip(start_ids, T_q):
+        original.setdefault(t_id, t)
+
+    # Triple -> query similarity, filled in one encode() batch per beam step
+    score_cache = {}
+
+    # Entity -> triple positions, so neighbor lookup doesn't scan all_triples
+    entity_index = build_entity_index(all_ids)
+
     # Initialize beams with single triples from T_q
-    beams = []
-    for t in T_q:
-        score = score_triple(t, query_emb)
-        beams.append((score, [t]))
+    start_scores = score_triples(start_ids, query_emb, score_cache, strings=strings)
+    beams = [(score, [t]) for t, score in zip(start_ids, start_scores)]
 
     # Keep top beam_size beams
-    beams = sorted(beams, key=lambda x: x[0], reverse=True)[:beam_size]
+    beams = heapq.nlargest(beam_size, beams, key=lambda x: x[0])
+
+    # The penalty only varies for ranks below gamma and is constant after, so
+    # the final top beam_size always lies within the first beam_size + ceil(gamma)
+    # candidates; keep a wider buffer than that for the penalty ranking
+    rank_buffer = max(beam_size * 4, beam_size + math.ceil(gamma))
 
     for _ in range(1, max_length):
-        candidates = []
+        # Collect every expansion of every beam first so all new triples are
+        # embedded together
+        expansions = []
         for score, seq in beams:
             last_triple = seq[-1]
-            for neighbor in get_neighbors(last_triple, all_triples):
+            for neighbor in get_neighbors(last_triple, all_ids, entity_index):
                 if neighbor in seq:
                     continue  # skip already visited
-                new_seq = seq + [neighbor]
-                new_score = score_triple(neighbor, query_emb)
-                avg_score = (score * len(seq) + new_score) / len(new_seq)
-                candidates.append((avg_score, new_seq))
+                expansions.append((score, seq, neighbor))
+
+        new_scores = score_triples(
+            [neighbor for _, _, neighbor in expansions], query_emb, score_cache, strings=strings
+        )
+
+        candidates = []
+        for (score, seq, neighbor), new_score in zip(expansions, new_scores):
+            new_seq = seq + [neighbor]
+            avg_score = (score * len(seq) + new_score) / len(new_seq)
+            candidates.append((avg_score, new_seq))
 
         # Apply diversity penalty using exponential rank weighting
-        candidates = sorted(candidates, key=lambda x: x[0], reverse=True)
+        top = heapq.nlargest(rank_buffer, candidates, key=lambda x: x[0])
         penalized = []
-        for rank, (score, path) in enumerate(candidates):
+        for rank, (score, path) in enumerate(top):
             penalty = math.exp(-min(rank, gamma))
             penalized.append((score * penalty, path))
 
-        beams = sorted(penalized, key=lambda x: x[0], reverse=True)[:beam_size]
+        beams = heapq.nlargest(beam_size, penalized, key=lambda x: x[0])
 
-    return [path for _, path in beams]
+    return [[original[t] for t in path] for _, path in beams]
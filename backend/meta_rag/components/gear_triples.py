@@ -3,10 +3,27 @@ GEAR Triple Extraction - Extracted from META notebook
 Uses GPT-4o-mini for extracting knowledge graph triples
 """
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from typing import Dict, List
+from tqdm import tqdm
+import asyncio
 import json
 import os
 
+# orjson parses model output faster; its JSONDecodeError subclasses json's,
+# so the existing except clauses cover both
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+from .llm_cache import LLMCache, cached_by_text, get_llm_cache
+from .async_runner import run_sync
+
+# Default extraction model (also part of the cache key)
+DEFAULT_TRIPLE_MODEL = "gpt-4o-mini"
+
 # Initialize client as None - will be created when needed
 client = None
 
@@ -20,25 +37,11 @@ def _get_client():
         client = OpenAI(api_key=api_key)
     return client
 
-def extract_triples_from_text(text: str, query: str = None, model: str = None):
-    """
-    Extract (subject, predicate, object) triples using OpenAI's new API.
-
-    Args:
-        text: context text to extract triples from
-        query: (optional) user question, used only to guide extraction in the prompt
-        model: (optional) OpenAI model name; if None or empty, uses a default
-
-    Returns:
-        List[dict] with keys: subject, predicate, object
-    """
-    # Choose default model if not provided or invalid
-    if not model:
-        model = "gpt-4o-mini"  # or "gpt-4.1-mini" depending on what you have
-
+def _build_prompt(text: str, query: str = None) -> str:
+    """Build the triple extraction prompt (shared by sync and async paths)."""
     query_hint = f"\nUser question (for context): {query}\n" if query else ""
 
-    prompt = f"""
+    return f"""
     You are an information extraction system.
 
     From the text below, extract ALL knowledge triples in the form:
@@ -56,18 +59,16 @@ def extract_triples_from_text(text: str, query: str = None, model: str = None):
     \"\"\"{text}\"\"\"
     """
 
-    # Use standard OpenAI chat completions API
-    api_client = _get_client()
-    resp = api_client.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0,
-    )
 
-    raw = resp.choices[0].message.content.strip()
+def _parse_triples(raw: str):
+    """
+    Parse the model output into a list of well-formed triple dicts.
 
+    Returns None when the output is not valid JSON, so callers can tell a
+    malformed response (retryable, never cached) from a genuine empty result.
+    """
     try:
-        triples = json.loads(raw)
+        triples = _loads(raw)
         if isinstance(triples, list):
             # Filter to only well-formed triples
             clean = []
@@ -83,5 +84,145 @@ def extract_triples_from_text(text: str, query: str = None, model: str = None):
         else:
             return []
     except json.JSONDecodeError:
-        # Fallback: avoid breaking the pipeline
-        return []
+        print(f"⚠️  GEAR triple output is not valid JSON (truncated): {raw[:200]}")
+        return None
+
+
+@cached_by_text(
+    "gear_triples",
+    # Query-guided extraction depends on the question, so only cache query=None
+    get_model=lambda query=None, model=None: None if query else (model or DEFAULT_TRIPLE_MODEL),
+    # Malformed output (None) is not stored, so the next run asks again
+    should_cache=lambda triples: triples is not None
+)
+def _extract_triples_cached(text: str, query: str = None, model: str = None):
+    """Single extraction request; None when the model output could not be parsed."""
+    # Choose default model if not provided or invalid
+    if not model:
+        model = DEFAULT_TRIPLE_MODEL  # or "gpt-4.1-mini" depending on what you have
+
+    prompt = _build_prompt(text, query)
+
+    # Use standard OpenAI chat completions API
+    api_client = _get_client()
+    resp = api_client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+    )
+
+    raw = resp.choices[0].message.content.strip()
+    return _parse_triples(raw)
+
+
+def extract_triples_from_text(text: str, query: str = None, model: str = None):
+    """
+    Extract (subject, predicate, object) triples using OpenAI's new API.
+    Results for query=None are memoized on disk by text hash (see llm_cache);
+    unparseable responses yield an empty list and are not memoized.
+
+    Args:
+        text: context text to extract triples from
+        query: (optional) user question, used only to guide extraction in the prompt
+        model: (optional) OpenAI model name; if None or empty, uses a default
+
+    Returns:
+        List[dict] with keys: subject, predicate, object
+    """
+    return _extract_triples_cached(text, query=query, model=model) or []
+
+
+async def extract_triples_from_text_async(text: str, client, query: str = None, model: str = None):
+    """
+    Async variant of extract_triples_from_text().
+
+    Args:
+        text: context text to extract triples from
+        client: AsyncOpenAI client bound to the running event loop
+        query: (optional) user question, used only to guide extraction in the prompt
+        model: (optional) OpenAI model name; if None or empty, uses a default
+
+    Returns:
+        List[dict] with keys: subject, predicate, object, or None when the
+        model output is not valid JSON
+    """
+    if not model:
+        model = DEFAULT_TRIPLE_MODEL
+
+    resp = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": _build_prompt(text, query)}],
+        temperature=0,
+    )
+
+    raw = resp.choices[0].message.content.strip()
+    return _parse_triples(raw)
+
+
+def extract_triples_batch(
+    texts: List[str],
+    model: str = None,
+    max_concurrency: int = 16,
+    max_retries: int = 3,
+    show_progress: bool = True
+) -> List[List[Dict]]:
+    """
+    Extract triples for many texts concurrently.
+
+    Requests run on an AsyncOpenAI client with at most max_concurrency in
+    flight; the client retries rate-limit/5xx errors with exponential backoff.
+    A text whose request still fails, or whose output is not valid
+    JSON, yields an empty list and is not cached. Texts already in
+    the on-disk LLM cache are served without a request.
+
+    Args:
+        texts: list of context texts
+        model: (optional) OpenAI model name
+        max_concurrency: maximum number of in-flight requests
+        max_retries: retries per request (handled by the OpenAI client)
+        show_progress: show a tqdm progress bar
+
+    Returns:
+        List of triple lists, aligned with texts
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+
+    cache = get_llm_cache()
+
+    async def _run():
+        # Created per run: the async HTTP pool is bound to this event loop
+        async_client = AsyncOpenAI(api_key=api_key, max_retries=max_retries)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        pbar = tqdm(total=len(texts), desc="GEAR triple extraction") if show_progress else None
+
+        async def _extract_one(text: str):
+            key = LLMCache.make_key("gear_triples", model or DEFAULT_TRIPLE_MODEL, (text or "").strip()) if cache else None
+            triples = cache.get(key) if cache else None
+            if triples is None:
+                async with semaphore:
+                    try:
+                        triples = await extract_triples_from_text_async(text, async_client, model=model)
+                        # Unparseable output is not cached either
+                        if triples is None:
+                            triples = []
+                        elif cache:
+                            cache.set(key, triples)
+                    except Exception as e:
+                        # Failures are not cached
+                        print(f"⚠️  GEAR triple extraction failed: {e}")
+                        triples = []
+            if pbar is not None:
+                pbar.update(1)
+            return triples
+
+        try:
+            # gather() preserves input order
+            return await asyncio.gather(*(_extract_one(text) for text in texts))
+        finally:
+            if pbar is not None:
+                pbar.close()
+            await async_client.close()
+
+    return list(run_sync(_run()))
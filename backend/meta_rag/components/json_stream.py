@@ -0,0 +1,62 @@
+"""
+Streamed JSON Reader
+Accumulates streamed LLM output and detects when the top-level JSON value is
+complete, so callers can stop reading instead of waiting for the model to
+finish generating
+"""
+
+from typing import List
+
+
+class JsonStreamBuffer:
+    """Collects text pieces up to the end of the first top-level JSON object or array."""
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escaped = False
+        self.complete = False
+
+    def feed(self, piece: str) -> bool:
+        """
+        Append a streamed piece of text.
+
+        Args:
+            piece: Next piece of model output
+
+        Returns:
+            True once the top-level value is closed (anything after it is dropped)
+        """
+        if self.complete or not piece:
+            return self.complete
+
+        for pos, ch in enumerate(piece):
+            if self._in_string:
+                # Brackets inside string values don't count
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{" or ch == "[":
+                self._depth += 1
+                self._started = True
+            elif (ch == "}" or ch == "]") and self._started:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(piece[:pos + 1])
+                    self.complete = True
+                    return True
+
+        self._parts.append(piece)
+        return False
+
+    @property
+    def text(self) -> str:
+        """The text received so far, stripped."""
+        return "".join(self._parts).strip()
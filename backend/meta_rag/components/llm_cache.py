@@ -0,0 +1,150 @@
+"""
+LLM Response Cache
+Persistent SQLite cache for deterministic LLM extraction results (metadata, GEAR triples)
+so re-indexing the same corpus does not repeat API calls
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import functools
+import threading
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+# Bump when a prompt changes so stale results are not reused
+PROMPT_VERSION = "v4"
+
+# Set METARAG_LLM_CACHE=0 to disable, METARAG_LLM_CACHE_PATH to relocate the file
+LLM_CACHE_ENABLED = os.getenv("METARAG_LLM_CACHE", "1") != "0"
+DEFAULT_CACHE_PATH = os.getenv(
+    "METARAG_LLM_CACHE_PATH",
+    str(Path.home() / ".cache" / "metarag" / "llm_cache.sqlite")
+)
+# Entries older than this are treated as misses (METARAG_LLM_CACHE_TTL_DAYS, 0 = never expire)
+DEFAULT_TTL_SECONDS = float(os.getenv("METARAG_LLM_CACHE_TTL_DAYS", "7")) * 86400
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace and case so trivially different copies of a chunk share a key."""
+    return " ".join((text or "").split()).casefold()
+
+
+class LLMCache:
+    """Key/value store of JSON-serialized LLM results keyed by a hash of the input text."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: float = DEFAULT_TTL_SECONDS):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path: SQLite file path
+            ttl: Seconds an entry stays valid (<= 0 disables expiry)
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL)"
+        )
+        # Databases from before TTL support lack the timestamp column
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cache)")}
+        if "created_at" not in columns:
+            self._conn.execute("ALTER TABLE cache ADD COLUMN created_at REAL")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(namespace: str, model: str, text: str) -> str:
+        """Hash (namespace, model, prompt version, text) into a cache key."""
+        payload = f"{namespace}|{model}|{PROMPT_VERSION}|{text}".encode("utf-8")
+        return hashlib.blake2b(payload, digest_size=32).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss or an expired entry."""
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+            # Entries without a timestamp predate TTL support and never expire
+            if row and self.ttl > 0 and row[1] is not None and time.time() - row[1] > self.ttl:
+                row = None
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any):
+        """Store a JSON-serializable value under key."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Hit/miss counters for this process."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_cache = None
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """Return the process-wide cache, or None if caching is disabled or unavailable."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        try:
+            _cache = LLMCache()
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  LLM cache unavailable ({e}), continuing without it")
+            return None
+    return _cache
+
+
+def cached_by_text(namespace: str, get_model: Callable[..., str], should_cache: Callable[[Any], bool] = bool):
+    """
+    Decorator memoizing fn(text, *args, **kwargs) on disk by a hash of text.
+
+    Args:
+        namespace: Separates different extraction tasks in the cache
+        get_model: Called with the wrapped function's (*args, **kwargs) after
+            text; returns the model name that is part of the key, or None to
+            bypass the cache for this call
+        should_cache: Predicate on the result; falsy results (e.g. an error
+            fallback) are not stored
+
+    Returns:
+        Decorator
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(text, *args, **kwargs):
+            cache = get_llm_cache()
+            model = get_model(*args, **kwargs) if cache is not None else None
+            if model is None:
+                return fn(text, *args, **kwargs)
+
+            key = LLMCache.make_key(namespace, model, (text or "").strip())
+            hit = cache.get(key)
+            if hit is not None:
+                return hit
+
+            result = fn(text, *args, **kwargs)
+            if should_cache(result):
+                cache.set(key, result)
+            return result
+        return wrapper
+    return decorator
@@ -4,8 +4,24 @@ Provides _call_mistral_chat function for answer generation
 """
 
 # --- Mistral setup (works across recent SDKs) ---
-import os, json, time
+import os, re, json, time
+import asyncio
 from mistralai.client import MistralClient
+from mistralai.async_client import MistralAsyncClient
+
+from .llm_cache import LLMCache, cached_by_text, get_llm_cache
+from .async_runner import run_sync
+
+# orjson parses model output faster; its JSONDecodeError subclasses json's,
+# so the existing except clauses cover both
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Leading ```/```json and trailing ``` fences around model JSON output
+FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.S)
 
 # Optional Colab compat: gracefully fall back to env var if google.colab.userdata isn't available
 try:
@@ -17,14 +33,23 @@ except Exception:
 # Prefer env var, else colab userdata, else empty (will error clearly if not set)
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY") or _maybe_key or ""
 MODEL_NAME = "open-mistral-7b"  # <-- use a valid model for your account
+METADATA_CACHE_NAMESPACE = "mistral_client_metadata"
+
+# Bound every request: fail fast instead of hanging, and cap retry storms
+MISTRAL_TIMEOUT = int(os.getenv("MISTRAL_TIMEOUT", "20"))          # seconds per request
+MISTRAL_MAX_RETRIES = int(os.getenv("MISTRAL_MAX_RETRIES", "3"))   # SDK retries with backoff
 
 if not MISTRAL_API_KEY:
     raise RuntimeError("MISTRAL_API_KEY is not set. Export it in your environment or Colab userdata.")
 
-mistral_client = MistralClient(api_key=MISTRAL_API_KEY)
+mistral_client = MistralClient(
+    api_key=MISTRAL_API_KEY,
+    timeout=MISTRAL_TIMEOUT,
+    max_retries=MISTRAL_MAX_RETRIES,
+)
 print(f"[Mistral] Client initialized: {type(mistral_client)} | Model: {MODEL_NAME}")
 
-def _call_mistral_chat(messages, model=MODEL_NAME, **kw):
+def _call_mistral_chat(messages, model=MODEL_NAME, max_tokens=None, **kw):
     """
     Call Mistral chat with a list of messages:
         messages = [
@@ -32,7 +57,13 @@ def _call_mistral_chat(messages, model=MODEL_NAME, **kw):
             {"role": "user",   "content": "..."}
         ]
     Tries the common method shapes across SDK versions.
+
+    max_tokens caps the completion length; timeout and retries are bounded
+    on the client (MISTRAL_TIMEOUT / MISTRAL_MAX_RETRIES).
     """
+    if max_tokens is not None:
+        kw["max_tokens"] = max_tokens
+
     # Guard: messages must be a list[dict] (role/content)
     if not (isinstance(messages, (list, tuple)) and all(isinstance(m, dict) for m in messages)):
         raise TypeError("`messages` must be a list of dicts like "
@@ -80,30 +111,25 @@ def _extract_text_from_response(resp):
     except Exception:
         return ""
 
-import json
-import time
-
-def extract_metadata(chunk_text):
-    """Call Mistral API to extract specified metadata from chunk_text, return parsed JSON."""
-    chunk_text = (chunk_text or "").strip()
-
-    # Skip very short / useless chunks to save time and tokens
-    if len(chunk_text) < 50:
-        return {
-            "summary": "",
-            "keywords": [],
-            "entities": [],
-            "effective_date": "",
-            "fund_codes": [],
-            "ilcs_citations": [],
-            "title": "",
-            "category": "",
-            "sub_category": "",
-            "topic": "",
-            "year": "",
-            "content_type": ""
-        }
+def _empty_metadata():
+    """Metadata dict with every expected field left empty."""
+    return {
+        "summary": "",
+        "keywords": [],
+        "entities": [],
+        "effective_date": "",
+        "fund_codes": [],
+        "ilcs_citations": [],
+        "title": "",
+        "category": "",
+        "sub_category": "",
+        "topic": "",
+        "year": "",
+        "content_type": ""
+    }
 
+def _metadata_messages(chunk_text):
+    """Build the system/user messages for one chunk (shared by sync and async paths)."""
     system_prompt = (
         "You are a helpful assistant that extracts specified metadata from policy text. "
         "Always output JSON only."
@@ -127,7 +153,13 @@ def extract_metadata(chunk_text):
         "- content_type: the type of content (e.g., policy, guideline, procedure, report)\n"
         "If a field is not found or applicable, use an empty string or empty list. JSON only, no explanation."
     )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user",   "content": user_prompt},
+    ]
 
+def _parse_metadata_output(output_text):
+    """Parse the model output into a metadata dict (empty fields on failure)."""
     expected_keys = [
         "summary", "keywords", "entities", "effective_date", "fund_codes",
         "ilcs_citations", "title", "category", "sub_category", "topic",
@@ -135,22 +167,10 @@ def extract_metadata(chunk_text):
     ]
 
     try:
-        resp = _call_mistral_chat(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user",   "content": user_prompt},
-            ],
-            model=MODEL_NAME
-        )
-        output_text = _extract_text_from_response(resp).strip()
+        output_text = output_text.strip()
 
         # Clean optional ``` fences
-        if output_text.startswith("```json"):
-            output_text = output_text[len("```json"):].strip()
-        elif output_text.startswith("```"):
-            output_text = output_text[len("```"):].strip()
-        if output_text.endswith("```"):
-            output_text = output_text[:-3].strip()
+        output_text = FENCE_RE.sub("", output_text)
 
         # ---- KEY FIX: isolate the first JSON object only ----
         start = output_text.find("{")
@@ -160,7 +180,7 @@ def extract_metadata(chunk_text):
         else:
             json_str = output_text  # fallback, may still be pure JSON
 
-        metadata = json.loads(json_str)
+        metadata = _loads(json_str)
 
         # Ensure all expected keys exist with sane defaults
         for k in expected_keys:
@@ -176,17 +196,88 @@ def extract_metadata(chunk_text):
         print(f"[extract_metadata] Unexpected error: {e}")
 
     # Fallback on any error
-    return {
-        "summary": "",
-        "keywords": [],
-        "entities": [],
-        "effective_date": "",
-        "fund_codes": [],
-        "ilcs_citations": [],
-        "title": "",
-        "category": "",
-        "sub_category": "",
-        "topic": "",
-        "year": "",
-        "content_type": ""
-    }
+    return _empty_metadata()
+
+@cached_by_text(
+    # Own namespace: MetadataExtractor stores a different schema under "metadata"
+    METADATA_CACHE_NAMESPACE,
+    get_model=lambda: MODEL_NAME,
+    # Don't store the all-empty fallback returned for short chunks and errors
+    should_cache=lambda metadata: any(metadata.values())
+)
+def extract_metadata(chunk_text):
+    """
+    Call Mistral API to extract specified metadata from chunk_text, return parsed JSON.
+    Results are memoized on disk by text hash (see llm_cache).
+    """
+    chunk_text = (chunk_text or "").strip()
+
+    # Skip very short / useless chunks to save time and tokens
+    if len(chunk_text) < 50:
+        return _empty_metadata()
+
+    try:
+        resp = _call_mistral_chat(messages=_metadata_messages(chunk_text), model=MODEL_NAME)
+    except Exception as e:
+        print(f"[extract_metadata] Unexpected error: {e}")
+        return _empty_metadata()
+
+    return _parse_metadata_output(_extract_text_from_response(resp))
+
+async def extract_metadata_async(chunk_text, client):
+    """
+    Async variant of extract_metadata() on a MistralAsyncClient.
+
+    Args:
+        chunk_text: chunk text to extract metadata from
+        client: MistralAsyncClient bound to the running event loop
+    """
+    chunk_text = (chunk_text or "").strip()
+
+    if len(chunk_text) < 50:
+        return _empty_metadata()
+
+    try:
+        resp = await client.chat(model=MODEL_NAME, messages=_metadata_messages(chunk_text))
+    except Exception as e:
+        print(f"[extract_metadata] Unexpected error: {e}")
+        return _empty_metadata()
+
+    return _parse_metadata_output(_extract_text_from_response(resp))
+
+def extract_metadata_batch(chunk_texts, max_concurrency=16):
+    """
+    Extract metadata for many chunks concurrently.
+
+    Requests share one pooled MistralAsyncClient with at most max_concurrency
+    in flight; cached texts are served without a request. Results are
+    aligned with chunk_texts.
+    """
+    cache = get_llm_cache()
+
+    async def _run():
+        # Created per run: the async HTTP pool is bound to this event loop
+        client = MistralAsyncClient(
+            api_key=MISTRAL_API_KEY,
+            timeout=MISTRAL_TIMEOUT,
+            max_retries=MISTRAL_MAX_RETRIES,
+        )
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def _extract_one(chunk_text):
+            key = LLMCache.make_key(METADATA_CACHE_NAMESPACE, MODEL_NAME, (chunk_text or "").strip()) if cache else None
+            metadata = cache.get(key) if cache else None
+            if metadata is None:
+                async with semaphore:
+                    metadata = await extract_metadata_async(chunk_text, client)
+                if cache and any(metadata.values()):
+                    cache.set(key, metadata)
+            return metadata
+
+        try:
+            # gather() preserves input order
+            return await asyncio.gather(*(_extract_one(t) for t in chunk_texts))
+        finally:
+            await client.close()
+
+    return list(run_sync(_run()))
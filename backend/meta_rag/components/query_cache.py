@@ -0,0 +1,122 @@
+"""
+Query Cache
+In-memory caches for the retrieval hot path: query embeddings by exact text,
+dense results by embedding similarity, and reranked results by (query, top_k)
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 10000
+# Cosine similarity a past query must reach to reuse its dense results
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+
+class QueryCache:
+    """Per-process LRU + nearest-neighbour cache for one index; not persisted."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, threshold: float = DEFAULT_SIMILARITY_THRESHOLD):
+        """
+        Args:
+            max_entries: Capacity of each cache level
+            threshold: Minimum cosine similarity for a semantic hit on dense results
+        """
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._reranked: "OrderedDict[Hashable, Any]" = OrderedDict()
+        # Past query embeddings; row i holds the (top_k searched, dense results) in _results[i]
+        self._index: Optional[faiss.IndexFlatIP] = None
+        self._results: List[Tuple[int, List[int]]] = []
+
+    def _lru_get(self, cache: OrderedDict, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = cache.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            cache.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _lru_put(self, cache: OrderedDict, key: Hashable, value: Any):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            if len(cache) > self.max_entries:
+                cache.popitem(last=False)
+
+    def get_embedding(self, query: str) -> Optional[np.ndarray]:
+        """Cached (d,) embedding of exactly this query text, or None."""
+        return self._lru_get(self._embeddings, query)
+
+    def add_embedding(self, query: str, embedding: np.ndarray):
+        self._lru_put(self._embeddings, query, embedding)
+
+    def get_reranked(self, key: Hashable) -> Optional[Any]:
+        """Cached reranked result for key (e.g. (query, top_k)), or None."""
+        return self._lru_get(self._reranked, key)
+
+    def add_reranked(self, key: Hashable, value: Any):
+        self._lru_put(self._reranked, key, value)
+
+    def _nearest(self, embedding: np.ndarray) -> Optional[int]:
+        """Row of the most similar past query above the threshold, or None (lock held by caller)."""
+        if self._index is None or not self._index.ntotal:
+            return None
+        scores, ids = self._index.search(embedding.reshape(1, -1), 1)
+        i = ids[0][0]
+        return i if i >= 0 and scores[0][0] >= self.threshold else None
+
+    def get_results(self, embedding: np.ndarray, top_k: int) -> Optional[List[int]]:
+        """
+        Dense results of the most similar past query, or None.
+
+        Only entries searched with a top_k at least as large can answer; their
+        first top_k indices are returned (fewer if the index had fewer hits).
+
+        Args:
+            embedding: L2-normalized (d,) float32 query embedding
+            top_k: Number of results wanted
+        """
+        with self._lock:
+            i = self._nearest(embedding)
+            if i is not None and self._results[i][0] >= top_k:
+                self.hits += 1
+                return self._results[i][1][:top_k]
+            self.misses += 1
+            return None
+
+    def add_results(self, embedding: np.ndarray, indices: List[int], top_k: int):
+        """
+        Store the dense results of one query searched with top_k. A near-duplicate
+        entry (e.g. one searched with a smaller top_k) is replaced, not duplicated.
+        """
+        with self._lock:
+            i = self._nearest(embedding)
+            if i is not None:
+                self._results[i] = (top_k, list(indices))
+                return
+            if self._index is None or self._index.ntotal >= self.max_entries:
+                # A flat index can't evict single rows cheaply, so start over when full
+                self._index = faiss.IndexFlatIP(embedding.shape[-1])
+                self._results = []
+            self._index.add(embedding.reshape(1, -1))
+            self._results.append((top_k, list(indices)))
+
+    def stats(self) -> dict:
+        """Hit/miss counters across all cache levels for this process."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,154 @@
+"""
+API Rate Limiting
+Async token buckets that keep concurrent LLM requests within a provider's
+requests-per-minute (RPM) and tokens-per-minute (TPM) quota
+"""
+
+import time
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Real token counts when tiktoken is installed (cl100k_base is close enough
+# for sizing Gemini/Mistral requests); otherwise ~4 characters per token
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+# (RPM, TPM) per quota tier; check your provider console, these are the
+# published defaults at the time of writing and change between models
+GEMINI_RATE_TIERS: Dict[str, Tuple[int, int]] = {
+    "free": (10, 250_000),
+    "tier1": (1_000, 1_000_000),
+    "tier2": (2_000, 3_000_000),
+    "tier3": (10_000, 8_000_000),
+}
+MISTRAL_RATE_TIERS: Dict[str, Tuple[int, int]] = {
+    "free": (60, 500_000),
+    "tier1": (300, 2_000_000),
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count for rate limiting and request sizing."""
+    if _ENCODING is not None:
+        return max(1, len(_ENCODING.encode(text, disallowed_special=())))
+    return max(1, len(text) // 4)
+
+
+class AsyncTokenBucket:
+    """Token bucket refilled continuously at rate_per_minute, holding at most one minute's worth."""
+
+    def __init__(self, rate_per_minute: float):
+        """
+        Args:
+            rate_per_minute: Tokens added per minute (also the bucket capacity)
+        """
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self._rate = self.capacity / 60.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        """Wait until amount tokens are available, then take them."""
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(float(amount), self.capacity)
+        while True:
+            async with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self._rate
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """Combined RPM + TPM limiter; either limit may be None (unlimited)."""
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None):
+        """
+        Create the buckets. Must be called inside the event loop that uses them.
+
+        Args:
+            rpm: Requests per minute
+            tpm: Input tokens per minute
+        """
+        self.rpm = AsyncTokenBucket(rpm) if rpm else None
+        self.tpm = AsyncTokenBucket(tpm) if tpm else None
+
+    async def acquire(self, tokens: int = 1):
+        """Wait for one request slot and tokens worth of TPM budget."""
+        if self.rpm is not None:
+            await self.rpm.acquire(1)
+        if self.tpm is not None:
+            await self.tpm.acquire(tokens)
+
+
+def resolve_rate_limits(
+    tiers: Dict[str, Tuple[int, int]],
+    tier: Optional[str] = None,
+    rpm: Optional[int] = None,
+    tpm: Optional[int] = None
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Pick (rpm, tpm) from a tier table, with explicit values taking precedence.
+
+    Args:
+        tiers: Provider tier table (e.g. GEMINI_RATE_TIERS)
+        tier: Tier name, or None for no tier defaults
+        rpm: Explicit requests-per-minute override
+        tpm: Explicit tokens-per-minute override
+
+    Returns:
+        (rpm, tpm), each None when unlimited
+    """
+    tier_rpm, tier_tpm = (None, None)
+    if tier is not None:
+        if tier not in tiers:
+            raise ValueError(f"Unknown rate tier '{tier}', expected one of {tuple(tiers)}")
+        tier_rpm, tier_tpm = tiers[tier]
+    return rpm or tier_rpm, tpm or tier_tpm
+
+
+def batch_by_token_budget(
+    items: List[Any],
+    max_items: int,
+    max_tokens: int,
+    text_of: Callable[[Any], str] = str
+) -> List[List[Any]]:
+    """
+    Group items (in order) into batches of at most max_items whose estimated
+    token total stays within max_tokens; an item larger than the budget gets
+    a batch of its own.
+
+    Args:
+        items: Items to group
+        max_items: Maximum batch length
+        max_tokens: Estimated input-token budget per batch
+        text_of: Returns the text of an item for estimate_tokens()
+
+    Returns:
+        List of batches
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for item in items:
+        tokens = estimate_tokens(text_of(item))
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
@@ -5,19 +5,24 @@ Uses BAAI/bge-reranker-base cross-encoder for reranking retrieved chunks
 
 import numpy as np
 import torch
+from concurrent.futures import ThreadPoolExecutor
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 
 class BGEReranker:
     """BGE cross-encoder reranker for improving retrieval quality"""
 
-    def __init__(self, model_name: str = "BAAI/bge-reranker-base"):
+    # Cross-encoder input limit (query + document tokens)
+    max_length = 512
+
+    def __init__(self, model_name: str = "BAAI/bge-reranker-base", quantize: bool = True):
         """
         Initialize BGE reranker model.
 
         Args:
             model_name: HuggingFace model name (default: BAAI/bge-reranker-base)
+            quantize: On CPU, apply int8 dynamic quantization to the Linear layers
         """
         print(f"🔄 Loading BGE reranker: {model_name}")
         self.model_name = model_name
@@ -35,25 +40,113 @@ class BGEReranker:
         
         # Load model with memory optimization
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForSequenceClassification.from_pretrained(
-            model_name,
-            torch_dtype=torch.float16 if self.device.type != "cpu" else torch.float32
-        )
+        # bf16 on GPUs that support it (same range as fp32, no logit overflow),
+        # fp16 on other accelerators, fp32 on CPU
+        if self.device.type == "cuda" and torch.cuda.is_bf16_supported():
+            model_dtype = torch.bfloat16
+        elif self.device.type != "cpu":
+            model_dtype = torch.float16
+        else:
+            model_dtype = torch.float32
+        try:
+            # Fused scaled-dot-product attention kernels (FlashAttention/mem-efficient on GPU)
+            self.model = AutoModelForSequenceClassification.from_pretrained(
+                model_name,
+                torch_dtype=model_dtype,
+                attn_implementation="sdpa"
+            )
+        except (TypeError, ValueError, ImportError) as e:
+            print(f"⚠️  SDPA attention unavailable ({e}), using default attention")
+            self.model = AutoModelForSequenceClassification.from_pretrained(
+                model_name,
+                torch_dtype=model_dtype
+            )
         self.model.eval()
         self.model.to(self.device)
-        
+
+        # CPU is the slow path: int8 GEMMs for the Linear projections (the bulk of the FLOPs)
+        if quantize and self.device.type == "cpu":
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            print("⚡ Applied int8 dynamic quantization (CPU)")
+
+        # On CUDA, pad + pin the next batch on a helper thread while the GPU
+        # runs the current one; host-to-device copies are then non-blocking
+        self._pin_memory = self.device.type == "cuda"
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1) if self._pin_memory else None
+
+        # Document text -> token ids (no special tokens); the corpus is fixed,
+        # so candidates that recur across queries are tokenized only once
+        self._doc_token_cache = {}
+
         print(f"✅ BGE reranker loaded on {self.device}")
 
-    def rerank(self, query: str, chunks: List[dict], top_k: int = None, batch_size: int = 8) -> Tuple[List[int], List[float]]:
+    def tokenize_query(self, query: str) -> List[int]:
+        """Token ids of the query without special tokens (paired with cached docs in rerank)."""
+        return self.tokenizer(query, add_special_tokens=False, truncation=True, max_length=self.max_length)["input_ids"]
+
+    def doc_token_ids(self, texts: List[str]) -> List[List[int]]:
+        """Token ids of each document text without special tokens, served from the cache when possible."""
+        cache = self._doc_token_cache
+        missing = [t for t in dict.fromkeys(texts) if t not in cache]
+        if missing:
+            encoded = self.tokenizer(missing, add_special_tokens=False, truncation=True, max_length=self.max_length)
+            cache.update(zip(missing, encoded["input_ids"]))
+        return [cache[t] for t in texts]
+
+    def _encode_pretokenized(self, query_ids: List[int], doc_ids: List[List[int]]) -> dict:
+        """
+        Build pair encodings from token ids. Documents are cut to the room left
+        after the query and special tokens, which is what
+        tokenizer(pairs, truncation=True) does for any query shorter than half
+        of max_length; cutting them here also keeps prepare_for_model from
+        logging its overflowing-tokens warning for every long document.
+        """
+        budget = self.max_length - self.tokenizer.num_special_tokens_to_add(pair=True)
+        doc_budget = max(budget - len(query_ids), 0)
+        items = [
+            # longest_first only kicks in for queries too long to leave any room
+            self.tokenizer.prepare_for_model(
+                query_ids, ids[:doc_budget], truncation="longest_first", max_length=self.max_length
+            )
+            for ids in doc_ids
+        ]
+        return {key: [item[key] for item in items] for key in items[0]}
+
+    def _prepare_batch(self, encodings, batch_idx):
+        """Pad one batch of pre-tokenized pairs to its own longest pair (pinned on CUDA)."""
+        inputs = self.tokenizer.pad(
+            [{key: encodings[key][j] for key in encodings} for j in batch_idx],
+            padding=True,
+            return_tensors='pt'
+        )
+        if self._pin_memory:
+            return {key: val.pin_memory() for key, val in inputs.items()}
+        return dict(inputs)
+
+    def rerank(
+        self,
+        query: str,
+        chunks: List[dict],
+        top_k: int = None,
+        batch_size: int = 8,
+        query_ids: Optional[List[int]] = None
+    ) -> Tuple[List[int], List[float]]:
         """
         Rerank retrieved chunks using BGE cross-encoder.
-        Uses batch processing to avoid memory issues.
+        Uses batch processing to avoid memory issues. Pairs are tokenized once,
+        then batched in order of token length so each batch pads to a similar
+        length instead of to the longest pair overall. On CUDA the next batch
+        is padded into pinned memory while the current one runs.
 
         Args:
             query: User question
             chunks: List of chunk dictionaries (must have 'text' field)
             top_k: Number of results to return (None = return all)
             batch_size: Number of pairs to process at once (default 8 for memory efficiency)
+            query_ids: Pre-tokenized query from tokenize_query(); if given, documents
+                are taken from the token cache instead of re-tokenizing every pair
 
         Returns:
             Tuple of (reranked_indices, reranked_scores)
@@ -64,20 +157,33 @@ class BGEReranker:
             doc_text = chunk["text"]
             pairs.append([query, doc_text])
 
-        # Process in batches to avoid OOM
-        all_scores = []
-        for i in range(0, len(pairs), batch_size):
-            batch_pairs = pairs[i:i+batch_size]
-            
-            # Tokenize pairs for reranker
-            inputs = self.tokenizer(
-                batch_pairs,
-                padding=True,
-                truncation=True,
-                return_tensors='pt',
-                max_length=512
-            )
-            inputs = {key: val.to(self.device) for key, val in inputs.items()}
+        if not pairs:
+            return [], []
+
+        # Tokenize all pairs once without padding to get their lengths
+        # (transformers 5 dropped prepare_for_model: tokenize the pairs directly there)
+        if query_ids is not None and hasattr(self.tokenizer, "prepare_for_model"):
+            encodings = self._encode_pretokenized(query_ids, self.doc_token_ids([doc for _, doc in pairs]))
+        else:
+            encodings = self.tokenizer(pairs, truncation=True, max_length=self.max_length)
+        lengths = np.array([len(ids) for ids in encodings["input_ids"]])
+        order = np.argsort(lengths, kind="stable")
+
+        # Process in length-sorted batches to avoid OOM and padding waste
+        scores = np.empty(len(pairs), dtype=np.float64)
+        batches = [order[i:i+batch_size] for i in range(0, len(pairs), batch_size)]
+        executor = self._prefetch_executor
+
+        next_inputs = self._prepare_batch(encodings, batches[0])
+        for b, batch_idx in enumerate(batches):
+            inputs = {key: val.to(self.device, non_blocking=self._pin_memory) for key, val in next_inputs.items()}
+
+            # Start preparing the next batch before this forward pass
+            if b + 1 < len(batches):
+                if executor is not None:
+                    next_inputs = executor.submit(self._prepare_batch, encodings, batches[b + 1])
+                else:
+                    next_inputs = self._prepare_batch(encodings, batches[b + 1])
 
             # Get relevance scores from reranker
             with torch.no_grad():
@@ -91,9 +197,11 @@ class BGEReranker:
                 # If single output
                 batch_scores = logits.view(-1)
 
-            all_scores.extend(batch_scores.cpu().numpy().tolist())
-        
-        scores = np.array(all_scores)
+            # Scatter back to the original pair positions
+            scores[batch_idx] = batch_scores.float().cpu().numpy()
+
+            if executor is not None and b + 1 < len(batches):
+                next_inputs = next_inputs.result()
 
         # Sort the indices by score desc
         sorted_idx = np.argsort(-scores)
@@ -131,22 +239,30 @@ def retrieve_and_rerank(
     Returns:
         Tuple of (reranked_chunk_indices, reranked_scores)
     """
-    # Embed the query
-    q_emb = embed_model.encode([query])
+    def _search():
+        # Embed the query
+        q_emb = embed_model.encode([query])
+
+        # Normalize for IndexFlatIP (converts to cosine similarity)
+        q_emb = q_emb / np.linalg.norm(q_emb, axis=1, keepdims=True)
+        q_emb = np.array(q_emb, dtype=np.float32)
 
-    # Normalize for IndexFlatIP (converts to cosine similarity)
-    q_emb = q_emb / np.linalg.norm(q_emb, axis=1, keepdims=True)
-    q_emb = np.array(q_emb, dtype=np.float32)
+        # Search the FAISS index
+        distances, indices = index.search(q_emb, top_k)
+        return indices[0]  # indices of top_k retrieved chunks
 
-    # Search the FAISS index
-    distances, indices = index.search(q_emb, top_k)
-    top_indices = indices[0]  # indices of top_k retrieved chunks
+    # Embed + search on a worker thread while the reranker tokenizes the query
+    # (both release the GIL in their native code)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        search_future = pool.submit(_search)
+        query_ids = reranker.tokenize_query(query)
+        top_indices = search_future.result()
 
     # Get the corresponding chunks
     retrieved_chunks = [all_chunks[idx] for idx in top_indices]
 
-    # Rerank using BGE cross-encoder
-    reranked_local_indices, reranked_scores = reranker.rerank(query, retrieved_chunks, top_k=None)
+    # Rerank using BGE cross-encoder; candidate documents come from its token cache
+    reranked_local_indices, reranked_scores = reranker.rerank(query, retrieved_chunks, top_k=None, query_ids=query_ids)
 
     # Map back to global indices
     reranked_global_indices = [int(top_indices[i]) for i in reranked_local_indices]
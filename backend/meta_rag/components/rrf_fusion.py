@@ -2,9 +2,11 @@
 Reciprocal Rank Fusion - Extracted from META notebook
 """
 
+import heapq
 from collections import defaultdict
+from operator import itemgetter
 
-def rrf_fuse(rank_lists, k: int = 60):
+def rrf_fuse(rank_lists, k: int = 60, top_k: int = None):
     """
     Reciprocal Rank Fusion (RRF).
 
@@ -15,18 +17,26 @@ def rrf_fuse(rank_lists, k: int = 60):
     ]
 
     k: damping factor (standard RRF uses 60)
+    top_k: if given, only the top_k doc_ids are selected (heap, O(U log K))
 
     Returns:
         fused_list: list of doc_ids sorted by RRF score (descending)
     """
     scores = defaultdict(float)
 
+    # 1 / (k + rank + 1) depends only on the rank: compute it once per rank
+    # (rank is 0-based, so add 1)
+    max_len = max((len(r_list) for r_list in rank_lists), default=0)
+    weights = [1.0 / (k + rank + 1) for rank in range(max_len)]
+
     for r_list in rank_lists:
-        for rank, doc_id in enumerate(r_list):
-            # rank is 0-based, so add 1
-            scores[doc_id] += 1.0 / (k + rank + 1)
+        for doc_id, weight in zip(r_list, weights):
+            scores[doc_id] += weight
 
-    # Sort by fused score descending
-    fused = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    # Sort by fused score descending (both paths keep first-seen order on ties)
+    if top_k is not None:
+        fused = heapq.nlargest(top_k, scores.items(), key=itemgetter(1))
+    else:
+        fused = sorted(scores.items(), key=itemgetter(1), reverse=True)
     fused_list = [doc_id for doc_id, _ in fused]
     return fused_list
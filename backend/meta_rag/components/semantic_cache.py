@@ -0,0 +1,173 @@
+"""
+Semantic Response Cache
+Reuses LLM extraction results for near-duplicate texts (paraphrased or lightly
+revised chunks) that the exact-match llm_cache misses
+"""
+
+import os
+import re
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from .embedder import load_embedding_model
+from .llm_cache import DEFAULT_TTL_SECONDS
+
+# Opt in with METARAG_SEMANTIC_CACHE=1 (loads an embedding model for lookups)
+SEMANTIC_CACHE_ENABLED = os.getenv("METARAG_SEMANTIC_CACHE", "0") == "1"
+DEFAULT_SEMANTIC_CACHE_DIR = os.getenv(
+    "METARAG_SEMANTIC_CACHE_DIR",
+    str(Path.home() / ".cache" / "metarag" / "semantic_cache")
+)
+
+# Cosine similarity a stored text must reach to count as the same chunk
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+
+class SemanticCache:
+    """Nearest-neighbour cache: text embedding -> JSON-serializable value."""
+
+    def __init__(
+        self,
+        namespace: str,
+        model_name: str = "all-MiniLM-L6-v2",
+        cache_dir: str = DEFAULT_SEMANTIC_CACHE_DIR,
+        threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+        ttl: float = DEFAULT_TTL_SECONDS
+    ):
+        """
+        Open (or create) the cache for one namespace.
+
+        Args:
+            namespace: Separates tasks/models/prompt versions (e.g. "metadata-v4-open-mistral-7b")
+            model_name: SentenceTransformer model used to embed texts
+            cache_dir: Directory holding <namespace>.faiss and <namespace>.jsonl
+            threshold: Minimum cosine similarity for a hit
+            ttl: Seconds an entry stays valid, as in LLMCache (<= 0 disables expiry)
+        """
+        self.embed_model = load_embedding_model(model_name)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        safe_name = re.sub(r"[^\w.-]", "_", namespace)
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        self._index_path = Path(cache_dir) / f"{safe_name}.faiss"
+        self._values_path = Path(cache_dir) / f"{safe_name}.jsonl"
+
+        self._lock = threading.Lock()
+        # Embeddings of looked-up texts that missed, reused by add()
+        self._pending: Dict[str, np.ndarray] = {}
+        self._dirty = False
+
+        # values[i] belongs to index row i; created_at[i] is its write time
+        # (None for entries written before timestamps were stored: never expire)
+        self.values: List[Any] = []
+        self.created_at: List[Optional[float]] = []
+        if self._index_path.exists() and self._values_path.exists():
+            self.index = faiss.read_index(str(self._index_path))
+            with open(self._values_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if isinstance(entry, dict) and entry.keys() == {"value", "created_at"}:
+                        self.values.append(entry["value"])
+                        self.created_at.append(entry["created_at"])
+                    else:
+                        self.values.append(entry)
+                        self.created_at.append(None)
+            self._drop_expired()
+        else:
+            dim = self.embed_model.get_sentence_embedding_dimension()
+            self.index = faiss.IndexFlatIP(dim)
+
+    def _expired(self, i: int) -> bool:
+        """True if entry i is older than the TTL."""
+        created = self.created_at[i]
+        return self.ttl > 0 and created is not None and time.time() - created > self.ttl
+
+    def _drop_expired(self):
+        """Rebuild the index without expired entries (rewritten on the next save())."""
+        keep = [i for i in range(len(self.values)) if not self._expired(i)]
+        if len(keep) == len(self.values):
+            return
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        self.index = faiss.IndexFlatIP(self.index.d)
+        if keep:
+            self.index.add(vectors[keep])
+        self.values = [self.values[i] for i in keep]
+        self.created_at = [self.created_at[i] for i in keep]
+        self._dirty = True
+
+    def _embed(self, text: str) -> np.ndarray:
+        """L2-normalized (1, d) float32 embedding, so inner product is cosine similarity."""
+        return self.embed_model.encode(
+            [text], convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32, copy=False)
+
+    def get(self, text: str) -> Optional[Any]:
+        """Return the value stored for the most similar text, or None below the threshold or past the TTL."""
+        emb = self._embed(text)
+        with self._lock:
+            if self.index.ntotal:
+                scores, ids = self.index.search(emb, 1)
+                if ids[0][0] >= 0 and scores[0][0] >= self.threshold and not self._expired(ids[0][0]):
+                    self.hits += 1
+                    return self.values[ids[0][0]]
+            self.misses += 1
+            self._pending[text] = emb
+        return None
+
+    def add(self, text: str, value: Any):
+        """Store value for text (reuses the embedding from a preceding get() miss)."""
+        with self._lock:
+            emb = self._pending.pop(text, None)
+        if emb is None:
+            emb = self._embed(text)
+        with self._lock:
+            self.index.add(emb)
+            self.values.append(value)
+            self.created_at.append(time.time())
+            self._dirty = True
+
+    def save(self):
+        """Write the index and values to disk if anything was added."""
+        with self._lock:
+            if not self._dirty:
+                return
+            faiss.write_index(self.index, str(self._index_path))
+            with open(self._values_path, "w", encoding="utf-8") as f:
+                for value, created in zip(self.values, self.created_at):
+                    f.write(json.dumps({"value": value, "created_at": created}, ensure_ascii=False) + "\n")
+            self._dirty = False
+
+    def stats(self) -> dict:
+        """Hit/miss counters for this process."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def get_semantic_cache(namespace: str, enabled: Optional[bool] = None) -> Optional[SemanticCache]:
+    """
+    Open a SemanticCache, or return None if it is disabled or cannot be loaded.
+
+    Args:
+        namespace: Cache namespace (see SemanticCache)
+        enabled: Override METARAG_SEMANTIC_CACHE
+    """
+    if not (SEMANTIC_CACHE_ENABLED if enabled is None else enabled):
+        return None
+    try:
+        return SemanticCache(namespace)
+    except Exception as e:
+        print(f"⚠️  Semantic cache unavailable ({e}), continuing without it")
+        return None
@@ -7,11 +7,30 @@ Augments chunk text with TF-IDF weighted keywords for better retrieval
 from sentence_transformers import SentenceTransformer
 from sklearn.feature_extraction.text import TfidfVectorizer
 import numpy as np
-import pandas as pd
+import torch
 import json, os, time
+import hashlib
+import pickle
 
 # Load embedding model
 embed_model = SentenceTransformer('all-MiniLM-L6-v2')
+if embed_model.device.type == "cuda":
+    embed_model.half()  # fp16 inference; encode() still returns float32
+    # Fused Inductor kernels + CUDA graphs for the one big encode() pass;
+    # dynamic=True avoids recompiling for every padded batch length
+    if hasattr(torch, "compile") and tuple(int(v) for v in torch.__version__.split(".")[:2]) >= (2, 1):
+        eager_model = embed_model[0].auto_model
+        try:
+            embed_model[0].auto_model = torch.compile(
+                eager_model, mode="reduce-overhead", dynamic=True
+            )
+            # Compilation happens lazily on the first forward pass, so run one
+            # here: backend failures (no Triton, unsupported GPU) surface now
+            embed_model.encode(["warm-up"], convert_to_numpy=True)
+            print("⚡ Compiled embedding model with torch.compile")
+        except Exception as e:
+            embed_model[0].auto_model = eager_model
+            print(f"⚠️  torch.compile unavailable ({e}), using eager mode")
 print("✅ Embedding model loaded.")
 
 # Initialize text variants
@@ -22,10 +41,88 @@ texts_prefix = []
 # Extract base text from each chunk
 corpus_texts = [chunk["text"] for chunk in all_chunks]
 
-# Compute TF-IDF top keywords across all chunks
-vectorizer = TfidfVectorizer(max_features=50, stop_words='english')
-X = vectorizer.fit_transform(corpus_texts)
+# Compute TF-IDF top keywords across all chunks.
+# The fitted vocabulary + IDF weights are persisted and reused on later runs,
+# one file per corpus location (the directory holding its documents) under
+# the user cache dir, so adding documents keeps using the same file. They are
+# refit only when the corpus' term usage drifts from what they were fitted
+# on: the share of document frequency per vocabulary term moves by more than
+# TFIDF_REFIT_DRIFT (total variation distance), or chunks contain that much
+# fewer vocabulary terms on average.
+TFIDF_CACHE_DIR = os.getenv(
+    "METARAG_TFIDF_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "metarag", "tfidf")
+)
+try:
+    _corpus_dir = os.path.commonpath([
+        os.path.dirname(os.path.abspath(chunk["doc"])) for chunk in all_chunks if chunk.get("doc")
+    ])
+except ValueError:  # no document paths, or paths on different drives
+    _corpus_dir = os.getcwd()
+_corpus_key = hashlib.sha256(_corpus_dir.encode("utf-8")).hexdigest()[:16]
+TFIDF_VECTORIZER_PATH = os.getenv(
+    "METARAG_TFIDF_VECTORIZER_PATH",
+    os.path.join(TFIDF_CACHE_DIR, f"tfidf_vectorizer-{_corpus_key}.pkl")
+)
+TFIDF_REFIT_DRIFT = 0.2
+
+
+def _pretokenized(tokens):
+    """Analyzer for token lists that are already lowercased and stop-word filtered."""
+    return tokens
+
+
+def _term_profile(X):
+    """Document-frequency share per vocabulary term and mean vocabulary terms per chunk."""
+    df = np.bincount(X.indices, minlength=X.shape[1]).astype(np.float64)
+    df_share = df / df.sum() if df.sum() else df
+    return df_share, X.nnz / max(X.shape[0], 1)
+
+
+# Tokenize once: the drift check and a refit both work from these tokens
+_analyze = TfidfVectorizer(stop_words='english').build_analyzer()
+corpus_tokens = [_analyze(text) for text in corpus_texts]
+
+vectorizer = None
+if os.path.exists(TFIDF_VECTORIZER_PATH):
+    try:
+        with open(TFIDF_VECTORIZER_PATH, "rb") as f:
+            cached = pickle.load(f)
+        vectorizer = TfidfVectorizer(analyzer=_pretokenized, vocabulary=cached["vocabulary"])
+        vectorizer.idf_ = cached["idf"]
+        fit_df_share, fit_terms_per_chunk = cached["df_share"], cached["terms_per_chunk"]
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError, ValueError) as e:
+        print(f"⚠️  Could not load cached TF-IDF vectorizer ({e}), refitting")
+        vectorizer = None
+
+if vectorizer is not None:
+    # The check's matrix is the one used below when no refit is needed
+    X = vectorizer.transform(corpus_tokens)
+    df_share, terms_per_chunk = _term_profile(X)
+    df_drift = 0.5 * float(np.abs(df_share - fit_df_share).sum()) if df_share.sum() else 1.0
+    coverage_drop = 1.0 - terms_per_chunk / fit_terms_per_chunk if fit_terms_per_chunk else 0.0
+    if max(df_drift, coverage_drop) > TFIDF_REFIT_DRIFT:
+        print(f"🔄 TF-IDF vocabulary drift (term share moved {df_drift:.0%}, "
+              f"coverage down {max(coverage_drop, 0.0):.0%}), refitting")
+        vectorizer = None
+    else:
+        print(f"✅ Reused TF-IDF vectorizer from {TFIDF_VECTORIZER_PATH}")
+
+if vectorizer is None:
+    vectorizer = TfidfVectorizer(analyzer=_pretokenized, max_features=50)
+    X = vectorizer.fit_transform(corpus_tokens)
+    fit_df_share, fit_terms_per_chunk = _term_profile(X)
+    os.makedirs(os.path.dirname(TFIDF_VECTORIZER_PATH) or ".", exist_ok=True)
+    with open(TFIDF_VECTORIZER_PATH, "wb") as f:
+        pickle.dump({
+            "vocabulary": vectorizer.vocabulary_,
+            "idf": vectorizer.idf_,
+            "df_share": fit_df_share,
+            "terms_per_chunk": fit_terms_per_chunk,
+        }, f)
 feature_names = vectorizer.get_feature_names_out()
+# Read the CSR arrays directly instead of materializing a row matrix per chunk
+indptr, indices, data = X.indptr, X.indices, X.data
 
 # Prepare all chunks with 3 styles
 for i, chunk in enumerate(all_chunks):
@@ -33,13 +130,17 @@ for i, chunk in enumerate(all_chunks):
     texts_content.append(content)
 
     # TF-IDF weighted keywords
-    row = X.getrow(i)
+    start, end = indptr[i], indptr[i + 1]
     top_terms = []
-    if row.getnnz() > 0:
-        nz_indices = row.indices
-        nz_weights = row.data
-        sorted_idx = np.argsort(nz_weights)[::-1]
-        top_terms = [feature_names[nz_indices[idx]] for idx in sorted_idx[:5]]
+    if end > start:
+        nz_indices = indices[start:end]
+        nz_weights = data[start:end]
+        # Partial sort: only the top 5 weights need ordering
+        top_idx = np.arange(end - start)
+        if end - start > 5:
+            top_idx = np.argpartition(-nz_weights, 5)[:5]
+        top_idx = top_idx[np.argsort(nz_weights[top_idx])[::-1]]
+        top_terms = list(feature_names[nz_indices[top_idx]])
 
     weighted_text = content
     if top_terms:
@@ -57,23 +158,41 @@ for i, chunk in enumerate(all_chunks):
 
 # --- Embed (choose best strategy: tfidf for retrieval strength) ---
 print("🧠 Computing semantic embeddings...")
-embeddings = embed_model.encode(texts_tfidf, show_progress_bar=True, convert_to_numpy=True)
-
-# Attach embedding to each chunk
-for i, emb in enumerate(embeddings):
-    all_chunks[i]["embedding"] = emb.tolist()
+EMBEDDINGS_MATRIX = embed_model.encode(
+    texts_tfidf,
+    batch_size=128,
+    show_progress_bar=True,
+    convert_to_numpy=True,
+    normalize_embeddings=True
+).astype(np.float32, copy=False)
+
+# Keep the vectors in one contiguous (N, d) matrix (ready for faiss index.add)
+# and store only each chunk's row number instead of a per-chunk float list
+for i, chunk in enumerate(all_chunks):
+    chunk["embedding_row"] = i
 
-print("✅ Embeddings attached.")
+print("✅ Embeddings computed.")
 
 # --- Add metadata & citation for GEAR ---
-from tqdm import tqdm
-tqdm.pandas()
-
+# Chunks come grouped by document (and by page/block within it), so resolve
+# each doc path and citation string once and reuse it for the repeats
+_basename_cache = {}
+_citation_cache = {}
 for i, chunk in enumerate(all_chunks):
     chunk["chunk_id"] = i
-    chunk["doc_name"] = os.path.basename(chunk.get("doc", "")) or "Unknown document"
+    doc = chunk.get("doc", "")
+    doc_name = _basename_cache.get(doc)
+    if doc_name is None:
+        doc_name = _basename_cache[doc] = os.path.basename(doc) or "Unknown document"
+    chunk["doc_name"] = doc_name
+
     page = chunk.get("page")
     block_idx = chunk.get("block_index")
-    chunk["citation"] = f"{chunk['doc_name']} – page {page}, block {block_idx}" if page is not None else chunk["doc_name"]
+    citation_key = (doc_name, page, block_idx)
+    citation = _citation_cache.get(citation_key)
+    if citation is None:
+        citation = f"{doc_name} – page {page}, block {block_idx}" if page is not None else doc_name
+        _citation_cache[citation_key] = citation
+    chunk["citation"] = citation
 
 
@@ -0,0 +1,574 @@
+"""
+Metadata Extraction Base
+Provider-independent part of the metadata extractors: caching, parsing,
+oversized-chunk splitting, batching and the concurrent enrich_chunks() run.
+Subclasses only implement the API calls
+"""
+
+import json
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from tqdm import tqdm
+
+from ..components.llm_cache import PROMPT_VERSION, LLMCache, get_llm_cache, normalize_text
+from ..components.async_runner import run_sync
+from .metadata_regex import is_informative, regex_extract_fields
+from ..components.rate_limiter import (
+    RateLimiter, batch_by_token_budget, estimate_tokens, resolve_rate_limits
+)
+
+logger = logging.getLogger(__name__)
+
+# Semantic cache needs faiss + sentence-transformers; optional for extraction
+try:
+    from ..components.semantic_cache import get_semantic_cache
+except ImportError:
+    get_semantic_cache = None
+
+# orjson parses model output faster; its JSONDecodeError subclasses json's,
+# so the existing except clauses cover both
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# The 12 metadata fields, in output order; LIST_FIELDS default to [], the rest to ""
+METADATA_FIELDS = [
+    "summary", "keywords", "entities", "effective_date", "fund_codes",
+    "ilcs_citations", "title", "category", "sub_category", "topic",
+    "year", "content_type"
+]
+LIST_FIELDS = {"keywords", "entities", "fund_codes", "ilcs_citations"}
+# Fields the local extractor cannot fill; chunks it handles still get these
+# from the API, in short classification-only requests
+CLASSIFICATION_FIELDS = ["category", "sub_category", "topic", "content_type"]
+# Chunks per classification request (the answers are a few words each)
+CLASSIFY_CHUNKS_PER_REQUEST = 8
+
+# Chunks estimated above this many tokens are extracted in halves and merged,
+# so one oversized chunk doesn't come back as truncated, unparsable JSON
+MAX_CHUNK_TOKENS = 3000
+
+
+class BaseMetadataExtractor:
+    """
+    Shared extract/parse/cache pipeline of the API metadata extractors.
+
+    Subclasses set provider_name and rate_tiers, call
+    _init_caches() from __init__, and implement _call_llm(),
+    _call_llm_async(), _call_llm_batch_async() and (for chunks a local
+    extractor handles) _call_classify()/_call_classify_async(). The calls
+    return the raw JSON text of the response and raise on failure.
+    """
+
+    provider_name = ""
+    rate_tiers: Dict[str, Tuple[int, int]] = {}
+
+    def _init_caches(self, model_name: str, semantic_cache: Optional[bool] = None, local_extractor=None):
+        """
+        Set up the response caches and the optional local extractor.
+
+        Args:
+            model_name: Model name, part of every cache key
+            semantic_cache: Reuse metadata of near-duplicate chunks
+                (default: METARAG_SEMANTIC_CACHE env var)
+            local_extractor: Optional LocalMetadataExtractor tried before the API
+        """
+        self.model_name = model_name
+        # On-disk response cache shared across runs (None if disabled)
+        self.cache = get_llm_cache()
+        # Near-duplicate lookup behind the exact cache (opt-in, None if disabled);
+        # keyed by prompt version like the exact cache, so prompt changes start fresh
+        self.semantic_cache = (
+            get_semantic_cache(f"metadata-{PROMPT_VERSION}-{model_name}", enabled=semantic_cache)
+            if get_semantic_cache is not None else None
+        )
+        self.local_extractor = local_extractor
+
+    def _call_llm(self, chunk_text: str) -> str:
+        """Request metadata for one chunk; returns the response's JSON text."""
+        raise NotImplementedError
+
+    async def _call_llm_async(self, chunk_text: str, limiter: Optional[RateLimiter] = None) -> str:
+        """Async variant of _call_llm(), awaiting limiter before each request."""
+        raise NotImplementedError
+
+    async def _call_llm_batch_async(self, chunk_texts: List[str], limiter: Optional[RateLimiter] = None) -> str:
+        """Request metadata for several chunks at once; returns the JSON list (or {"items": [...]})."""
+        raise NotImplementedError
+
+    def _call_classify(self, chunk_texts: List[str]) -> str:
+        """Request only CLASSIFICATION_FIELDS for the chunks; returns the JSON list (or {"items": [...]})."""
+        raise NotImplementedError
+
+    async def _call_classify_async(self, chunk_texts: List[str], limiter: Optional[RateLimiter] = None) -> str:
+        """Async variant of _call_classify(), awaiting limiter before the request."""
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def _async_session(self):
+        """Per-run setup around the async calls (e.g. a client bound to the running loop)."""
+        yield
+
+    def _cache_key(self, chunk_text: str) -> Optional[str]:
+        """Exact-cache key for a chunk (model + normalized text), or None when caching is off."""
+        if self.cache is None:
+            return None
+        return LLMCache.make_key("metadata", self.model_name, normalize_text(chunk_text))
+
+    def _cache_lookup(self, key: Optional[str], chunk_text: str) -> Optional[Dict]:
+        """
+        Cached metadata for the chunk (exact match first, then near-duplicate), or None.
+        Near-duplicate hits are not copied into the exact cache, so a paraphrase
+        never gets pinned to another chunk's metadata under its own key.
+        """
+        metadata = self.cache.get(key) if key is not None else None
+        if metadata is None and self.semantic_cache is not None:
+            metadata = self.semantic_cache.get(chunk_text)
+        return metadata
+
+    def _cache_store(self, key: Optional[str], chunk_text: str, metadata: Dict):
+        """Cache metadata unless it is the all-empty fallback (errors are retried next run)."""
+        if not any(metadata.values()):
+            return
+        if key is not None:
+            self.cache.set(key, metadata)
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(chunk_text, metadata)
+
+    def _empty_metadata(self) -> Dict:
+        """Return the metadata dict with every expected field left empty."""
+        return {k: [] if k in LIST_FIELDS else "" for k in METADATA_FIELDS}
+
+    def _split_oversized(self, chunk_text: str) -> List[str]:
+        """Split chunk_text in two at the line break (else space) nearest before the middle."""
+        mid = len(chunk_text) // 2
+        cut = chunk_text.rfind("\n", 0, mid)
+        if cut < mid // 2:
+            cut = chunk_text.rfind(" ", 0, mid)
+        if cut <= 0:
+            cut = mid
+        return [chunk_text[:cut].strip(), chunk_text[cut:].strip()]
+
+    def _merge_metadata(self, parts: List[Dict]) -> Dict:
+        """Merge metadata of consecutive pieces: lists are unioned, scalars keep the first non-empty value."""
+        merged = self._empty_metadata()
+        for metadata in parts:
+            for k, v in metadata.items():
+                if isinstance(v, list):
+                    merged[k] = list(dict.fromkeys((merged.get(k) or []) + v))
+                elif v and not merged.get(k):
+                    merged[k] = v
+        return merged
+
+    def _parse_metadata(self, output_text: str) -> Dict:
+        """
+        Parse the model output (JSON mode / schema-constrained) into a metadata dict.
+        Falls back to empty metadata if the output is not valid JSON, e.g.
+        when the response was cut off at the output token limit.
+        """
+        try:
+            metadata = _loads(output_text)
+
+            # Ensure all expected keys exist with sane defaults
+            for k in METADATA_FIELDS:
+                if k not in metadata:
+                    metadata[k] = [] if k in LIST_FIELDS else ""
+
+            return metadata
+
+        except json.JSONDecodeError as e:
+            logger.warning("JSON decode error: %s; output (truncated): %.300s", e, output_text)
+        except Exception:
+            logger.exception("Unexpected error parsing metadata")
+
+        # Fallback on any error
+        return self._empty_metadata()
+
+    def _parse_metadata_list(self, output_text: str, expected: int) -> Optional[List[Dict]]:
+        """
+        Parse the metadata objects of a multi-chunk response, given as a JSON
+        array or as {"items": [...]}. Returns None if it is not a list of
+        exactly `expected` objects.
+        """
+        try:
+            items = _loads(output_text)
+        except json.JSONDecodeError:
+            return None
+        if isinstance(items, dict):
+            items = items.get("items")
+        if not isinstance(items, list) or len(items) != expected or not all(isinstance(m, dict) for m in items):
+            return None
+
+        empty = self._empty_metadata()
+        return [{**empty, **metadata} for metadata in items]
+
+    def _extract_llm_fields(self, chunk_text: str) -> Dict:
+        """
+        Call the API to extract the LLM-only metadata fields from chunk_text, return parsed JSON.
+        (REGEX_FIELDS are filled in locally by extract_metadata().)
+        """
+        chunk_text = (chunk_text or "").strip()
+
+        # Skip very short / useless chunks to save time and tokens
+        if not is_informative(chunk_text):
+            return self._empty_metadata()
+
+        key = self._cache_key(chunk_text)
+        cached = self._cache_lookup(key, chunk_text)
+        if cached is not None:
+            return cached
+
+        if estimate_tokens(chunk_text) > MAX_CHUNK_TOKENS:
+            metadata = self._merge_metadata(
+                [self._extract_llm_fields(part) for part in self._split_oversized(chunk_text)]
+            )
+            self._cache_store(key, chunk_text, metadata)
+            return metadata
+
+        try:
+            output_text = self._call_llm(chunk_text)
+        except Exception:
+            logger.exception("Metadata request failed")
+            return self._empty_metadata()
+
+        metadata = self._parse_metadata(output_text)
+        self._cache_store(key, chunk_text, metadata)
+        return metadata
+
+    async def _extract_llm_fields_async(self, chunk_text: str, limiter: Optional[RateLimiter] = None) -> Dict:
+        """
+        Async variant of _extract_llm_fields(); run it inside _async_session().
+
+        Args:
+            chunk_text: Chunk text to extract metadata from
+            limiter: Optional RPM/TPM limiter awaited before the request
+
+        Returns:
+            Parsed metadata dict (empty fields on any error)
+        """
+        chunk_text = (chunk_text or "").strip()
+
+        if not is_informative(chunk_text):
+            return self._empty_metadata()
+
+        key = self._cache_key(chunk_text)
+        cached = self._cache_lookup(key, chunk_text)
+        if cached is not None:
+            return cached
+
+        if estimate_tokens(chunk_text) > MAX_CHUNK_TOKENS:
+            parts = await asyncio.gather(
+                *(self._extract_llm_fields_async(part, limiter) for part in self._split_oversized(chunk_text))
+            )
+            metadata = self._merge_metadata(parts)
+            self._cache_store(key, chunk_text, metadata)
+            return metadata
+
+        try:
+            output_text = await self._call_llm_async(chunk_text, limiter)
+        except Exception as e:
+            logger.warning("Metadata request failed: %s", e)
+            return self._empty_metadata()
+
+        metadata = self._parse_metadata(output_text)
+        self._cache_store(key, chunk_text, metadata)
+        return metadata
+
+    async def _extract_llm_fields_many_async(
+        self,
+        chunk_texts: List[str],
+        limiter: Optional[RateLimiter] = None
+    ) -> List[Dict]:
+        """
+        Extract metadata for several chunks with a single request, so the
+        instructions are sent once instead of once per chunk. Uninformative and cached
+        chunks are answered locally; if the response is not a list of the
+        expected length, the uncached chunks are retried one request each.
+
+        Args:
+            chunk_texts: Chunk texts to extract metadata from
+            limiter: Optional RPM/TPM limiter awaited before each request
+
+        Returns:
+            Metadata dicts aligned with chunk_texts
+        """
+        results = [None] * len(chunk_texts)
+        pending = []  # (position, text, cache key)
+        oversized = []  # positions
+        for i, text in enumerate(chunk_texts):
+            text = (text or "").strip()
+            if not is_informative(text):
+                results[i] = self._empty_metadata()
+                continue
+            if estimate_tokens(text) > MAX_CHUNK_TOKENS:
+                # Oversized chunks take the single-chunk path, which splits them
+                oversized.append(i)
+                continue
+            key = self._cache_key(text)
+            cached = self._cache_lookup(key, text)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append((i, text, key))
+
+        parsed = None
+        if len(pending) > 1:
+            try:
+                output_text = await self._call_llm_batch_async([text for _, text, _ in pending], limiter)
+                parsed = self._parse_metadata_list(output_text, len(pending))
+            except Exception as e:
+                logger.warning("Batch request failed: %s", e)
+            if parsed is None:
+                logger.debug("Batch of %d not parsed, retrying chunks individually", len(pending))
+
+        if parsed is not None:
+            for (i, text, key), metadata in zip(pending, parsed):
+                self._cache_store(key, text, metadata)
+                results[i] = metadata
+        else:
+            for i, text, _ in pending:
+                results[i] = await self._extract_llm_fields_async(text, limiter)
+        for i in oversized:
+            results[i] = await self._extract_llm_fields_async(chunk_texts[i], limiter)
+
+        return results
+
+    def _classify_prepare(self, chunk_texts: List[str]):
+        """Cached classifications for chunk_texts, plus the (position, text, key) still to request."""
+        results = [None] * len(chunk_texts)
+        pending = []
+        for i, text in enumerate(chunk_texts):
+            text = (text or "").strip()
+            key = (
+                LLMCache.make_key("metadata_classification", self.model_name, normalize_text(text))
+                if self.cache is not None else None
+            )
+            cached = self.cache.get(key) if key is not None else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append((i, text, key))
+        return results, pending
+
+    def _classify_finish(self, results: List[Optional[Dict]], pending, output_text: Optional[str]) -> List[Dict]:
+        """Fill results from the classification response; requested chunks stay empty if it did not parse."""
+        parsed = self._parse_metadata_list(output_text, len(pending)) if output_text is not None else None
+        if parsed is None and pending:
+            logger.warning("Classification of %d chunks not parsed; fields left empty", len(pending))
+        for n, (i, _, key) in enumerate(pending):
+            fields = {k: parsed[n][k] if parsed is not None else "" for k in CLASSIFICATION_FIELDS}
+            if key is not None and any(fields.values()):
+                self.cache.set(key, fields)
+            results[i] = fields
+        return results
+
+    def _classify_many(self, chunk_texts: List[str]) -> List[Dict]:
+        """CLASSIFICATION_FIELDS for each chunk (cached, else one API request for all uncached chunks)."""
+        results, pending = self._classify_prepare(chunk_texts)
+        output_text = None
+        if pending:
+            try:
+                output_text = self._call_classify([text for _, text, _ in pending])
+            except Exception:
+                logger.exception("Classification request failed")
+        return self._classify_finish(results, pending, output_text)
+
+    async def _classify_many_async(self, chunk_texts: List[str], limiter: Optional[RateLimiter] = None) -> List[Dict]:
+        """Async variant of _classify_many()."""
+        results, pending = self._classify_prepare(chunk_texts)
+        output_text = None
+        if pending:
+            try:
+                output_text = await self._call_classify_async([text for _, text, _ in pending], limiter)
+            except Exception as e:
+                logger.warning("Classification request failed: %s", e)
+        return self._classify_finish(results, pending, output_text)
+
+    def extract_metadata(self, chunk_text: str) -> Dict:
+        """
+        Extract all 12 metadata fields from chunk_text: REGEX_FIELDS locally,
+        the rest with the local extractor if it is confident (the API then
+        only classifies the chunk), else with the API.
+        """
+        llm_fields = None
+        if self.local_extractor is not None:
+            llm_fields = self.local_extractor.extract_many([chunk_text])[0]
+            if llm_fields is not None and is_informative((chunk_text or "").strip()):
+                llm_fields = {**llm_fields, **self._classify_many([chunk_text])[0]}
+        if llm_fields is None:
+            llm_fields = self._extract_llm_fields(chunk_text)
+        return {**llm_fields, **regex_extract_fields(chunk_text)}
+
+    async def extract_metadata_async(self, chunk_text: str, limiter: Optional[RateLimiter] = None) -> Dict:
+        """Async variant of extract_metadata() (see _extract_llm_fields_async for arguments)."""
+        llm_fields = await self._extract_llm_fields_async(chunk_text, limiter)
+        return {**llm_fields, **regex_extract_fields(chunk_text)}
+
+    async def extract_metadata_many_async(
+        self,
+        chunk_texts: List[str],
+        limiter: Optional[RateLimiter] = None
+    ) -> List[Dict]:
+        """Multi-chunk variant of extract_metadata_async() (see _extract_llm_fields_many_async)."""
+        llm_fields = await self._extract_llm_fields_many_async(chunk_texts, limiter)
+        return [{**fields, **regex_extract_fields(text)} for fields, text in zip(llm_fields, chunk_texts)]
+
+    async def _enrich_chunks_async(
+        self,
+        chunks: List[Dict],
+        max_concurrency: int,
+        verbose: bool,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        chunks_per_request: int = 1,
+        max_input_tokens: int = 6000
+    ) -> List[Dict]:
+        """
+        Run metadata extraction for all chunks with at most max_concurrency
+        requests in flight, paced to the rpm/tpm quota when given. With
+        chunks_per_request > 1, chunks are sent in groups bounded by
+        max_input_tokens.
+        """
+        limiter = RateLimiter(rpm, tpm) if (rpm or tpm) else None
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        # Chunks without text are passed through unchanged; chunks whose text
+        # only differs in whitespace/case share one extraction
+        metadata_by_pos = [None] * len(chunks)
+        positions_by_text: Dict[str, List[int]] = defaultdict(list)
+        for i, chunk in enumerate(chunks):
+            if chunk.get("text", ""):
+                positions_by_text[normalize_text(chunk["text"])].append(i)
+        text_positions = [positions[0] for positions in positions_by_text.values()]
+
+        # Chunks the local models handle confidently only go to the API for
+        # CLASSIFICATION_FIELDS, several per short request
+        classify_groups = []
+        if self.local_extractor is not None:
+            local_results = self.local_extractor.extract_many([chunks[i]["text"] for i in text_positions])
+            for i, llm_fields in zip(text_positions, local_results):
+                if llm_fields is not None:
+                    metadata_by_pos[i] = {**llm_fields, **regex_extract_fields(chunks[i]["text"])}
+            api_positions = [i for i in text_positions if metadata_by_pos[i] is None]
+            classify_positions = [
+                i for i in text_positions
+                if metadata_by_pos[i] is not None and is_informative(chunks[i]["text"].strip())
+            ]
+            classify_groups = batch_by_token_budget(
+                classify_positions, CLASSIFY_CHUNKS_PER_REQUEST, max_input_tokens, text_of=lambda i: chunks[i]["text"]
+            )
+            if verbose:
+                print(f"🖥️  {len(text_positions) - len(api_positions)} chunks extracted locally "
+                      f"({len(classify_groups)} classification requests), {len(api_positions)} sent to the API")
+            text_positions = api_positions
+
+        pbar = (
+            tqdm(total=len(chunks), desc=f"🔍 Extracting metadata ({self.provider_name})", unit="chunk")
+            if verbose else None
+        )
+        if pbar is not None:
+            pbar.update(len(chunks) - len(text_positions))
+        groups = batch_by_token_budget(
+            text_positions, max(1, chunks_per_request), max_input_tokens, text_of=lambda i: chunks[i]["text"]
+        )
+
+        async def _enrich_group(group: List[int]):
+            texts = [chunks[i]["text"] for i in group]
+            async with semaphore:
+                if len(group) == 1:
+                    results = [await self.extract_metadata_async(texts[0], limiter)]
+                else:
+                    results = await self.extract_metadata_many_async(texts, limiter)
+            for i, metadata in zip(group, results):
+                metadata_by_pos[i] = metadata
+            if pbar is not None:
+                pbar.update(len(group))
+
+        async def _classify_group(group: List[int]):
+            async with semaphore:
+                results = await self._classify_many_async([chunks[i]["text"] for i in group], limiter)
+            for i, fields in zip(group, results):
+                metadata_by_pos[i].update(fields)
+
+        try:
+            async with self._async_session():
+                await asyncio.gather(
+                    *(_enrich_group(group) for group in groups),
+                    *(_classify_group(group) for group in classify_groups)
+                )
+            for positions in positions_by_text.values():
+                for i in positions[1:]:
+                    # Regex fields still come from each chunk's own text
+                    metadata_by_pos[i] = {
+                        **metadata_by_pos[positions[0]], **regex_extract_fields(chunks[i]["text"])
+                    }
+            # Merge metadata into chunks, keeping input order
+            return [
+                {**chunk, **metadata} if metadata is not None else chunk
+                for chunk, metadata in zip(chunks, metadata_by_pos)
+            ]
+        finally:
+            if pbar is not None:
+                pbar.close()
+
+    def enrich_chunks(
+        self,
+        chunks: List[Dict],
+        max_concurrency: int = 8,
+        batch_size: int = 10,
+        verbose: bool = True,
+        rate_tier: Optional[str] = None,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        chunks_per_request: int = 1,
+        max_input_tokens: int = 6000
+    ) -> List[Dict]:
+        """
+        Enrich chunks with metadata from the API.
+
+        Requests are issued concurrently (bounded by max_concurrency) instead of
+        one at a time with a fixed sleep between calls.
+
+        Args:
+            chunks: List of chunk dictionaries
+            max_concurrency: Maximum number of in-flight API requests
+            batch_size: Number of chunks to process before showing progress (unused, kept for compatibility)
+            verbose: Print progress messages
+            rate_tier: Quota tier from the provider's rate tiers (sets rpm/tpm defaults)
+            rpm: Requests-per-minute limit (overrides the tier)
+            tpm: Input-tokens-per-minute limit (overrides the tier)
+            chunks_per_request: Chunks extracted per API request (1 = one request per chunk)
+            max_input_tokens: Estimated input-token cap for a multi-chunk request
+
+        Returns:
+            List of enriched chunks (same order as input)
+        """
+        rpm, tpm = resolve_rate_limits(self.rate_tiers, rate_tier, rpm, tpm)
+        enriched_chunks = list(run_sync(self._enrich_chunks_async(
+            chunks,
+            max_concurrency=max_concurrency,
+            verbose=verbose,
+            rpm=rpm,
+            tpm=tpm,
+            chunks_per_request=chunks_per_request,
+            max_input_tokens=max_input_tokens
+        )))
+
+        if verbose:
+            print(f"✅ Enriched {len(enriched_chunks)} chunks with metadata ({self.provider_name})")
+            if self.cache is not None:
+                stats = self.cache.stats()
+                print(f"💾 Metadata cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+            if self.semantic_cache is not None:
+                stats = self.semantic_cache.stats()
+                print(f"💾 Semantic cache: {stats['hits']} near-duplicate hits, {stats['misses']} misses")
+
+        if self.semantic_cache is not None:
+            self.semantic_cache.save()
+
+        return enriched_chunks
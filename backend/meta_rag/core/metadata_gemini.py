@@ -4,23 +4,107 @@ Extracts the same 12 metadata fields as Mistral version for fair comparison
 """
 
 import os
+import re
 import json
 import time
+import logging
+import random
+import asyncio
 from typing import Dict, List, Optional
 import google.generativeai as genai
-from tqdm import tqdm
-
-
-class GeminiMetadataExtractor:
+from google.api_core import exceptions as google_exceptions
+
+from ..components.json_stream import JsonStreamBuffer
+from ..components.rate_limiter import GEMINI_RATE_TIERS, RateLimiter, estimate_tokens
+from .metadata_base import CLASSIFICATION_FIELDS, BaseMetadataExtractor
+
+logger = logging.getLogger(__name__)
+
+# Transient errors worth retrying; anything else (bad request, permission
+# denied, blocked or empty response) fails on the first attempt
+_RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,    # 429 quota / rate limit
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+)
+_MAX_ATTEMPTS = 5
+_BACKOFF_BASE = 1.0   # seconds, doubled per attempt
+_BACKOFF_CAP = 60.0
+# Server-suggested wait in a 429's RetryInfo detail: "retry_delay { seconds: 37 }"
+_RETRY_DELAY_RE = re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)")
+
+# Static instructions sent as the model's system instruction, so requests
+# carry only the chunk text. Kept short, since it is resent with every
+# request: the per-field descriptions live in the response schema rather
+# than being repeated here.
+_SYSTEM_INSTRUCTION = """Extract metadata from the policy/financial documentation text in each request as JSON matching the response schema.
+If a field is not found or applicable, use an empty string or empty list.
+If the request contains several numbered texts, return one object per text, in the same order."""
+
+
+def _string_field(description: str) -> Dict:
+    return {"type": "string", "description": description}
+
+
+def _list_field(description: str) -> Dict:
+    return {"type": "array", "items": {"type": "string"}, "description": description}
+
+
+# Structured output: Gemini decodes against these schemas, so responses are
+# always bare, valid JSON with the LLM-extracted keys
+_METADATA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": _string_field("a brief summary of the text"),
+        "keywords": _list_field("important keywords or phrases"),
+        "entities": _list_field("named entities (persons, organizations, etc.) mentioned"),
+        "title": _string_field("the title of the policy or document (if present)"),
+        "category": _string_field("the general category of the policy (e.g., Financial, HR, Academic)"),
+        "sub_category": _string_field("a more specific sub-category of the policy (if applicable)"),
+        "topic": _string_field("the main topic or subject of the policy text"),
+        "content_type": _string_field("the type of content (e.g., policy, guideline, procedure, report)"),
+    },
+    "required": [
+        "summary", "keywords", "entities", "title",
+        "category", "sub_category", "topic", "content_type"
+    ],
+}
+_METADATA_LIST_SCHEMA = {"type": "array", "items": _METADATA_SCHEMA}
+# Classification-only requests (chunks whose other fields came from the local extractor)
+_CLASSIFICATION_LIST_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {k: _METADATA_SCHEMA["properties"][k] for k in CLASSIFICATION_FIELDS},
+        "required": CLASSIFICATION_FIELDS,
+    },
+}
+
+
+class GeminiMetadataExtractor(BaseMetadataExtractor):
     """Extract structured metadata from policy text using Gemini (gemini-flash-latest)"""
 
-    def __init__(self, api_key: Optional[str] = None, model: str = "gemini-flash-latest"):
+    provider_name = "Gemini"
+    rate_tiers = GEMINI_RATE_TIERS
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = "gemini-flash-latest",
+        semantic_cache: Optional[bool] = None,
+        local_extractor=None
+    ):
         """
         Initialize the metadata extractor.
 
         Args:
             api_key: Gemini API key (if None, reads from environment)
             model: Gemini model to use (default: gemini-flash-latest)
+            semantic_cache: Reuse metadata of near-duplicate chunks
+                (default: METARAG_SEMANTIC_CACHE env var)
+            local_extractor: Optional LocalMetadataExtractor tried first;
+                Gemini is only called for chunks it rejects
         """
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
         if not self.api_key:
@@ -36,221 +120,153 @@ class GeminiMetadataExtractor:
                 "temperature": 0.3,
                 "top_p": 0.95,
                 "max_output_tokens": 2048,
-            }
+                "response_mime_type": "application/json",
+                "response_schema": _METADATA_SCHEMA,
+            },
+            system_instruction=_SYSTEM_INSTRUCTION
         )
-        self.model_name = model
+        self._init_caches(model, semantic_cache, local_extractor)
 
         print(f"[Gemini] Client initialized: {model}")
 
-    def extract_metadata(self, chunk_text: str) -> Dict:
+    def _build_prompt(self, chunk_text: str) -> str:
+        """Build the per-chunk request; the instructions live in the system instruction."""
+        return f'TEXT:\n"""\n{chunk_text}\n"""'
+
+    def _build_batch_prompt(self, chunk_texts: List[str]) -> str:
+        """Build a request for several chunks, answered as a JSON array of metadata objects."""
+        n = len(chunk_texts)
+        texts_block = "\n".join(
+            f'TEXT {i}:\n"""\n{text}\n"""' for i, text in enumerate(chunk_texts, start=1)
+        )
+        return f"{n} texts follow; return a JSON array of exactly {n} objects.\n\n{texts_block}"
+
+    def _chunk_text(self, chunk) -> str:
+        """Text of one streamed response chunk ("" if it carries none, e.g. only a finish reason)."""
+        try:
+            return chunk.text
+        except (ValueError, AttributeError, IndexError):
+            return ""
+
+    def _stream_text(self, prompt: str, generation_config: Optional[Dict] = None) -> str:
+        """
+        Stream the response and stop reading once the top-level JSON value is
+        closed, rather than waiting out the rest of the generation (JSON mode
+        can pad the output with whitespace up to max_output_tokens).
+        Raises if no text was received.
         """
-        Call Gemini API to extract specified metadata from chunk_text, return parsed JSON.
+        buffer = JsonStreamBuffer()
+        for chunk in self.model.generate_content(prompt, generation_config=generation_config, stream=True):
+            if buffer.feed(self._chunk_text(chunk)):
+                break
+        if not buffer.text:
+            raise ValueError("Empty response from Gemini API")
+        return buffer.text
+
+    async def _stream_text_async(self, prompt: str, generation_config: Optional[Dict] = None) -> str:
+        """Async variant of _stream_text() using generate_content_async."""
+        buffer = JsonStreamBuffer()
+        response = await self.model.generate_content_async(
+            prompt, generation_config=generation_config, stream=True
+        )
+        async for chunk in response:
+            if buffer.feed(self._chunk_text(chunk)):
+                break
+        if not buffer.text:
+            raise ValueError("Empty response from Gemini API")
+        return buffer.text
 
-        This extracts the EXACT same 12 fields as the Mistral version for fair comparison.
+    def _retry_wait(self, api_error: Exception, attempt: int) -> Optional[float]:
         """
-        chunk_text = (chunk_text or "").strip()
-
-        # Skip very short / useless chunks to save time and tokens
-        if len(chunk_text) < 50:
-            return {
-                "summary": "",
-                "keywords": [],
-                "entities": [],
-                "effective_date": "",
-                "fund_codes": [],
-                "ilcs_citations": [],
-                "title": "",
-                "category": "",
-                "sub_category": "",
-                "topic": "",
-                "year": "",
-                "content_type": ""
-            }
+        Seconds to wait before retrying after api_error, or None to give up.
 
-        prompt = f"""Analyze this policy/financial documentation text and extract metadata.
-
-TEXT:
-\"\"\"
-{chunk_text}
-\"\"\"
-
-Extract the following information and output as JSON with these exact keys:
-- summary: a brief summary of the text
-- keywords: a list of important keywords or phrases
-- entities: a list of named entities (persons, organizations, etc.) mentioned
-- effective_date: the effective or issuance date of the policy (if present)
-- fund_codes: any fund or account codes mentioned (if any)
-- ilcs_citations: any ILCS (Illinois Compiled Statutes) citations (e.g., '5 ILCS 430/...') mentioned
-- title: the title of the policy or document (if present)
-- category: the general category of the policy (e.g., Financial, HR, Academic)
-- sub_category: a more specific sub-category of the policy (if applicable)
-- topic: the main topic or subject of the policy text
-- year: the year associated with the policy (if present)
-- content_type: the type of content (e.g., policy, guideline, procedure, report)
+        Backoff is exponential with full jitter, so concurrent requests that
+        failed together do not retry in lockstep; rate-limit errors also wait
+        out the delay the API asks for.
+        """
+        if not isinstance(api_error, _RETRYABLE_ERRORS) or attempt >= _MAX_ATTEMPTS - 1:
+            return None
+
+        wait = random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt))
+        if isinstance(api_error, google_exceptions.ResourceExhausted):
+            match = _RETRY_DELAY_RE.search(str(api_error))
+            if match:
+                wait += float(match.group(1))
+        logger.debug(
+            "%s on attempt %d/%d, retrying in %.1fs", type(api_error).__name__, attempt + 1, _MAX_ATTEMPTS, wait
+        )
+        return wait
 
-If a field is not found or applicable, use an empty string or empty list.
-Return ONLY valid JSON, nothing else. Do not include markdown code blocks or explanations."""
-
-        expected_keys = [
-            "summary", "keywords", "entities", "effective_date", "fund_codes",
-            "ilcs_citations", "title", "category", "sub_category", "topic",
-            "year", "content_type"
-        ]
-
-        # Retry logic for API calls
-        max_retries = 3
-        retry_delay = 2.0
-        
-        for attempt in range(max_retries):
+    def _call_llm(self, chunk_text: str) -> str:
+        """Stream the metadata for one chunk, retrying transient API errors (see _retry_wait)."""
+        prompt = self._build_prompt(chunk_text)
+        for attempt in range(_MAX_ATTEMPTS):
             try:
                 # Call API (timeout is handled by the client library)
-                response = self.model.generate_content(prompt)
-                
-                # Handle Gemini API response (may have .text or .candidates[0].content.parts[0].text)
-                if hasattr(response, 'text') and response.text:
-                    output_text = response.text.strip()
-                elif hasattr(response, 'candidates') and response.candidates:
-                    # Alternative response format
-                    output_text = response.candidates[0].content.parts[0].text.strip()
-                else:
-                    raise ValueError(f"Unexpected response format: {response}")
-                
-                if not output_text:
-                    raise ValueError("Empty response from Gemini API")
-                
-                # Success, break out of retry loop
-                break
-                
+                return self._stream_text(prompt)
             except Exception as api_error:
-                if attempt < max_retries - 1:
-                    error_msg = str(api_error)
-                    if "timeout" in error_msg.lower() or "deadline" in error_msg.lower():
-                        print(f"[Gemini extract_metadata] Timeout on attempt {attempt + 1}/{max_retries}, retrying in {retry_delay}s...")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2  # Exponential backoff
-                        continue
-                    elif "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
-                        print(f"[Gemini extract_metadata] Rate limit on attempt {attempt + 1}/{max_retries}, waiting {retry_delay * 2}s...")
-                        time.sleep(retry_delay * 2)
-                        retry_delay *= 2
-                        continue
-                    else:
-                        print(f"[Gemini extract_metadata] Error on attempt {attempt + 1}/{max_retries}: {error_msg}, retrying...")
-                        time.sleep(retry_delay)
-                        continue
-                else:
-                    # Last attempt failed, raise the error
+                wait = self._retry_wait(api_error, attempt)
+                if wait is None:
                     raise
-        
-        # If we get here, API call succeeded and output_text is defined
-        try:
-            # Clean optional ``` fences
-            if output_text.startswith("```json"):
-                output_text = output_text[len("```json"):].strip()
-            elif output_text.startswith("```"):
-                output_text = output_text[len("```"):].strip()
-            if output_text.endswith("```"):
-                output_text = output_text[:-3].strip()
-
-            # KEY FIX: isolate the first JSON object only
-            start = output_text.find("{")
-            end = output_text.rfind("}")
-            if start != -1 and end != -1 and end > start:
-                json_str = output_text[start:end+1]
-            else:
-                json_str = output_text  # fallback, may still be pure JSON
-
-            metadata = json.loads(json_str)
-
-            # Ensure all expected keys exist with sane defaults
-            for k in expected_keys:
-                if k not in metadata:
-                    metadata[k] = [] if k in ["keywords", "entities", "fund_codes", "ilcs_citations"] else ""
-
-            return metadata
-
-        except json.JSONDecodeError as e:
-            print(f"[Gemini extract_metadata] JSON decode error: {e}")
-            if 'output_text' in locals():
-                print(f"[Gemini extract_metadata] Problematic output (truncated): {output_text[:300]}...")
-            else:
-                print(f"[Gemini extract_metadata] No output_text available")
-        except Exception as e:
-            print(f"[Gemini extract_metadata] Unexpected error: {e}")
-            print(f"[Gemini extract_metadata] Error type: {type(e).__name__}")
-            import traceback
-            traceback.print_exc()
-
-        # Fallback on any error
-        return {
-            "summary": "",
-            "keywords": [],
-            "entities": [],
-            "effective_date": "",
-            "fund_codes": [],
-            "ilcs_citations": [],
-            "title": "",
-            "category": "",
-            "sub_category": "",
-            "topic": "",
-            "year": "",
-            "content_type": ""
-        }
-
-    def enrich_chunks(
-        self,
-        chunks: List[Dict],
-        delay: float = 0.5,
-        batch_size: int = 10,
-        verbose: bool = True
-    ) -> List[Dict]:
-        """
-        Enrich chunks with metadata from Gemini.
+                time.sleep(wait)
 
-        Args:
-            chunks: List of chunk dictionaries
-            delay: Delay between API calls (seconds) - Gemini is faster, so 0.5s default
-            batch_size: Number of chunks to process before showing progress (unused, kept for compatibility)
-            verbose: Print progress messages
-
-        Returns:
-            List of enriched chunks
+    async def _call_llm_async(self, chunk_text: str, limiter: Optional[RateLimiter] = None) -> str:
         """
-        enriched_chunks = []
-        total = len(chunks)
-
-        # Use tqdm progress bar for visual feedback
-        iterator = tqdm(chunks, desc="🔍 Extracting metadata (Gemini)", unit="chunk") if verbose else chunks
-
-        for chunk in iterator:
-            text = chunk.get("text", "")
-            if not text:
-                enriched_chunks.append(chunk)
-                continue
-
-            # Extract metadata
-            metadata = self.extract_metadata(text)
-
-            # Merge metadata into chunk
-            enriched_chunk = {**chunk, **metadata}
-            enriched_chunks.append(enriched_chunk)
+        Async variant of _call_llm(). Retries with the same backoff, but waits
+        with asyncio.sleep so other requests keep running.
+        """
+        prompt = self._build_prompt(chunk_text)
+        for attempt in range(_MAX_ATTEMPTS):
+            if limiter is not None:
+                # Retries count against the quota too
+                await limiter.acquire(estimate_tokens(prompt))
+            try:
+                return await self._stream_text_async(prompt)
+            except Exception as api_error:
+                wait = self._retry_wait(api_error, attempt)
+                if wait is None:
+                    raise
+                await asyncio.sleep(wait)
+
+    async def _call_llm_batch_async(self, chunk_texts: List[str], limiter: Optional[RateLimiter] = None) -> str:
+        """Stream the metadata for several chunks as a JSON array (single attempt)."""
+        prompt = self._build_batch_prompt(chunk_texts)
+        if limiter is not None:
+            await limiter.acquire(estimate_tokens(prompt))
+        # Room for one full metadata object per chunk; merged over the
+        # model's generation_config
+        return await self._stream_text_async(
+            prompt,
+            generation_config={
+                "max_output_tokens": min(8192, 2048 * len(chunk_texts)),
+                "response_schema": _METADATA_LIST_SCHEMA,
+            }
+        )
 
-            # Rate limiting (Gemini is faster than Mistral)
-            if delay > 0:
-                time.sleep(delay)
+    def _classify_config(self, n: int) -> Dict:
+        """generation_config override for a classification-only request over n chunks."""
+        return {"max_output_tokens": min(8192, 256 * n), "response_schema": _CLASSIFICATION_LIST_SCHEMA}
 
-        if verbose:
-            print(f"✅ Enriched {len(enriched_chunks)} chunks with metadata (Gemini)")
+    def _call_classify(self, chunk_texts: List[str]) -> str:
+        """Stream category/sub_category/topic/content_type for the chunks as a JSON array (single attempt)."""
+        return self._stream_text(self._build_batch_prompt(chunk_texts), self._classify_config(len(chunk_texts)))
 
-        return enriched_chunks
+    async def _call_classify_async(self, chunk_texts: List[str], limiter: Optional[RateLimiter] = None) -> str:
+        """Async variant of _call_classify()."""
+        prompt = self._build_batch_prompt(chunk_texts)
+        if limiter is not None:
+            await limiter.acquire(estimate_tokens(prompt))
+        return await self._stream_text_async(prompt, self._classify_config(len(chunk_texts)))
 
 
 def extract_metadata_batch(
     chunks: List[Dict],
     api_key: Optional[str] = None,
     model: str = "gemini-flash-latest",
-    delay: float = 0.5,
-    batch_size: int = 10
+    max_concurrency: int = 8,
+    batch_size: int = 10,
+    rate_tier: Optional[str] = None,
+    chunks_per_request: int = 1
 ) -> List[Dict]:
     """
     Convenience function to extract metadata for a batch of chunks.
@@ -259,14 +275,22 @@ def extract_metadata_batch(
         chunks: List of chunk dictionaries
         api_key: Gemini API key
         model: Gemini model to use
-        delay: Delay between API calls
+        max_concurrency: Maximum number of in-flight API requests
         batch_size: Progress update frequency
+        rate_tier: Quota tier from GEMINI_RATE_TIERS used to pace requests
+        chunks_per_request: Chunks extracted per API request
 
     Returns:
         List of enriched chunks
     """
     extractor = GeminiMetadataExtractor(api_key=api_key, model=model)
-    return extractor.enrich_chunks(chunks, delay=delay, batch_size=batch_size)
+    return extractor.enrich_chunks(
+        chunks,
+        max_concurrency=max_concurrency,
+        batch_size=batch_size,
+        rate_tier=rate_tier,
+        chunks_per_request=chunks_per_request
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+"""
+Local Metadata Extraction
+Runs small on-device transformers models (NER + summarization) over chunks
+so the Mistral/Gemini API is only needed for chunks they handle poorly
+"""
+
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+from ..components.embedder import default_device
+from .metadata_regex import is_informative
+
+try:
+    from transformers import pipeline
+except ImportError:
+    pipeline = None
+
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z'-]+")
+
+
+class LocalMetadataExtractor:
+    """
+    Fill summary, keywords, entities and title locally, with a confidence
+    score per chunk.
+
+    category, sub_category, topic and content_type need the API extractor's
+    instructions and are left empty here: the API extractors fill them with
+    a short classification-only request for every chunk accepted locally.
+    The confidence only decides whether the local summary, keywords and
+    entities are used (see min_confidence).
+    """
+
+    def __init__(
+        self,
+        ner_model: str = "dslim/distilbert-NER",
+        summarization_model: str = "t5-small",
+        device: Optional[str] = None,
+        batch_size: int = 32,
+        min_confidence: float = 0.6
+    ):
+        """
+        Load the NER and summarization pipelines.
+
+        Args:
+            ner_model: Token-classification model for entities
+            summarization_model: Seq2seq model for summaries
+            device: torch device (default: default_device())
+            batch_size: Chunks per pipeline batch
+            min_confidence: Results scoring below this are rejected by extract_many()
+        """
+        if pipeline is None:
+            raise ImportError("Local metadata extraction requires transformers (pip install transformers)")
+
+        device = device or default_device()
+        self.batch_size = batch_size
+        self.min_confidence = min_confidence
+        # stride splits chunks longer than the model's window instead of failing on them
+        self.ner = pipeline("ner", model=ner_model, aggregation_strategy="simple", stride=128, device=device)
+        self.summarizer = pipeline("summarization", model=summarization_model, device=device)
+        print(f"✅ Loaded local metadata models on {device}: {ner_model}, {summarization_model}")
+
+    def _empty_metadata(self) -> Dict:
+        """LLM-extracted fields, all empty."""
+        return {
+            "summary": "",
+            "keywords": [],
+            "entities": [],
+            "title": "",
+            "category": "",
+            "sub_category": "",
+            "topic": "",
+            "content_type": ""
+        }
+
+    def _keywords(self, text: str, top_k: int = 8) -> List[str]:
+        """Most frequent non-stopword terms of the chunk."""
+        counts = Counter(
+            word.lower() for word in _WORD_RE.findall(text)
+            if len(word) > 3 and word.lower() not in ENGLISH_STOP_WORDS
+        )
+        return [word for word, _ in counts.most_common(top_k)]
+
+    def _title(self, text: str) -> str:
+        """First line of the chunk when it looks like a heading (chunking puts headings first)."""
+        first_line = text.split("\n", 1)[0].strip()
+        if first_line and len(first_line) <= 100 and not first_line.endswith("."):
+            return first_line
+        return ""
+
+    def _summary_support(self, summary: str, text: str) -> float:
+        """Share of summary words that occur in the chunk (a cheap ROUGE-1 precision)."""
+        summary_words = [w.lower() for w in _WORD_RE.findall(summary)]
+        if not summary_words:
+            return 0.0
+        text_words = {w.lower() for w in _WORD_RE.findall(text)}
+        return sum(w in text_words for w in summary_words) / len(summary_words)
+
+    def extract_many(self, chunk_texts: List[str]) -> List[Optional[Dict]]:
+        """
+        Extract metadata for many chunks in batches.
+
+        Args:
+            chunk_texts: Chunk texts
+
+        Returns:
+            Metadata dicts aligned with chunk_texts; None where the confidence
+            is below min_confidence (send those to the API)
+        """
+        results: List[Optional[Dict]] = [None] * len(chunk_texts)
+        positions = []
+        for i, text in enumerate(chunk_texts):
+            if not is_informative((text or "").strip()):
+                # Nothing to describe; the API extractors skip these as well
+                results[i] = self._empty_metadata()
+            else:
+                positions.append(i)
+        if not positions:
+            return results
+
+        texts = [chunk_texts[i].strip() for i in positions]
+        entity_lists = self.ner(texts, batch_size=self.batch_size)
+        summaries = self.summarizer(
+            texts, batch_size=self.batch_size, truncation=True, max_length=60, min_length=10
+        )
+
+        for i, text, entities, summary in zip(positions, texts, entity_lists, summaries):
+            summary_text = summary["summary_text"].strip()
+            confidence = self._summary_support(summary_text, text)
+            if entities:
+                confidence = min(confidence, sum(e["score"] for e in entities) / len(entities))
+            if confidence < self.min_confidence:
+                continue
+
+            metadata = self._empty_metadata()
+            metadata["summary"] = summary_text
+            metadata["keywords"] = self._keywords(text)
+            metadata["entities"] = list(dict.fromkeys(e["word"] for e in entities if e["score"] >= 0.5))
+            metadata["title"] = self._title(text)
+            results[i] = metadata
+
+        return results
@@ -5,22 +5,64 @@ Extracts structured metadata from policy text chunks
 
 import os
 import json
-import time
+from contextlib import asynccontextmanager
 from typing import Dict, List, Optional
 from mistralai.client import MistralClient
-from tqdm import tqdm
-
-
-class MetadataExtractor:
+from mistralai.async_client import MistralAsyncClient
+
+from ..components.json_stream import JsonStreamBuffer
+from ..components.rate_limiter import MISTRAL_RATE_TIERS, RateLimiter, estimate_tokens
+from .metadata_base import BaseMetadataExtractor
+
+# All static instructions go in the system message, so the user message
+# carries only the chunk text. Kept terse: it is sent, and counted against
+# the TPM quota, on every request.
+_SYSTEM_PROMPT = (
+    "Extract metadata from the policy text in the user message. Output one JSON object with keys: "
+    "summary (brief summary), keywords (list of key phrases), entities (list of named persons, "
+    "organizations, etc.), title, category (e.g. Financial, HR, Academic), sub_category, "
+    "topic (main subject), content_type (e.g. policy, guideline, procedure, report).\n"
+    "Use \"\" or [] for fields that are not present. JSON only, no explanation.\n"
+    "For several numbered texts, output {\"items\": [...]} with one such object per text, in order."
+)
+
+# Classification-only requests, for chunks whose other fields came from the
+# local extractor
+_CLASSIFY_PROMPT = (
+    "Classify each numbered policy text in the user message. Output {\"items\": [...]} with one JSON "
+    "object per text, in order, with keys: category (e.g. Financial, HR, Academic), sub_category, "
+    "topic (main subject), content_type (e.g. policy, guideline, procedure, report).\n"
+    "Use \"\" for fields that do not apply. JSON only, no explanation."
+)
+
+# JSON mode: the API guarantees the completion is one valid JSON object
+# (hence the {"items": [...]} wrapper for multi-chunk requests)
+_RESPONSE_FORMAT = {"type": "json_object"}
+
+
+class MetadataExtractor(BaseMetadataExtractor):
     """Extract structured metadata from policy text using Mistral open-mistral-7b"""
 
-    def __init__(self, api_key: Optional[str] = None, model: str = "open-mistral-7b"):
+    provider_name = "Mistral"
+    rate_tiers = MISTRAL_RATE_TIERS
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = "open-mistral-7b",
+        semantic_cache: Optional[bool] = None,
+        local_extractor=None
+    ):
         """
         Initialize the metadata extractor.
 
         Args:
             api_key: Mistral API key (if None, reads from environment)
             model: Mistral model to use (default: open-mistral-7b)
+            semantic_cache: Reuse metadata of near-duplicate chunks
+                (default: METARAG_SEMANTIC_CACHE env var)
+            local_extractor: Optional LocalMetadataExtractor tried first;
+                Mistral is only called for chunks it rejects
         """
         self.api_key = api_key or os.getenv("MISTRAL_API_KEY")
         if not self.api_key:
@@ -28,228 +70,123 @@ class MetadataExtractor:
 
         self.client = MistralClient(api_key=self.api_key)
         self.model = model
+        # Created per enrich_chunks() run (see _async_session)
+        self._async_client = None
+        self._init_caches(model, semantic_cache, local_extractor)
 
         print(f"[Mistral] Client initialized: {type(self.client)} | Model: {model}")
 
-    def _call_mistral_chat(self, messages, **kw):
-        """
-        Call Mistral chat with a list of messages.
-        Tries the common method shapes across SDK versions.
-        """
-        # Guard: messages must be a list[dict] (role/content)
-        if not (isinstance(messages, (list, tuple)) and all(isinstance(m, dict) for m in messages)):
-            raise TypeError("`messages` must be a list of dicts like "
-                            "[{'role':'system','content':'...'}, {'role':'user','content':'...'}]")
-
-        # Newer SDKs: client.chat(...)
+    def _delta_text(self, chunk) -> str:
+        """Text of one streamed completion chunk ("" if it carries none)."""
         try:
-            return self.client.chat(model=self.model, messages=messages, **kw)
-        except TypeError:
-            # Some SDKs: client.chat.complete(...)
-            return self.client.chat.complete(model=self.model, messages=messages, **kw)
+            return chunk.choices[0].delta.content or ""
+        except (AttributeError, IndexError):
+            return ""
 
-    def _extract_text_from_response(self, resp):
+    def _stream_chat(self, messages: List[Dict]) -> str:
         """
-        Normalize different response shapes into a text string.
-        Returns "" if no text was found.
+        Stream a JSON-mode completion and stop reading once the top-level JSON
+        value is closed, rather than waiting out the rest of the generation.
         """
-        # Already a string
-        if isinstance(resp, str):
-            return resp.strip()
-
-        # Common SDK object paths
+        buffer = JsonStreamBuffer()
+        stream = self.client.chat_stream(model=self.model, messages=messages, response_format=_RESPONSE_FORMAT)
         try:
-            return resp.choices[0].message.content.strip()
-        except Exception:
-            pass
+            for chunk in stream:
+                if buffer.feed(self._delta_text(chunk)):
+                    break
+        finally:
+            # Closing the generator releases the HTTP response early
+            stream.close()
+        return buffer.text
+
+    async def _stream_chat_async(self, client, messages: List[Dict]) -> str:
+        """Async variant of _stream_chat() on a MistralAsyncClient."""
+        buffer = JsonStreamBuffer()
+        stream = client.chat_stream(model=self.model, messages=messages, response_format=_RESPONSE_FORMAT)
         try:
-            return resp["choices"][0]["message"]["content"].strip()
-        except Exception:
-            pass
-
-        # Some SDKs stream or keep delta/content on choices[0].delta.content
-        try:
-            return resp.choices[0].delta.content.strip()
-        except Exception:
-            pass
-        try:
-            return resp["choices"][0]["delta"]["content"].strip()
-        except Exception:
-            pass
-
-        # Fallback to string
-        try:
-            return str(resp).strip()
-        except Exception:
-            return ""
-
-    def extract_metadata(self, chunk_text: str) -> Dict:
-        """
-        Call Mistral API to extract specified metadata from chunk_text, return parsed JSON.
+            async for chunk in stream:
+                if buffer.feed(self._delta_text(chunk)):
+                    break
+        finally:
+            await stream.aclose()
+        return buffer.text
+
+    def _build_messages(self, chunk_text: str) -> List[Dict]:
+        """Build the messages for one chunk: the static system prompt, then the chunk text."""
+        return [
+            {"role": "system", "content": _SYSTEM_PROMPT},
+            {"role": "user",   "content": "Text:\n\"\"\"\n" + chunk_text + "\n\"\"\""},
+        ]
 
-        This is the EXACT implementation from the META notebook.
-        """
-        chunk_text = (chunk_text or "").strip()
-
-        # Skip very short / useless chunks to save time and tokens
-        if len(chunk_text) < 50:
-            return {
-                "summary": "",
-                "keywords": [],
-                "entities": [],
-                "effective_date": "",
-                "fund_codes": [],
-                "ilcs_citations": [],
-                "title": "",
-                "category": "",
-                "sub_category": "",
-                "topic": "",
-                "year": "",
-                "content_type": ""
-            }
-
-        system_prompt = (
-            "You are a helpful assistant that extracts specified metadata from policy text. "
-            "Always output JSON only."
-        )
-        user_prompt = (
-            "Text:\n\"\"\"\n" + chunk_text + "\n\"\"\"\n"
-            "Extract the following information and output as JSON with keys: "
-            "summary, keywords, entities, effective_date, fund_codes, ilcs_citations, title, "
-            "category, sub_category, topic, year, content_type.\n"
-            "- summary: a brief summary of the text\n"
-            "- keywords: a list of important keywords or phrases\n"
-            "- entities: a list of named entities (persons, organizations, etc.) mentioned\n"
-            "- effective_date: the effective or issuance date of the policy (if present)\n"
-            "- fund_codes: any fund or account codes mentioned (if any)\n"
-            "- ilcs_citations: any ILCS (Illinois Compiled Statutes) citations (e.g., '5 ILCS 430/...') mentioned\n"
-            "- title: the title of the policy or document (if present)\n"
-            "- category: the general category of the policy (e.g., Financial, HR, Academic)\n"
-            "- sub_category: a more specific sub-category of the policy (if applicable)\n"
-            "- topic: the main topic or subject of the policy text\n"
-            "- year: the year associated with the policy (if present)\n"
-            "- content_type: the type of content (e.g., policy, guideline, procedure, report)\n"
-            "If a field is not found or applicable, use an empty string or empty list. JSON only, no explanation."
+    def _build_batch_messages(self, chunk_texts: List[str]) -> List[Dict]:
+        """Build the messages asking for one metadata object per chunk, as {"items": [...]}."""
+        n = len(chunk_texts)
+        texts_block = "\n".join(
+            f"TEXT {i}:\n\"\"\"\n{text}\n\"\"\"" for i, text in enumerate(chunk_texts, start=1)
         )
+        return [
+            {"role": "system", "content": _SYSTEM_PROMPT},
+            {"role": "user",   "content": f"{n} texts follow; return {{\"items\": [...]}} with exactly {n} objects.\n\n{texts_block}"},
+        ]
 
-        expected_keys = [
-            "summary", "keywords", "entities", "effective_date", "fund_codes",
-            "ilcs_citations", "title", "category", "sub_category", "topic",
-            "year", "content_type"
+    def _call_llm(self, chunk_text: str) -> str:
+        """Stream the metadata for one chunk."""
+        return self._stream_chat(self._build_messages(chunk_text))
+
+    async def _call_llm_async(self, chunk_text: str, limiter: Optional[RateLimiter] = None) -> str:
+        """Async variant of _call_llm() on the run's MistralAsyncClient."""
+        messages = self._build_messages(chunk_text)
+        if limiter is not None:
+            await limiter.acquire(estimate_tokens(messages[0]["content"] + messages[1]["content"]))
+        return await self._stream_chat_async(self._async_client, messages)
+
+    async def _call_llm_batch_async(self, chunk_texts: List[str], limiter: Optional[RateLimiter] = None) -> str:
+        """Stream the metadata for several chunks as {"items": [...]}."""
+        messages = self._build_batch_messages(chunk_texts)
+        if limiter is not None:
+            await limiter.acquire(estimate_tokens(messages[0]["content"] + messages[1]["content"]))
+        return await self._stream_chat_async(self._async_client, messages)
+
+    def _build_classify_messages(self, chunk_texts: List[str]) -> List[Dict]:
+        """Build the messages asking only for the classification fields of each chunk."""
+        texts_block = "\n".join(
+            f"TEXT {i}:\n\"\"\"\n{text}\n\"\"\"" for i, text in enumerate(chunk_texts, start=1)
+        )
+        return [
+            {"role": "system", "content": _CLASSIFY_PROMPT},
+            {"role": "user",   "content": texts_block},
         ]
 
+    def _call_classify(self, chunk_texts: List[str]) -> str:
+        """Stream the classification fields for several chunks as {"items": [...]}."""
+        return self._stream_chat(self._build_classify_messages(chunk_texts))
+
+    async def _call_classify_async(self, chunk_texts: List[str], limiter: Optional[RateLimiter] = None) -> str:
+        """Async variant of _call_classify() on the run's MistralAsyncClient."""
+        messages = self._build_classify_messages(chunk_texts)
+        if limiter is not None:
+            await limiter.acquire(estimate_tokens(messages[0]["content"] + messages[1]["content"]))
+        return await self._stream_chat_async(self._async_client, messages)
+
+    @asynccontextmanager
+    async def _async_session(self):
+        """Open a MistralAsyncClient for the run: its HTTP pool is bound to the running event loop."""
+        self._async_client = MistralAsyncClient(api_key=self.api_key)
         try:
-            resp = self._call_mistral_chat(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user",   "content": user_prompt},
-                ]
-            )
-            output_text = self._extract_text_from_response(resp).strip()
-
-            # Clean optional ``` fences
-            if output_text.startswith("```json"):
-                output_text = output_text[len("```json"):].strip()
-            elif output_text.startswith("```"):
-                output_text = output_text[len("```"):].strip()
-            if output_text.endswith("```"):
-                output_text = output_text[:-3].strip()
-
-            # KEY FIX: isolate the first JSON object only
-            start = output_text.find("{")
-            end = output_text.rfind("}")
-            if start != -1 and end != -1 and end > start:
-                json_str = output_text[start:end+1]
-            else:
-                json_str = output_text  # fallback, may still be pure JSON
-
-            metadata = json.loads(json_str)
-
-            # Ensure all expected keys exist with sane defaults
-            for k in expected_keys:
-                if k not in metadata:
-                    metadata[k] = [] if k in ["keywords", "entities", "fund_codes", "ilcs_citations"] else ""
-
-            return metadata
-
-        except json.JSONDecodeError as e:
-            print(f"[extract_metadata] JSON decode error: {e}")
-            print(f"[extract_metadata] Problematic output (truncated): {output_text[:300]}...")
-        except Exception as e:
-            print(f"[extract_metadata] Unexpected error: {e}")
-            import traceback
-            traceback.print_exc()
-
-        # Fallback on any error
-        return {
-            "summary": "",
-            "keywords": [],
-            "entities": [],
-            "effective_date": "",
-            "fund_codes": [],
-            "ilcs_citations": [],
-            "title": "",
-            "category": "",
-            "sub_category": "",
-            "topic": "",
-            "year": "",
-            "content_type": ""
-        }
-
-    def enrich_chunks(
-        self,
-        chunks: List[Dict],
-        delay: float = 1.0,
-        batch_size: int = 10,
-        verbose: bool = True
-    ) -> List[Dict]:
-        """
-        Enrich chunks with metadata from Mistral.
-
-        Args:
-            chunks: List of chunk dictionaries
-            delay: Delay between API calls (seconds)
-            batch_size: Number of chunks to process before showing progress (unused, kept for compatibility)
-            verbose: Print progress messages
-
-        Returns:
-            List of enriched chunks
-        """
-        enriched_chunks = []
-        total = len(chunks)
-
-        # Use tqdm progress bar for visual feedback
-        iterator = tqdm(chunks, desc="🔍 Extracting metadata", unit="chunk") if verbose else chunks
-
-        for chunk in iterator:
-            text = chunk.get("text", "")
-            if not text:
-                enriched_chunks.append(chunk)
-                continue
-
-            # Extract metadata
-            metadata = self.extract_metadata(text)
-
-            # Merge metadata into chunk
-            enriched_chunk = {**chunk, **metadata}
-            enriched_chunks.append(enriched_chunk)
-
-            # Rate limiting
-            if delay > 0:
-                time.sleep(delay)
-
-        if verbose:
-            print(f"✅ Enriched {len(enriched_chunks)} chunks with metadata")
-
-        return enriched_chunks
+            yield
+        finally:
+            await self._async_client.close()
+            self._async_client = None
 
 
 def extract_metadata_batch(
     chunks: List[Dict],
     api_key: Optional[str] = None,
     model: str = "open-mistral-7b",
-    delay: float = 1.0,
-    batch_size: int = 10
+    max_concurrency: int = 8,
+    batch_size: int = 10,
+    rate_tier: Optional[str] = None,
+    chunks_per_request: int = 1
 ) -> List[Dict]:
     """
     Convenience function to extract metadata for a batch of chunks.
@@ -258,14 +195,22 @@ def extract_metadata_batch(
         chunks: List of chunk dictionaries
         api_key: Mistral API key
         model: Mistral model to use
-        delay: Delay between API calls
+        max_concurrency: Maximum number of in-flight API requests
         batch_size: Progress update frequency
+        rate_tier: Quota tier from MISTRAL_RATE_TIERS used to pace requests
+        chunks_per_request: Chunks extracted per API request
 
     Returns:
         List of enriched chunks
     """
     extractor = MetadataExtractor(api_key=api_key, model=model)
-    return extractor.enrich_chunks(chunks, delay=delay, batch_size=batch_size)
+    return extractor.enrich_chunks(
+        chunks,
+        max_concurrency=max_concurrency,
+        batch_size=batch_size,
+        rate_tier=rate_tier,
+        chunks_per_request=chunks_per_request
+    )
 
 
 if __name__ == "__main__":
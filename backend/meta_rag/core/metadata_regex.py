@@ -0,0 +1,98 @@
+"""
+Rule-based Metadata Fields
+Extracts the pattern-shaped metadata fields (dates, fund codes, ILCS citations,
+year) locally so the LLM prompt only asks for the fields that need a model,
+and screens out chunks with nothing for the model to describe
+"""
+
+import re
+from typing import Dict
+
+# Fields filled by regex_extract_fields() instead of the LLM
+REGEX_FIELDS = ("effective_date", "fund_codes", "ilcs_citations", "year")
+
+_MONTHS = (
+    r"(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|June?|July?|"
+    r"Aug(?:ust)?|Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)\.?"
+)
+
+# "5 ILCS 430/5-15", "110 ILCS 305/7(a)"
+ILCS_RE = re.compile(r"\b\d+\s+ILCS\s+\d+/[\w.\-()]*[\w)]")
+# "July 1, 2023", "Jul. 1 2023", "2023-07-01", "7/1/2023"
+DATE_RE = re.compile(
+    rf"\b{_MONTHS}\s+\d{{1,2}},?\s+(?:19|20)\d{{2}}\b"
+    r"|\b(?:19|20)\d{2}-\d{2}-\d{2}\b"
+    r"|\b\d{1,2}/\d{1,2}/(?:19|20)\d{2}\b",
+    re.IGNORECASE
+)
+# A date introduced as the effective/issue/revision date
+EFFECTIVE_DATE_RE = re.compile(
+    rf"\b(?:effective|issued|revised|adopted|approved)\b[^.\n]{{0,40}}?({DATE_RE.pattern})",
+    re.IGNORECASE
+)
+YEAR_RE = re.compile(r"\b(?:19|20)\d{2}\b")
+# "Fund 100", "Fund Code 123456"
+FUND_RE = re.compile(r"\bFund\s+(?:Code\s+|No\.?\s+|#\s*)?(\d{3,6})\b", re.IGNORECASE)
+
+# Lines that carry no content: page footers, table-of-contents headers and
+# entries ("1.2 Travel Advances ........ 14")
+BOILERPLATE_LINE_RE = re.compile(
+    r"(?:page\s+\d+(?:\s+of\s+\d+)?|(?:table\s+of\s+)?contents|.*?(?:\.{3,}|\s{3,})\s*\d+)",
+    re.IGNORECASE
+)
+
+# Thresholds for is_informative()
+MIN_CHARS = 50
+MIN_UNIQUE_TOKENS = 8
+MIN_ALPHA_RATIO = 0.5
+
+
+def regex_extract_fields(text: str) -> Dict:
+    """
+    Extract REGEX_FIELDS from text.
+
+    Args:
+        text: Chunk text
+
+    Returns:
+        Dict with every key in REGEX_FIELDS (empty string/list when not found)
+    """
+    text = text or ""
+
+    match = EFFECTIVE_DATE_RE.search(text)
+    if match:
+        effective_date = match.group(1)
+    else:
+        match = DATE_RE.search(text)
+        effective_date = match.group(0) if match else ""
+
+    # The year of the effective date, else the first year mentioned
+    year_match = YEAR_RE.search(effective_date) or YEAR_RE.search(text)
+
+    return {
+        "effective_date": effective_date,
+        "fund_codes": list(dict.fromkeys(FUND_RE.findall(text))),
+        "ilcs_citations": list(dict.fromkeys(ILCS_RE.findall(text))),
+        "year": year_match.group(0) if year_match else "",
+    }
+
+
+def is_informative(text: str) -> bool:
+    """
+    Cheap screen for chunks worth an LLM call: long enough, enough distinct
+    words, mostly letters (not number tables), and not only page/TOC lines.
+
+    Args:
+        text: Chunk text (stripped)
+
+    Returns:
+        False if the chunk should get empty LLM fields without a request
+    """
+    if len(text) < MIN_CHARS:
+        return False
+    if sum(map(str.isalpha, text)) / len(text) < MIN_ALPHA_RATIO:
+        return False
+    if len(set(text.lower().split())) < MIN_UNIQUE_TOKENS:
+        return False
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return not all(BOILERPLATE_LINE_RE.fullmatch(line) for line in lines)
@@ -5,9 +5,40 @@ Supports PDF, DOCX, and text files with improved heading detection
 
 import os
 import re
+import mmap
+import zipfile
 import fitz  # PyMuPDF
-import docx
-from typing import List, Dict, Optional
+from lxml import etree  # installed with python-docx
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from statistics import median
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# A paragraph runs from a non-space character to the next blank line (or the
+# end of the text); matching them directly yields their offsets in one scan
+_PARA_RE = re.compile(r'\S.*?(?=\n\s*\n|\Z)', re.DOTALL)
+
+# Numbered sections: "1. Something", "2) Something", "1.1 Subsection"
+_NUMBERED_HEADING_RE = re.compile(r"^\d+(?:\.\d+)*[\.\)]\s+")
+
+# "dict" extraction without image blocks: only text blocks are used, and
+# MuPDF would otherwise materialize every image's bytes into the dict
+_PDF_DICT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+# WordprocessingML tags read by the streaming DOCX parser
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_BODY, _W_P, _W_TBL, _W_SDT = _W + "body", _W + "p", _W + "tbl", _W + "sdt"
+# Run content that makes up a paragraph's text (same as python-docx's para.text)
+_DOCX_RUN_CONTENT = etree.XPath(
+    "w:r/* | w:hyperlink/w:r/*", namespaces={"w": _W[1:-1]}
+)
+
+# Pages with text sampled via "dict" extraction for the font statistics;
+# the rest of the parse uses the much cheaper "blocks" extraction
+_FONT_SAMPLE_PAGES = 3
+# Spans counted at most; the mode is stable long before this
+_FONT_SAMPLE_MAX_SPANS = 50000
 
 
 def _split_paragraphs_with_spans(text: str) -> List[Dict]:
@@ -16,30 +47,22 @@ def _split_paragraphs_with_spans(text: str) -> List[Dict]:
     Returns a list of dicts: {para_idx, start, end, text}
     """
     paragraphs = []
-    cursor = 0
-    para_idx = 0
 
-    parts = re.split(r'\n\s*\n', text)  # split on blank lines
-
-    for part in parts:
-        part = part.strip()
-        if not part:
-            continue
-        start = text.find(part, cursor)
-        end = start + len(part)
+    for match in _PARA_RE.finditer(text):  # split on blank lines
+        part = match.group().rstrip()
+        start = match.start()
         paragraphs.append({
-            "para_idx": para_idx,
+            "para_idx": len(paragraphs),
             "start": start,
-            "end": end,
+            "end": start + len(part),
             "text": part
         })
-        para_idx += 1
-        cursor = end
 
     return paragraphs
 
 
-def _is_major_pdf_heading(text: str, font_sizes: List[float], base_size: float) -> bool:
+@lru_cache(maxsize=4096)
+def _is_major_pdf_heading(text: str, max_font: float, base_size: float) -> bool:
     """
     Conservative major-heading detector for PDFs.
 
@@ -47,8 +70,11 @@ def _is_major_pdf_heading(text: str, font_sizes: List[float], base_size: float)
       - Big titles with large fonts
       - Numbered sections (1. Something, 2) Something, 1.1 Subsection)
       - ALL CAPS short lines with larger fonts
+
+    text must already be stripped; max_font is the block's largest (or
+    estimated) font size. Callers round the sizes to one decimal so that
+    repeated page headers/footers hit the cache.
     """
-    text = text.strip()
     if not text:
         return False
 
@@ -56,21 +82,21 @@ def _is_major_pdf_heading(text: str, font_sizes: List[float], base_size: float)
     if len(text) > 120:
         return False
 
-    max_font = max(font_sizes) if font_sizes else base_size
-
-    # Pattern for numbered sections: "1. Something", "2) Something", "1.1 Subsection"
-    numbered_pattern = re.compile(r"^\d+(\.\d+)*[\.\)]\s+")
+    # Every rule needs at least a slightly larger font; this settles body text
+    # before any string scans
+    if max_font < base_size * 1.25:
+        return False
 
     # 1) Big title or very large text
     if max_font >= base_size * 1.7:
         return True
 
     # 2) Numbered sections with slightly larger font
-    if numbered_pattern.match(text) and max_font >= base_size * 1.25:
+    if text[0].isdigit() and _NUMBERED_HEADING_RE.match(text):
         return True
 
     # 3) ALL CAPS, fairly short, and noticeably larger than body text
-    if text.isupper() and len(text) < 80 and max_font >= base_size * 1.4:
+    if max_font >= base_size * 1.4 and len(text) < 80 and not text[0].islower() and text.isupper():
         return True
 
     return False
@@ -88,6 +114,10 @@ def _merge_small_pdf_blocks(blocks: List[Dict], min_chars: int = 1500) -> List[D
         return blocks
 
     merged = [blocks[0]]
+    # Text pieces of blocks that absorbed later ones, by index in merged;
+    # joined (and split into paragraphs) once, after merging
+    merged_parts: Dict[int, List[str]] = {}
+    last_len = len(blocks[0]["text"])
 
     for blk in blocks[1:]:
         last = merged[-1]
@@ -96,18 +126,24 @@ def _merge_small_pdf_blocks(blocks: List[Dict], min_chars: int = 1500) -> List[D
         both_no_heading = (blk.get("heading") is None and last.get("heading") is None)
 
         if (same_heading or both_no_heading) and (
-            len(last["text"]) < min_chars or len(blk["text"]) < min_chars
+            last_len < min_chars or len(blk["text"]) < min_chars
         ):
             # Merge blk into last
+            parts = merged_parts.setdefault(len(merged) - 1, [last["text"]])
             separator = "\n\n"
-            if last["text"] and last["text"][-1] not in ".!?":
+            if parts[-1] and parts[-1][-1] not in ".!?":
                 separator = " "
-            
-            new_text = (last["text"] + separator + blk["text"]).strip()
-            last["text"] = new_text
-            last["paragraphs"] = _split_paragraphs_with_spans(new_text)
+
+            parts.append(separator)
+            parts.append(blk["text"])
+            last_len += len(separator) + len(blk["text"])
         else:
             merged.append(blk)
+            last_len = len(blk["text"])
+
+    for i, parts in merged_parts.items():
+        merged[i]["text"] = "".join(parts).strip()
+        merged[i]["paragraphs"] = _split_paragraphs_with_spans(merged[i]["text"])
 
     # Reassign block_idx to keep them contiguous
     for i, blk in enumerate(merged):
@@ -116,6 +152,132 @@ def _merge_small_pdf_blocks(blocks: List[Dict], min_chars: int = 1500) -> List[D
     return merged
 
 
+def _docx_heading_styles(archive: zipfile.ZipFile) -> Tuple[Dict[str, bool], bool]:
+    """
+    Decide once per paragraph style of a .docx whether it is a heading style
+    (name starting with "heading"), rather than once per paragraph.
+
+    Returns:
+        (is_heading_by_id, default_is_heading): paragraph style id -> is a
+        heading style, and the same for the default paragraph style (used
+        for paragraphs without a style or with an unknown one)
+    """
+    is_heading_by_id, default_is_heading = {}, False
+    try:
+        root = etree.fromstring(archive.read("word/styles.xml"))
+    except KeyError:
+        return is_heading_by_id, default_is_heading
+
+    for style in root.iterchildren(_W + "style"):
+        if style.get(_W + "type") != "paragraph":
+            continue
+        name_el = style.find(_W + "name")
+        name = name_el.get(_W + "val", "") if name_el is not None else ""
+        is_heading = name.lower().startswith("heading")
+        is_heading_by_id[style.get(_W + "styleId")] = is_heading
+        if style.get(_W + "default") in ("1", "true", "on"):
+            default_is_heading = is_heading
+    return is_heading_by_id, default_is_heading
+
+
+def _docx_paragraph_text(p) -> str:
+    """Text of a <w:p> element, with tabs and line breaks like python-docx."""
+    parts = []
+    for el in _DOCX_RUN_CONTENT(p):
+        tag = el.tag[len(_W):]
+        if tag == "t":
+            parts.append(el.text or "")
+        elif tag in ("tab", "ptab"):
+            parts.append("\t")
+        elif tag == "cr" or (tag == "br" and el.get(_W + "type", "textWrapping") == "textWrapping"):
+            parts.append("\n")
+        elif tag == "noBreakHyphen":
+            parts.append("-")
+    return "".join(parts)
+
+
+def _iter_docx_paragraphs(filepath: str) -> Iterator[Tuple[bool, str]]:
+    """
+    Stream the top-level paragraphs of a .docx as (is heading, text).
+
+    Parses word/document.xml incrementally instead of building python-docx
+    objects for every paragraph and run. Like python-docx's doc.paragraphs,
+    only paragraphs directly in the body are returned (not table cells).
+    """
+    with zipfile.ZipFile(filepath) as archive:
+        is_heading_by_id, default_is_heading = _docx_heading_styles(archive)
+        with archive.open("word/document.xml") as xml:
+            for _, el in etree.iterparse(xml, events=("end",), tag=(_W_P, _W_TBL, _W_SDT)):
+                parent = el.getparent()
+                if parent is None or parent.tag != _W_BODY:
+                    continue
+                if el.tag == _W_P:
+                    style_el = el.find(f"{_W}pPr/{_W}pStyle")
+                    style_id = style_el.get(_W + "val") if style_el is not None else None
+                    yield is_heading_by_id.get(style_id, default_is_heading), _docx_paragraph_text(el)
+                # Drop processed body children to keep memory flat
+                el.clear()
+                while el.getprevious() is not None:
+                    del parent[0]
+
+
+def _read_text_file(filepath: str) -> str:
+    """
+    Read a UTF-8 text file (undecodable bytes dropped) with one decode
+    straight from a memory map, instead of text mode's buffered copy.
+    Newlines are normalized to "\n" as in text mode.
+    """
+    with open(filepath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            content = str(mapped, 'utf-8', 'ignore')
+
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    return content
+
+
+def _estimate_pdf_font_metrics(doc) -> Tuple[float, float]:
+    """
+    Estimate the body font size and the line height per point of font size
+    from the first _FONT_SAMPLE_PAGES pages that have text (fewer once
+    _FONT_SAMPLE_MAX_SPANS spans have been counted).
+
+    Returns:
+        (base_size, line_height_ratio): the mode of the span sizes (like
+        notebook) and the median single-line block height / font size, used
+        to convert "blocks" bounding boxes back into approximate font sizes
+    """
+    font_size_counts = Counter()
+    ratios = []
+    sampled = 0
+    # MuPDF's text blocks always carry lines/spans/size, so they are indexed
+    # directly rather than through .get()
+    for page in doc:
+        page_dict = page.get_text("dict", flags=_PDF_DICT_FLAGS)
+        text_blocks = [block for block in page_dict["blocks"] if block["type"] == 0]
+        for block in text_blocks:
+            lines = block["lines"]
+            for line in lines:
+                for span in line["spans"]:
+                    font_size_counts[round(span["size"], 1)] += 1
+            # Single-line blocks only: headings are mostly single lines, and
+            # line spacing would inflate the ratio for paragraphs
+            if len(lines) == 1 and lines[0]["spans"]:
+                x0, y0, x1, y1 = block["bbox"]
+                ratios.append((y1 - y0) / max(span["size"] for span in lines[0]["spans"]))
+        if text_blocks:
+            sampled += 1
+            if sampled >= _FONT_SAMPLE_PAGES or sum(font_size_counts.values()) >= _FONT_SAMPLE_MAX_SPANS:
+                break
+
+    # Use mode (most frequent) as base_size, like notebook
+    base_size = font_size_counts.most_common(1)[0][0] if font_size_counts else 11.0
+    line_height_ratio = median(ratios) if ratios else 1.4
+    return base_size, line_height_ratio
+
+
 def parse_document(filepath: str) -> List[Dict]:
     """
     Parse a document and return structured blocks.
@@ -135,7 +297,6 @@ def parse_document(filepath: str) -> List[Dict]:
 
     # ---------------- DOCX ----------------
     if ext.endswith(".docx"):
-        doc = docx.Document(filepath)
         current_heading = None
         current_text_parts = []
 
@@ -157,12 +318,11 @@ def parse_document(filepath: str) -> List[Dict]:
             current_heading = None
             current_text_parts = []
 
-        for para in doc.paragraphs:
-            text = para.text.strip()
+        for is_heading, text in _iter_docx_paragraphs(filepath):
+            text = text.strip()
             if not text:
                 continue
-            style = para.style.name if para.style else ""
-            if style.lower().startswith("heading"):
+            if is_heading:
                 _flush()
                 current_heading = text
             else:
@@ -172,73 +332,55 @@ def parse_document(filepath: str) -> List[Dict]:
 
     # ---------------- PDF ----------------
     elif ext.endswith(".pdf"):
-        doc = fitz.open(filepath)
         all_blocks = []
-
-        # Pre-pass to estimate dominant font size (using mode, like notebook)
-        font_sizes = []
-        for page in doc:
-            page_dict = page.get_text("dict")
-            for block in page_dict.get("blocks", []):
-                if block.get("type") == 0:  # text block
-                    for line in block.get("lines", []):
-                        for span in line.get("spans", []):
-                            font_sizes.append(round(span.get("size", 11.0), 1))
-
-        # Use mode (most frequent) as base_size, like notebook
-        if font_sizes:
-            base_size = max(set(font_sizes), key=font_sizes.count)
-        else:
-            base_size = 11.0
-
-        # Per-page iteration with per-page flush (like notebook)
-        for page in doc:
-            page_number = page.number + 1
-            page_dict = page.get_text("dict")
-
-            # Per-page variables
-            current_heading = None
-            current_text_parts = []
-            current_block_start_page = page_number
-
-            def _flush_pdf():
-                nonlocal block_idx, current_heading, current_text_parts, current_block_start_page
-                if current_text_parts or current_heading:
-                    full_text = " ".join(current_text_parts).strip()
-                    if full_text:
-                        paragraph_spans = _split_paragraphs_with_spans(full_text)
-                        all_blocks.append({
-                            "heading": current_heading,
-                            "page": current_block_start_page,
-                            "block_idx": block_idx,
-                            "text": full_text,
-                            "paragraphs": paragraph_spans,
-                            "source_file": filename
-                        })
-                        block_idx += 1
+        # Heading results are only reused within a document
+        _is_major_pdf_heading.cache_clear()
+        # Closed before merging so the file and MuPDF's caches are released early
+        with fitz.open(filepath) as doc:
+            base_size, line_height_ratio = _estimate_pdf_font_metrics(doc)
+            # Smallest font _is_major_pdf_heading accepts
+            min_heading_font = base_size * 1.25
+
+            # Per-page iteration with per-page flush (like notebook)
+            for page in doc:
+                page_number = page.number + 1
+                # Per-page variables
                 current_heading = None
                 current_text_parts = []
                 current_block_start_page = page_number
 
-            for block in page_dict.get("blocks", []):
-                if block.get("type") == 0:  # text block
-                    # Extract text WITHOUT adding spaces/newlines (like notebook)
-                    text_parts = []
-                    block_fonts = []
-
-                    for line in block.get("lines", []):
-                        for span in line.get("spans", []):
-                            span_text = span.get("text", "")
-                            if span_text.strip():
-                                text_parts.append(span_text)
-                                block_fonts.append(span.get("size", base_size))
-
-                    block_text = " ".join(text_parts).strip()  # Join spans with spaces
+                def _flush_pdf():
+                    nonlocal block_idx, current_heading, current_text_parts, current_block_start_page
+                    if current_text_parts or current_heading:
+                        full_text = " ".join(current_text_parts).strip()
+                        if full_text:
+                            paragraph_spans = _split_paragraphs_with_spans(full_text)
+                            all_blocks.append({
+                                "heading": current_heading,
+                                "page": current_block_start_page,
+                                "block_idx": block_idx,
+                                "text": full_text,
+                                "paragraphs": paragraph_spans,
+                                "source_file": filename
+                            })
+                            block_idx += 1
+                    current_heading = None
+                    current_text_parts = []
+                    current_block_start_page = page_number
+
+                for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks"):
+                    if block_type != 0:  # text blocks only
+                        continue
+                    # Lines come newline-separated; join them with spaces like the spans
+                    block_text = text.replace("\n", " ").strip()
                     if not block_text:
                         continue
+                    # Approximate font size from the block's line height
+                    line_count = text.rstrip("\n").count("\n") + 1
+                    font_size = round((y1 - y0) / line_count / line_height_ratio, 1)
 
-                    # Check if this block is a heading
-                    is_heading = _is_major_pdf_heading(block_text, block_fonts, base_size)
+                    # Check if this block is a heading (body-size text never is)
+                    is_heading = font_size >= min_heading_font and _is_major_pdf_heading(block_text, font_size, base_size)
 
                     if is_heading:
                         _flush_pdf()
@@ -246,8 +388,10 @@ def parse_document(filepath: str) -> List[Dict]:
                     else:
                         current_text_parts.append(block_text)
 
-            # Flush at end of each page (like notebook)
-            _flush_pdf()
+                # Flush at end of each page (like notebook)
+                _flush_pdf()
+                # Let MuPDF drop the page's cached content right away
+                page = None
 
         # Merge small blocks
         all_blocks = _merge_small_pdf_blocks(all_blocks, min_chars=1500)
@@ -255,8 +399,7 @@ def parse_document(filepath: str) -> List[Dict]:
 
     # ---------------- TXT ----------------
     elif ext.endswith(".txt"):
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
+        content = _read_text_file(filepath)
 
         # Simple text parsing - treat the entire file as one block
         paragraph_spans = _split_paragraphs_with_spans(content)
@@ -275,13 +418,21 @@ def parse_document(filepath: str) -> List[Dict]:
     return blocks
 
 
-def parse_directory(directory_path: str, extensions: Optional[List[str]] = None) -> Dict[str, List[Dict]]:
+def parse_directory(
+    directory_path: str,
+    extensions: Optional[List[str]] = None,
+    max_workers: Optional[int] = None
+) -> Dict[str, List[Dict]]:
     """
     Parse all documents in a directory (recursively searches subdirectories).
 
+    Files are parsed in parallel worker processes: parsing is CPU-bound and
+    every file is independent.
+
     Args:
         directory_path: Path to directory containing documents
         extensions: List of file extensions to parse (default: ['.pdf', '.docx', '.txt'])
+        max_workers: Worker processes (default: min(CPU count, 4); 1 parses in-process)
 
     Returns:
         Dictionary mapping filenames to lists of blocks
@@ -295,6 +446,7 @@ def parse_directory(directory_path: str, extensions: Optional[List[str]] = None)
         raise FileNotFoundError(f"Directory not found: {directory_path}")
 
     # Walk through directory recursively
+    filepaths = []
     for root, dirs, files in os.walk(directory_path):
         for filename in files:
             # Skip hidden files and check extension
@@ -302,16 +454,31 @@ def parse_directory(directory_path: str, extensions: Optional[List[str]] = None)
                 continue
             if not any(filename.lower().endswith(ext) for ext in extensions):
                 continue
-
-            filepath = os.path.join(root, filename)
-            try:
-                blocks = parse_document(filepath)
-                # Use relative path from input dir as key for better identification
-                rel_path = os.path.relpath(filepath, directory_path)
-                documents_blocks[rel_path] = blocks
-                print(f"✅ Parsed {rel_path}: {len(blocks)} blocks")
-            except Exception as e:
-                print(f"❌ Error parsing {filename}: {e}")
+            filepaths.append(os.path.join(root, filename))
+
+    if max_workers is None:
+        max_workers = min(os.cpu_count() or 1, 4)
+    max_workers = min(max_workers, len(filepaths))
+
+    def _collect(filepath: str, parse):
+        try:
+            blocks = parse()
+            # Use relative path from input dir as key for better identification
+            rel_path = os.path.relpath(filepath, directory_path)
+            documents_blocks[rel_path] = blocks
+            print(f"✅ Parsed {rel_path}: {len(blocks)} blocks")
+        except Exception as e:
+            print(f"❌ Error parsing {os.path.basename(filepath)}: {e}")
+
+    if max_workers < 2:
+        for filepath in filepaths:
+            _collect(filepath, lambda: parse_document(filepath))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(parse_document, filepath) for filepath in filepaths]
+            # Collected in walk order so the result doesn't depend on timing
+            for filepath, future in zip(filepaths, futures):
+                _collect(filepath, future.result)
 
     return documents_blocks
 
@@ -11,18 +11,53 @@ import os
 import sys
 import json
 import pickle
+import functools
+import asyncio
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+# Both accept bytes, so metadata files can be read without decoding first
+_loads = orjson.loads if orjson is not None else json.loads
+
 # Load backend .env
 BACKEND_DIR = Path(__file__).parent.parent
 env_path = BACKEND_DIR / ".env"
-load_dotenv(env_path)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_env():
+    """Read backend/.env once per process; later calls are no-ops."""
+    load_dotenv(env_path)
+
+
+_load_env()
+
+# Parsed once at import instead of on every request
+GEMINI_TIMEOUT = int(os.getenv("GEMINI_TIMEOUT", "30"))  # seconds per answer request
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))  # inverted lists scanned per query (IVF indices)
+# Opt in to serving exact flat indices as OPQ+IVF+PQ (PQ32x4fs with FAISS_FAST_SCAN=1).
+# The conversion trains on first load and trades recall for speed; prefer
+# building compressed indices offline with the builders' --index-type ivfpq
+FAISS_CONVERT_FLAT = os.getenv("FAISS_CONVERT_FLAT", "0") == "1"
+FAISS_FAST_SCAN = os.getenv("FAISS_FAST_SCAN", "0") == "1"
+# Search on GPU 0 when faiss has CUDA support (FAISS_USE_GPU=0 to keep indices on CPU)
+FAISS_USE_GPU = os.getenv("FAISS_USE_GPU", "1") == "1"
+# Entries per in-memory query cache level (0 disables query caching)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+
+# Indices are opened read-only from disk rather than copied into memory
+_FAISS_MMAP_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
 
 # Mistral components are NOT needed for retrieval - only for building index
 # So we don't import them at all
@@ -39,6 +74,10 @@ meta_mistral_client = None
 #     RERANKER_AVAILABLE = False
 RERANKER_AVAILABLE = True  # We use subprocess now
 
+from meta_rag.components.embedder import load_query_embedder
+from meta_rag.components.faiss_index import convert_flat_index
+from meta_rag.components.query_cache import QueryCache
+
 try:
     from meta_rag.components.rrf_fusion import rrf_fuse
     RRF_AVAILABLE = True
@@ -79,7 +118,9 @@ class EnhancedRAGBackendV2:
         use_gear: bool = False,
         gemini_api_key: Optional[str] = None,
         gemini_model: str = "gemini-flash-latest",
-        index_choice: str = "prefix"  # New parameter: "content", "tfidf", or "prefix"
+        index_choice: str = "prefix",  # New parameter: "content", "tfidf", or "prefix"
+        nprobe: Optional[int] = None,
+        max_workers: int = 4
     ):
         """
         Initialize the RAG backend.
@@ -91,6 +132,10 @@ class EnhancedRAGBackendV2:
             gemini_api_key: Gemini API key for answer generation
             gemini_model: Gemini model name
             index_choice: Which index to use ("content", "tfidf", or "prefix")
+            nprobe: Inverted lists searched per query on IVF indices
+                (default: FAISS_NPROBE env var); higher is slower but more exact
+            max_workers: Threads generate_answer_async() uses for retrieval
+                and Gemini calls across concurrent requests
         """
         if embedding_dir is None:
             # Get backend directory (parent of meta_rag directory)
@@ -101,6 +146,10 @@ class EnhancedRAGBackendV2:
         self.use_reranker = use_reranker and RERANKER_AVAILABLE
         self.use_gear = use_gear and GEAR_AVAILABLE
         self.index_choice = index_choice
+        self.nprobe = nprobe or FAISS_NPROBE
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag")
+        # Repeated and near-duplicate questions skip encoding, search and reranking
+        self._query_cache = QueryCache(QUERY_CACHE_SIZE) if QUERY_CACHE_SIZE > 0 else None
 
         # Load resources
         self._load_indices()  # Load all 3 indices
@@ -109,9 +158,14 @@ class EnhancedRAGBackendV2:
 
         # Initialize reranker (Process Isolation - no direct loading)
         self.reranker = None
+        self._rerank_proc = None
+        # One request in flight per worker: requests and responses are matched by order
+        self._rerank_lock = threading.Lock()
         print(f"DEBUG: Initializing EnhancedRAGBackendV2 with use_reranker={self.use_reranker}")
         if self.use_reranker:
-            print("✅ Reranker enabled (will use subprocess worker)")
+            # Started now so the model loads while the rest of the backend does
+            self._start_rerank_worker()
+            print("✅ Reranker enabled (persistent subprocess worker)")
 
         # Load GEAR triples if available
         self.gear_triples = None
@@ -126,36 +180,29 @@ class EnhancedRAGBackendV2:
             self._init_gemini()
 
     def _load_indices(self):
-        """Load all 3 FAISS indices and select the active one."""
+        """Locate the FAISS indices and open the active one; the others open on first use."""
         # Try to load all 3 indices
-        index_content_path = self.embedding_dir / "index_content.faiss"
-        index_tfidf_path = self.embedding_dir / "index_tfidf.faiss"
-        index_prefix_path = self.embedding_dir / "index_prefix.faiss"
+        index_paths = {
+            "content": self.embedding_dir / "index_content.faiss",
+            "tfidf": self.embedding_dir / "index_tfidf.faiss",
+            "prefix": self.embedding_dir / "index_prefix.faiss"
+        }
+        self._indices = {}
+        self._index_lock = threading.Lock()
+        self._gpu_res = None
 
         # Check if 3-index format exists
-        if index_content_path.exists() and index_tfidf_path.exists() and index_prefix_path.exists():
-            # Load all 3 indices
-            self.index_content = faiss.read_index(str(index_content_path))
-            self.index_tfidf = faiss.read_index(str(index_tfidf_path))
-            self.index_prefix = faiss.read_index(str(index_prefix_path))
+        if all(path.exists() for path in index_paths.values()):
+            self._index_paths = index_paths
 
             # Select the active index based on index_choice
-            index_map = {
-                "content": self.index_content,
-                "tfidf": self.index_tfidf,
-                "prefix": self.index_prefix
-            }
-
-            if self.index_choice not in index_map:
+            if self.index_choice not in index_paths:
                 print(f"⚠️  Invalid index_choice '{self.index_choice}', defaulting to 'prefix'")
                 self.index_choice = "prefix"
 
-            self.index = index_map[self.index_choice]
+            self.index = self._get_index(self.index_choice)
 
-            print(f"✅ Loaded 3 FAISS indices:")
-            print(f"   - index_content: {self.index_content.ntotal} vectors")
-            print(f"   - index_tfidf: {self.index_tfidf.ntotal} vectors")
-            print(f"   - index_prefix: {self.index_prefix.ntotal} vectors")
+            print(f"✅ Found 3 FAISS indices (content, tfidf, prefix)")
             print(f"   - Using: {self.index_choice} ({self.index.ntotal} vectors)")
 
         else:
@@ -169,19 +216,122 @@ class EnhancedRAGBackendV2:
                     f"  - Single index format: index.faiss"
                 )
 
-            self.index = faiss.read_index(str(old_index_path))
-            self.index_content = self.index
-            self.index_tfidf = self.index
-            self.index_prefix = self.index
+            self._index_paths = dict.fromkeys(index_paths, old_index_path)
+            self.index = self._open_or_convert_index(old_index_path)
+            self._indices = dict.fromkeys(index_paths, self.index)
             print(f"⚠️  Using legacy single index format")
             print(f"✅ Loaded FAISS index with {self.index.ntotal} vectors")
 
+    def _get_index(self, name: str) -> faiss.Index:
+        """Open the index for one text variant ("content", "tfidf", "prefix") once, on first use."""
+        with self._index_lock:
+            if name not in self._indices:
+                self._indices[name] = self._open_or_convert_index(self._index_paths[name])
+            return self._indices[name]
+
+    @property
+    def index_content(self) -> faiss.Index:
+        return self._get_index("content")
+
+    @property
+    def index_tfidf(self) -> faiss.Index:
+        return self._get_index("tfidf")
+
+    @property
+    def index_prefix(self) -> faiss.Index:
+        return self._get_index("prefix")
+
+    def _open_or_convert_index(self, path: Path) -> faiss.Index:
+        """
+        Memory-map a FAISS index, optionally serving an exact IndexFlatIP as OPQ+IVF+PQ.
+
+        Mapped indices are paged in from disk on access (and shared between
+        processes through the page cache) instead of being copied into RAM.
+
+        With FAISS_CONVERT_FLAT=1, a flat index (which scans every vector on
+        each query) is replaced by a converted copy that only scans nprobe
+        inverted lists of compressed codes. The copy is stored next to the
+        original as <name>.ivfpq.faiss and reused while it is newer than the
+        flat file; the original is never modified. If the copy cannot be
+        written, the flat index is served.
+
+        Args:
+            path: Path of the .faiss file
+
+        Returns:
+            Index ready for search, with nprobe applied if it is IVF-based
+        """
+        index = faiss.read_index(str(path), _FAISS_MMAP_FLAGS)
+
+        if FAISS_CONVERT_FLAT and isinstance(index, faiss.IndexFlatIP):
+            converted_path = path.with_suffix(".ivfpq.faiss")
+            if converted_path.exists() and converted_path.stat().st_mtime >= path.stat().st_mtime:
+                index = faiss.read_index(str(converted_path), _FAISS_MMAP_FLAGS)
+            else:
+                converted = convert_flat_index(index, fast_scan=FAISS_FAST_SCAN)
+                if converted is not None:
+                    # Per-process temp name: concurrent workers never write the same file,
+                    # and the rename means a reader never sees a partial index
+                    tmp_path = converted_path.with_name(f"{converted_path.name}.{os.getpid()}.tmp")
+                    try:
+                        faiss.write_index(converted, str(tmp_path))
+                        os.replace(tmp_path, converted_path)
+                        index = faiss.read_index(str(converted_path), _FAISS_MMAP_FLAGS)
+                        print(f"✅ Converted {path.name} to OPQ+IVF+PQ ({index.ntotal} vectors) -> {converted_path.name}")
+                    except (OSError, RuntimeError) as e:
+                        # faiss reports IO failures as RuntimeError
+                        print(f"⚠️  Could not write {converted_path.name} ({e}), serving the flat index")
+                        tmp_path.unlink(missing_ok=True)
+
+        try:
+            faiss.extract_index_ivf(index).nprobe = self.nprobe
+        except RuntimeError:
+            pass  # flat / sq8 / HNSW index: nothing to tune
+        return self._to_gpu(index, path)
+
+    def _to_gpu(self, index: faiss.Index, path: Path) -> faiss.Index:
+        """
+        Copy an index to GPU 0 when faiss was built with CUDA and a GPU is present.
+
+        Index types the GPU build can't clone (e.g. HNSW, 4-bit fast-scan PQ)
+        stay on the CPU. Apple GPUs have no faiss backend, so Macs always
+        search on the CPU.
+        """
+        if not FAISS_USE_GPU or not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+            return index
+        try:
+            if self._gpu_res is None:
+                # Shared by all indices; must outlive them
+                self._gpu_res = faiss.StandardGpuResources()
+            co = faiss.GpuClonerOptions()
+            # fp16 IVFPQ lookup tables / flat storage: half the device memory traffic
+            co.useFloat16 = True
+            gpu_index = faiss.index_cpu_to_gpu(self._gpu_res, 0, index, co)
+            print(f"🎮 Moved {path.name} to GPU")
+            return gpu_index
+        except Exception as e:
+            print(f"⚠️  Keeping {path.name} on CPU ({e})")
+            return index
+
     def _load_metadata(self):
         """Load metadata and ID mappings."""
-        # Load metadata
-        metadata_path = self.embedding_dir / "metadata.json"
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            self.metadata = json.load(f)
+        # Load metadata (JSON Lines from current builds, single JSON dict from older ones)
+        jsonl_path = self.embedding_dir / "metadata.jsonl"
+        if jsonl_path.exists():
+            self.metadata = {}
+            with open(jsonl_path, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        chunk = _loads(line)
+                        self.metadata[f"chunk_{chunk['chunk_id']}"] = chunk
+        else:
+            metadata_path = self.embedding_dir / "metadata.json"
+            self.metadata = _loads(metadata_path.read_bytes())
+            # Older builds inlined each chunk's vectors as JSON float lists;
+            # the FAISS indices already hold them, so don't keep them in memory
+            for chunk in self.metadata.values():
+                for key in ("embedding_content", "embedding_tfidf", "embedding_prefix"):
+                    chunk.pop(key, None)
 
         # Load ID mapping
         id_mapping_path = self.embedding_dir / "id_mapping.pkl"
@@ -202,6 +352,7 @@ class EnhancedRAGBackendV2:
         if MISTRAL_AVAILABLE and meta_answer_gen and meta_mistral_client:
             try:
                 meta_answer_gen.all_chunks = self.all_chunks
+                meta_answer_gen.citation_records = meta_answer_gen.build_citation_records(self.all_chunks)
                 meta_answer_gen._call_mistral_chat = meta_mistral_client._call_mistral_chat
                 meta_answer_gen._extract_text_from_response = meta_mistral_client._extract_text_from_response
                 meta_answer_gen.MODEL_NAME = meta_mistral_client.MODEL_NAME
@@ -220,15 +371,14 @@ class EnhancedRAGBackendV2:
         else:
             model_name = 'all-MiniLM-L6-v2'
 
-        self.embed_model = SentenceTransformer(model_name)
+        self.embed_model = load_query_embedder(model_name)
         print(f"✅ Loaded embedding model: {model_name}")
 
     def _load_gear_triples(self):
         """Load GEAR triples if available."""
         triples_path = self.embedding_dir / "gear_triples.json"
         if triples_path.exists():
-            with open(triples_path, 'r', encoding='utf-8') as f:
-                self.gear_triples = json.load(f)
+            self.gear_triples = _loads(triples_path.read_bytes())
             print(f"✅ Loaded {len(self.gear_triples)} GEAR triples")
         else:
             print("⚠️  No GEAR triples found, disabling GEAR")
@@ -258,21 +408,137 @@ class EnhancedRAGBackendV2:
         Returns:
             List of chunk indices
         """
-        # Embed query
-        q_emb = self.embed_model.encode([query])
+        return self.retrieve_dense_batch([query], top_k)[0]
+
+    def retrieve_dense_batch(self, queries: List[str], top_k: int = 10) -> List[List[int]]:
+        """
+        Dense retrieval for several queries at once.
 
-        # Normalize for IndexFlatIP
-        q_emb = q_emb / np.linalg.norm(q_emb, axis=1, keepdims=True)
-        q_emb = np.array(q_emb, dtype=np.float32)
+        Queries missing the query cache are embedded in one encode() call and
+        searched with a single index.search() so FAISS runs one matrix
+        product for the batch.
 
-        # Search
+        Returns:
+            List of chunk index lists, one per query
+        """
+        if self._query_cache is None:
+            return self._search_dense(self._embed_queries(queries), top_k)
+
+        cache = self._query_cache
+        results: List[Optional[List[int]]] = [None] * len(queries)
+
+        # Level 1: exact query text -> embedding; encode the misses in one batch
+        embeddings = [cache.get_embedding(q) for q in queries]
+        to_embed = [i for i, emb in enumerate(embeddings) if emb is None]
+        if to_embed:
+            new_emb = self._embed_queries([queries[i] for i in to_embed])
+            for i, emb in zip(to_embed, new_emb):
+                embeddings[i] = emb
+                cache.add_embedding(queries[i], emb)
+
+        # Level 2: near-duplicate past query -> its dense results
+        to_search = []
+        for i, emb in enumerate(embeddings):
+            results[i] = cache.get_results(emb, top_k)
+            if results[i] is None:
+                to_search.append(i)
+
+        if to_search:
+            searched = self._search_dense(np.stack([embeddings[i] for i in to_search]), top_k)
+            for i, indices in zip(to_search, searched):
+                results[i] = indices
+                cache.add_results(embeddings[i], indices, top_k)
+
+        return results
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed queries as L2-normalized (n, d) float32 rows."""
+        # Normalized inside encode() (inner product == cosine); already float32, so no copy
+        q_emb = self.embed_model.encode(
+            queries, normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False
+        )
+        return q_emb.astype(np.float32, copy=False)
+
+    def _search_dense(self, q_emb: np.ndarray, top_k: int) -> List[List[int]]:
+        """Search the active index with one index.search() for all rows."""
         distances, indices = self.index.search(q_emb, top_k)
-        return indices[0].tolist()
+        # Approximate indices (HNSW/IVF) pad missing results with -1
+        return [[i for i in row if i >= 0] for row in indices.tolist()]
+
+    def _start_rerank_worker(self):
+        """
+        Spawn the reranker worker (rerank_worker.py).
+
+        The worker loads the model and this backend's chunk texts once and
+        then serves one JSON line per request for the lifetime of the backend.
+        It exits when its stdin is closed, which also happens when this
+        process exits.
+        """
+        worker_path = Path(__file__).parent / "rerank_worker.py"
+        # Use the same python interpreter as current process; stderr is
+        # inherited so the worker's log lines show up in the server console
+        self._rerank_proc = subprocess.Popen(
+            [sys.executable, str(worker_path)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            env={**os.environ, "EMBEDDING_DIR": str(self.embedding_dir)}
+        )
+
+    def _call_rerank_worker(self, input_data: Dict) -> List[float]:
+        """
+        Send one request to the reranker worker and return its scores.
+
+        A worker that has died is respawned: before the request if it already
+        exited, or right after it closes its stdout mid-request (that request
+        then fails and the caller falls back to dense order).
+        """
+        with self._rerank_lock:
+            if self._rerank_proc is None or self._rerank_proc.poll() is not None:
+                self._start_rerank_worker()
+            proc = self._rerank_proc
+
+            print("🔄 Calling Reranker Worker (Isolated Process)...")
+            try:
+                proc.stdin.write(json.dumps(input_data) + "\n")
+                proc.stdin.flush()
+                line = proc.stdout.readline()
+            except (BrokenPipeError, OSError):
+                line = ""
+
+            if not line:
+                returncode = proc.wait()
+                print(f"❌ Reranker worker exited with code {returncode}, respawning")
+                self._start_rerank_worker()
+                raise RuntimeError(f"Reranker worker exited with code {returncode}")
+
+        # Try to parse result
+        try:
+            result = json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"❌ Failed to parse reranker output: {e}")
+            print(f"   Raw output: {line}")
+            raise
+
+        if "error" in result:
+            raise RuntimeError(f"Reranker error: {result['error']}")
+
+        return result["scores"]
 
     def retrieve_with_reranking(self, query: str, top_k: int = 10, rerank_top: int = None) -> Tuple[List[int], List[float]]:
         """
         Retrieve with BGE reranking using subprocess isolation.
+
+        Successful results are cached by (query, top_k), so a repeated
+        question skips both retrieval and the reranker.
         """
+        cache_key = (query, top_k)
+        if self._query_cache is not None and self.use_reranker:
+            cached = self._query_cache.get_reranked(cache_key)
+            if cached is not None:
+                return list(cached[0]), list(cached[1])
+
         # 1. Dense Retrieval first to get candidates
         # Retrieve more candidates for reranking (e.g. 30)
         candidate_k = max(top_k * 3, 30)
@@ -282,74 +548,33 @@ class EnhancedRAGBackendV2:
             # Fallback if reranker disabled
             return candidate_indices[:top_k], [1.0] * min(len(candidate_indices), top_k)
 
-        # 2. Prepare data for reranker worker
-        chunks_data = []
-        for idx in candidate_indices:
-            chunks_data.append({
-                "text": self.all_chunks[idx].get("text", "")
-            })
-            
+        # 2. Prepare data for reranker worker: the worker reads the same
+        # corpus (EMBEDDING_DIR), so candidates are sent as indices, not text
         input_data = {
             "query": query,
-            "chunks": chunks_data
+            "ids": candidate_indices
         }
-        
-        # 3. Call worker subprocess
-        import subprocess
-        import json
-        
-        worker_path = Path(__file__).parent / "rerank_worker.py"
-        
+
+        # 3. Call the persistent worker subprocess
         try:
-            print("🔄 Calling Reranker Worker (Isolated Process)...")
-            # Use the same python interpreter as current process
-            process = subprocess.Popen(
-                [sys.executable, str(worker_path)],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            stdout, stderr = process.communicate(input=json.dumps(input_data))
-            
-            # Debug output
-            if stderr:
-                print(f"[DEBUG] Reranker stderr: {stderr}")
-            
-            if process.returncode != 0:
-                print(f"❌ Reranker worker failed with code {process.returncode}")
-                print(f"   stdout: {stdout}")
-                print(f"   stderr: {stderr}")
-                raise RuntimeError(f"Reranker worker failed with code {process.returncode}")
-            
-            # Try to parse result
-            try:
-                result = json.loads(stdout)
-            except json.JSONDecodeError as e:
-                print(f"❌ Failed to parse reranker output: {e}")
-                print(f"   Raw output: {stdout}")
-                raise
-                
-            if "error" in result:
-                raise RuntimeError(f"Reranker error: {result['error']}")
-                
-            scores = result["scores"]
-            
-            # 4. Sort by reranker scores
-            # Combine indices and scores
-            combined = list(zip(candidate_indices, scores))
-            # Sort desc
-            combined.sort(key=lambda x: x[1], reverse=True)
-            
-            # 5. Take top_k
-            top_results = combined[:top_k]
-            
-            reranked_indices = [x[0] for x in top_results]
-            reranked_scores = [x[1] for x in top_results]
-            
+            scores = self._call_rerank_worker(input_data)
+
+            # 4. Take the top_k by reranker score: partial selection, then sort only those
+            scores_np = np.asarray(scores, dtype=np.float64)
+            cand_np = np.asarray(candidate_indices, dtype=np.int64)
+            if top_k < len(scores_np):
+                top = np.argpartition(-scores_np, top_k - 1)[:top_k]
+            else:
+                top = np.arange(len(scores_np))
+            order = top[np.argsort(-scores_np[top], kind="stable")]
+
+            reranked_indices = cand_np[order].tolist()
+            reranked_scores = scores_np[order].tolist()
+
             print("✅ Reranker worker finished successfully")
-            return reranked_indices, reranked_scores
+            if self._query_cache is not None:
+                self._query_cache.add_reranked(cache_key, (reranked_indices, reranked_scores))
+            return list(reranked_indices), list(reranked_scores)
             
         except Exception as e:
             print(f"⚠️ Reranking failed, falling back to dense: {e}")
@@ -381,12 +606,11 @@ class EnhancedRAGBackendV2:
         gear_indices = dense_indices  # Placeholder
 
         # Fuse with RRF
-        fused_indices = rrf_fuse([dense_indices, gear_indices], k=60)
-        fused_indices = fused_indices[:top_k]
+        fused_indices = rrf_fuse([dense_indices, gear_indices], k=60, top_k=top_k)
 
         # Get scores (use reranker scores if available)
-        scores = [dense_scores[dense_indices.index(idx)] if idx in dense_indices else 0.5
-                  for idx in fused_indices]
+        dense_map = dict(zip(dense_indices, dense_scores))
+        scores = [dense_map.get(idx, 0.5) for idx in fused_indices]
 
         return fused_indices, scores
 
@@ -432,11 +656,41 @@ class EnhancedRAGBackendV2:
         results = self.retrieve(query, top_k, use_fusion=use_fusion)
 
         if not results:
-            return {
-                'answer': "I couldn't find relevant information to answer your question.",
-                'sources': []
-            }
+            return self._no_results_answer()
+
+        answer_text = self._generate_text(self._answer_prompt(query, results))
+        return self._answer_payload(results, answer_text)
 
+    async def generate_answer_async(self, query: str, top_k: int = 10, use_fusion: bool = False) -> Dict:
+        """
+        Async variant of generate_answer() for servers handling several requests.
+
+        Retrieval (embedding, FAISS, reranker RPC) and the blocking Gemini call
+        run on the backend's thread pool, so the event loop keeps serving other
+        requests meanwhile; at most max_workers of these steps run at once.
+        """
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(
+            self._executor, functools.partial(self.retrieve, query, top_k, use_fusion=use_fusion)
+        )
+
+        if not results:
+            return self._no_results_answer()
+
+        answer_text = await loop.run_in_executor(
+            self._executor, self._generate_text, self._answer_prompt(query, results)
+        )
+        return self._answer_payload(results, answer_text)
+
+    def _no_results_answer(self) -> Dict:
+        """Response when retrieval found nothing."""
+        return {
+            'answer': "I couldn't find relevant information to answer your question.",
+            'sources': []
+        }
+
+    def _answer_prompt(self, query: str, results: List[Dict]) -> str:
+        """Build the Gemini prompt from the question and the numbered top results."""
         # --- 1) 給 Gemini 的編號 context ---
         # Funnel Design: Retrieve top_k (e.g. 10), but only give top 5 to LLM for context
         top_n_context = 5
@@ -463,19 +717,30 @@ class EnhancedRAGBackendV2:
             "6. Do NOT generate a 'Sources used' list at the end.\n"
         )
 
-        answer_text = None
-        if self.llm:
-            try:
-                # Combine system and user messages into one prompt
-                full_prompt = f"{system_msg}\n\n{user_msg}"
-                response = self.llm.generate_content(full_prompt)
-                answer_text = (response.text or "").strip()
-                print("✅ Generated answer using Gemini with [i] citations")
-            except Exception as e:
-                print(f"Error generating Gemini citation-style answer: {e}")
-                import traceback
-                traceback.print_exc()
+        # Combine system and user messages into one prompt
+        return f"{system_msg}\n\n{user_msg}"
+
+    def _generate_text(self, full_prompt: str) -> Optional[str]:
+        """Call Gemini; returns the answer text, or None if unavailable or the call failed."""
+        if not self.llm:
+            return None
+        try:
+            # Bound the request so a stalled call can't hang the UI
+            response = self.llm.generate_content(
+                full_prompt,
+                request_options={"timeout": GEMINI_TIMEOUT}
+            )
+            answer_text = (response.text or "").strip()
+            print("✅ Generated answer using Gemini with [i] citations")
+            return answer_text
+        except Exception as e:
+            print(f"Error generating Gemini citation-style answer: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
 
+    def _answer_payload(self, results: List[Dict], answer_text: Optional[str]) -> Dict:
+        """Assemble the response, falling back to the top chunk if there is no answer text."""
         # --- 2) 如果 Gemini 掛掉，退回簡單回答 ---
         if not answer_text:
             answer_text = f"""Based on the UIC Vice Chancellor's Office policy documents:
@@ -490,7 +755,7 @@ Summary: {results[0].get('summary', 'No summary available.')}"""
         }
 
 
-def get_backend_v2(use_reranker=True, use_gear=False, embedding_dir=None, metadata_source="gemini"):
+def get_backend_v2(use_reranker=True, use_gear=False, embedding_dir=None, metadata_source="gemini", max_workers=4):
     """
     Get or create the enhanced RAG backend V2 singleton.
 
@@ -499,9 +764,10 @@ def get_backend_v2(use_reranker=True, use_gear=False, embedding_dir=None, metada
         use_gear: Whether to use GEAR graph retrieval
         embedding_dir: Custom embedding directory path (if None, uses default based on metadata_source)
         metadata_source: "mistral" or "gemini" - determines which index to use (default: "gemini")
+        max_workers: Thread pool size for generate_answer_async()
     """
-    # Load API keys
-    load_dotenv()
+    # Load API keys (.env is only read on the first call)
+    _load_env()
     gemini_key = os.getenv("GEMINI_API_KEY")
     gemini_model = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
 
@@ -524,7 +790,8 @@ def get_backend_v2(use_reranker=True, use_gear=False, embedding_dir=None, metada
         use_reranker=use_reranker,
         use_gear=use_gear,
         gemini_api_key=gemini_key,
-        gemini_model=gemini_model
+        gemini_model=gemini_model,
+        max_workers=max_workers
     )
 
     return backend
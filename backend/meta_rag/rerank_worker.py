@@ -1,82 +1,279 @@
 import sys
 import json
 import os
+import pickle
+import platform
+from pathlib import Path
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import numpy as np
 
-def main():
-    # Read input from stdin
-    try:
-        input_data = json.load(sys.stdin)
-        query = input_data['query']
-        chunks = input_data['chunks']
-        
-        # Load model
-        model_name = os.getenv("RERANKER_MODEL_NAME", "BAAI/bge-reranker-base")
-       
-        print(f"🔄 Loading reranker model: {model_name}", file=sys.stderr)
-        
-        # Hugging Face token check
-        hf_token = os.getenv("HF_TOKEN") or os.getenv("HUGGINGFACE_TOKEN")
-        
-        if hf_token:
-            from huggingface_hub import login
-            login(token=hf_token)
-            
-            print(f"✅ Authenticated with Hugging Face token", file=sys.stderr)
-        
-        tokenizer = AutoTokenizer.from_pretrained(model_name, token=hf_token)
-        model = AutoModelForSequenceClassification.from_pretrained(model_name, token=hf_token)
-        model.eval()
-        
-        # Use MPS if available
-        if torch.backends.mps.is_available():
-            device = torch.device("mps")
-            
-            print("📱 Using Apple Silicon GPU (MPS)", file=sys.stderr)
-        elif torch.cuda.is_available():
-            device = torch.device("cuda")
-            print("🎮 Using NVIDIA GPU (CUDA)", file=sys.stderr)
+# Pairs per forward pass (see score())
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", "16"))
+
+# "auto" runs an int8 ONNX Runtime export when there is no GPU and torch
+# otherwise; "onnx-int8" / "torch" force one. ONNX needs optimum[onnxruntime]
+# and falls back to torch if it is missing or the export fails.
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "auto")
+# Exported + quantized models, one subdirectory per model (built on first use)
+RERANKER_ONNX_DIR = Path(os.getenv(
+    "RERANKER_ONNX_DIR",
+    str(Path.home() / ".cache" / "metarag" / "reranker_onnx")
+))
+ONNX_INT8_FILE = "model_quantized.onnx"
+
+# Cross-encoder input limit (query + chunk tokens)
+MAX_LENGTH = 512
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+_loads = orjson.loads if orjson is not None else json.loads
+
+# Chunk text -> token ids (no special tokens). The corpus is fixed and the
+# worker is long-lived, so each chunk is tokenized once, not once per query.
+_doc_token_cache = {}
+
+
+def load_chunk_texts(embedding_dir):
+    """
+    Chunk texts in FAISS index order, read from the same files as the backend,
+    so requests can name candidates by index instead of sending their text.
+    """
+    embedding_dir = Path(embedding_dir)
+    jsonl_path = embedding_dir / "metadata.jsonl"
+    if jsonl_path.exists():
+        metadata = {}
+        with open(jsonl_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    chunk = _loads(line)
+                    metadata[f"chunk_{chunk['chunk_id']}"] = chunk.get("text", "")
+    else:
+        metadata = {
+            chunk_id: chunk.get("text", "")
+            for chunk_id, chunk in _loads((embedding_dir / "metadata.json").read_bytes()).items()
+        }
+
+    with open(embedding_dir / "id_mapping.pkl", 'rb') as f:
+        index_to_id = pickle.load(f)['index_to_id']
+    return [metadata[index_to_id[i]] for i in range(len(index_to_id))]
+
+
+def has_gpu():
+    """True if torch can use an MPS or CUDA device."""
+    return torch.backends.mps.is_available() or torch.cuda.is_available()
+
+
+def load_onnx_int8_model(model_name, hf_token):
+    """
+    Load the reranker as a dynamically int8-quantized ONNX Runtime model.
+
+    The first run exports and quantizes the model into RERANKER_ONNX_DIR;
+    later runs load the cached file directly.
+    """
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    save_dir = RERANKER_ONNX_DIR / model_name.replace("/", "--")
+    if not (save_dir / ONNX_INT8_FILE).exists():
+        print(f"🔄 Exporting {model_name} to int8 ONNX (one-time)", file=sys.stderr)
+        fp32_model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True, token=hf_token)
+        # Dynamic quantization: weights stored as int8, activations quantized per batch
+        if platform.machine().lower() in ("arm64", "aarch64"):
+            qconfig = AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
         else:
-            device = torch.device("cpu")
-            print("💻 Using CPU", file=sys.stderr)
-        
-        model.to(device)
-        print(f"✅ Reranker model loaded successfully on {device}", file=sys.stderr)
-        
-        # Prepare pairs
-        pairs = []
-        for chunk in chunks:
-            pairs.append([query, chunk['text']])
-            
-        # Inference
-        inputs = tokenizer(
-            pairs,
-            padding=True,
-            truncation=True,
-            return_tensors='pt',
-            max_length=512
+            # avx2 kernels run on any x86-64 CPU, including AVX-512/VNNI ones
+            qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        ORTQuantizer.from_pretrained(fp32_model).quantize(save_dir=save_dir, quantization_config=qconfig)
+
+    return ORTModelForSequenceClassification.from_pretrained(
+        save_dir, file_name=ONNX_INT8_FILE, provider="CPUExecutionProvider"
+    )
+
+
+def load_model():
+    """Load the reranker once; returns (tokenizer, model, device)."""
+    model_name = os.getenv("RERANKER_MODEL_NAME", "BAAI/bge-reranker-base")
+
+    print(f"🔄 Loading reranker model: {model_name}", file=sys.stderr)
+
+    # Hugging Face token check
+    hf_token = os.getenv("HF_TOKEN") or os.getenv("HUGGINGFACE_TOKEN")
+
+    if hf_token:
+        from huggingface_hub import login
+        login(token=hf_token)
+
+        print(f"✅ Authenticated with Hugging Face token", file=sys.stderr)
+
+    # The Rust tokenizer; some checkpoints would otherwise get the slow Python one
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True, token=hf_token)
+
+    use_onnx = RERANKER_BACKEND == "onnx-int8" or (RERANKER_BACKEND == "auto" and not has_gpu())
+    if use_onnx:
+        try:
+            model = load_onnx_int8_model(model_name, hf_token)
+            print("✅ Reranker model loaded on ONNX Runtime (int8, CPU)", file=sys.stderr)
+            return tokenizer, model, torch.device("cpu")
+        except Exception as e:
+            print(f"⚠️  ONNX reranker unavailable ({e}), falling back to torch", file=sys.stderr)
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_name, token=hf_token)
+    model.eval()
+
+    # Use MPS if available
+    if torch.backends.mps.is_available():
+        device = torch.device("mps")
+
+        print("📱 Using Apple Silicon GPU (MPS)", file=sys.stderr)
+    elif torch.cuda.is_available():
+        device = torch.device("cuda")
+        print("🎮 Using NVIDIA GPU (CUDA)", file=sys.stderr)
+    else:
+        device = torch.device("cpu")
+        print("💻 Using CPU", file=sys.stderr)
+
+    model.to(device)
+    if device.type == "cuda":
+        # bf16 keeps fp32's range (no logit overflow) where supported; TF32
+        # covers any matmuls still in fp32
+        model = model.to(torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16)
+        torch.backends.cuda.matmul.allow_tf32 = True
+    elif device.type == "mps":
+        model = model.half()
+    else:
+        torch.set_num_threads(min(8, os.cpu_count() or 1))
+    print(f"✅ Reranker model loaded successfully on {device} ({next(model.parameters()).dtype})", file=sys.stderr)
+    return tokenizer, model, device
+
+
+def doc_token_ids(tokenizer, texts):
+    """Token ids of each chunk text, served from _doc_token_cache when possible."""
+    missing = [t for t in dict.fromkeys(texts) if t not in _doc_token_cache]
+    if missing:
+        encoded = tokenizer(missing, add_special_tokens=False, truncation=True, max_length=MAX_LENGTH)
+        _doc_token_cache.update(zip(missing, encoded['input_ids']))
+    return [_doc_token_cache[t] for t in texts]
+
+
+def encode_pairs(tokenizer, query, texts):
+    """
+    Unpadded (query, chunk) pair encodings built from token ids; only the
+    query is tokenized per request. Chunks are cut to the room left after
+    the query and special tokens, which matches tokenizer(pairs,
+    truncation=True) for any query shorter than half of MAX_LENGTH and keeps
+    prepare_for_model from logging its overflowing-tokens warning per chunk.
+    """
+    if not hasattr(tokenizer, 'prepare_for_model'):
+        # transformers 5 dropped prepare_for_model: tokenize the pairs directly
+        return tokenizer([[query, text] for text in texts], truncation=True, max_length=MAX_LENGTH)
+
+    query_ids = tokenizer(query, add_special_tokens=False, truncation=True, max_length=MAX_LENGTH)['input_ids']
+    doc_budget = max(MAX_LENGTH - tokenizer.num_special_tokens_to_add(pair=True) - len(query_ids), 0)
+    items = [
+        # longest_first only kicks in for queries too long to leave any room
+        tokenizer.prepare_for_model(query_ids, ids[:doc_budget], truncation='longest_first', max_length=MAX_LENGTH)
+        for ids in doc_token_ids(tokenizer, texts)
+    ]
+    return {key: [item[key] for item in items] for key in items[0]}
+
+
+def score(tokenizer, model, device, query, texts):
+    """
+    Score each chunk text's relevance to the query.
+
+    Pairs are run in length-sorted sub-batches (smart batching), so each
+    batch is padded only to its own longest pair instead of the longest
+    pair overall.
+    """
+    if not texts:
+        return []
+
+    # Encode once without padding to get each pair's true length
+    features = encode_pairs(tokenizer, query, texts)
+    order = np.argsort([len(ids) for ids in features['input_ids']], kind='stable')
+
+    scores = np.empty(len(texts), dtype=np.float32)
+    for start in range(0, len(order), RERANKER_BATCH_SIZE):
+        batch = order[start:start + RERANKER_BATCH_SIZE]
+        inputs = tokenizer.pad(
+            {key: [values[i] for i in batch] for key, values in features.items()},
+            return_tensors='pt'
         )
         inputs = {key: val.to(device) for key, val in inputs.items()}
-        
-        with torch.no_grad():
+
+        # inference_mode also skips autograd's version-counter bookkeeping
+        with torch.inference_mode():
             logits = model(**inputs).logits
-            
+
         if logits.size(-1) == 2:
-            scores = logits[:, 1]
+            batch_scores = logits[:, 1]
         else:
-            scores = logits.view(-1)
-            
-        scores = scores.cpu().numpy().tolist()
-        
-        # Output result (this is the only JSON that needs to be printed to stdout)
-        print(json.dumps({"scores": scores}))
-        
+            batch_scores = logits.view(-1)
+
+        # Write back in the original pair order
+        scores[batch] = batch_scores.float().cpu().numpy()
+
+    return scores.tolist()
+
+
+def main():
+    """
+    Serve rerank requests until stdin closes.
+
+    Each request is one JSON line, either {"query": ..., "ids": [...]} with
+    FAISS indices into the corpus at EMBEDDING_DIR, or {"query": ...,
+    "chunks": [{"text": ...}]}, and gets one JSON line back, {"scores": [...]}
+    or {"error": ...}. The model and corpus are loaded once at startup, so
+    only the first request pays for them.
+    """
+    # Responses are the only thing allowed on stdout; anything else
+    # (library banners, HF login messages) goes to stderr
+    out = sys.stdout
+    sys.stdout = sys.stderr
+
+    try:
+        tokenizer, model, device = load_model()
     except Exception as e:
-        # Error also print to stdout, so the main program can catch it
-        print(json.dumps({"error": str(e)}))
+        out.write(json.dumps({"error": f"Could not load reranker: {e}"}) + "\n")
+        out.flush()
         sys.exit(1)
 
+    chunk_texts = None
+    embedding_dir = os.getenv("EMBEDDING_DIR")
+    if embedding_dir:
+        try:
+            chunk_texts = load_chunk_texts(embedding_dir)
+            print(f"✅ Loaded {len(chunk_texts)} chunk texts from {embedding_dir}", file=sys.stderr)
+        except Exception as e:
+            # "ids" requests then fail and the backend falls back to dense order
+            print(f"⚠️  Could not load chunk texts ({e}); only \"chunks\" requests will work", file=sys.stderr)
+
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break  # parent closed the pipe (backend shut down)
+        if not line.strip():
+            continue
+
+        try:
+            input_data = _loads(line)
+            if 'ids' in input_data:
+                if chunk_texts is None:
+                    raise RuntimeError("no corpus loaded (EMBEDDING_DIR unset or unreadable)")
+                texts = [chunk_texts[i] for i in input_data['ids']]
+            else:
+                texts = [chunk['text'] for chunk in input_data['chunks']]
+            result = {"scores": score(tokenizer, model, device, input_data['query'], texts)}
+        except Exception as e:
+            # Errors are reported per request; the worker keeps serving
+            result = {"error": str(e)}
+
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -122,5 +122,10 @@ if str(BACKEND_DIR) not in sys.path:
 os.chdir(FRONTEND_DIR)
 print(f"🚀 [System] Launching App...")
 
-with open("app.py", encoding="utf-8") as f:
-    exec(f.read())
\ No newline at end of file
+# Load app.py as a real module instead of exec()-ing its source text, so the
+# compiled bytecode is cached in __pycache__ and not re-parsed on every run
+import importlib.util
+
+_spec = importlib.util.spec_from_file_location("frontend_app", FRONTEND_DIR / "app.py")
+_app_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_app_module)